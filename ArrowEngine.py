@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Rule-major (vectorized) evaluation of simple rules using Arrow.
+
+Normally, every rule is applied to every unique entry in Python.
+In Arrow mode, the cleaned up msgstr & the msgid of all unique entries
+of a language are first loaded into two Arrow string arrays. The rules
+with vector checks (see Rule.vector_checks()) are checked using compute
+kernels (match_substring_regex, match_substring) over the whole columns.
+The resulting masks determine which of these rules can hit which entries
+(see RuleEngine.RuleMatches), so the RuleEvaluator only applies them to the
+matching entries in order to extract the hits. All other rules use the normal path.
+
+Regex checks only use regexes the rules have compiled with RE2 (which Arrow
+uses as well), so they have the same semantics as the rules.
+Case-insensitive substring checks may match more entries than the rule,
+but never less.
+
+Requires pyarrow (only imported in Arrow mode).
+"""
+import time
+from ansicolor import black, red
+from Rules import cleanupTranslatedString
+from RuleEngine import RuleMatches, read_translated_entries
+
+# str.lower() maps this character to two characters, which the
+# Arrow kernels don't do. Entries containing it always match.
+_multiCharLower = "İ"
+
+class _Columns(object):
+    """The msgstr & msgid arrays plus derived arrays (computed on demand)"""
+    def __init__(self, msgstrs, msgids):
+        import pyarrow as pa
+        self.arrays = {"msgstr": pa.array(msgstrs, pa.large_string()),
+                       "msgid": pa.array(msgids, pa.large_string())}
+        self._multiCharLower = {}
+
+    def __len__(self):
+        return len(self.arrays["msgstr"])
+
+    def multi_char_lower(self, field):
+        """Mask of the entries whose str.lower() is longer than the string"""
+        import pyarrow.compute as pc
+        if field not in self._multiCharLower:
+            self._multiCharLower[field] = pc.match_substring(self.arrays[field], _multiCharLower)
+        return self._multiCharLower[field]
+
+    def mask(self, check):
+        """Compute the boolean mask for a check of Rule.vector_checks()"""
+        import pyarrow.compute as pc
+        field, kind, pattern, negate = check
+        array = self.arrays[field]
+        if kind == "regex":
+            mask = pc.match_substring_regex(array, pattern)
+        elif kind == "substring":
+            mask = pc.match_substring(array, pattern)
+        elif kind == "isubstring":
+            mask = pc.or_(pc.match_substring(array, pattern, ignore_case=True),
+                          self.multi_char_lower(field))
+        else:
+            raise ValueError("Unknown check kind: {}".format(kind))
+        return pc.invert(mask) if negate else mask
+
+def compute_vector_matches(evaluator, files, corpus=None):
+    """
+    Run the vector checks of the content rules of a RuleEvaluator
+    over the unique entries of the given (filename, relpath) list.
+    Returns the RuleMatches of the vectorized rules.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    startTime = time.time()
+    checks = {}
+    for ruleIdx, rule in enumerate(evaluator.contentRules):
+        ruleChecks = rule.vector_checks()
+        if ruleChecks:
+            checks[ruleIdx] = ruleChecks
+    # Load the unique entries into columns
+    keys, msgstrs, msgids = [], [], []
+    seen = set()
+    for filename, relpath in files:
+        for entry in read_translated_entries(filename, relpath, corpus):
+            key = evaluator.entry_key(entry)
+            if key in seen:
+                continue
+            seen.add(key)
+            keys.append(key)
+            msgstrs.append(cleanupTranslatedString(entry.translated))
+            msgids.append(entry.english)
+    del seen
+    columns = _Columns(msgstrs, msgids)
+    del msgstrs, msgids
+    # Rule-major evaluation
+    matches = {}
+    vectorized = []
+    numMatches = 0
+    for ruleIdx, ruleChecks in checks.items():
+        try:
+            mask = None
+            for check in ruleChecks:
+                checkMask = columns.mask(check)
+                mask = checkMask if mask is None else pc.and_(mask, checkMask)
+        except pa.ArrowInvalid as ex: # e.g. a regex Arrow's RE2 rejects
+            print(red("Can't vectorize rule {}: {}".format(evaluator.contentRules[ruleIdx].name, ex)))
+            continue
+        vectorized.append(ruleIdx)
+        for row in pc.indices_nonzero(mask).to_pylist():
+            matches[keys[row]] = matches.get(keys[row], ()) + (ruleIdx,)
+            numMatches += 1
+    print(black("Checked {} of {} rules over {} unique strings using Arrow in {:.1f} s ({} matching rows)".format(
+        len(vectorized), len(evaluator.contentRules), len(columns), time.time() - startTime, numMatches), bold=True))
+    return RuleMatches(vectorized, matches)
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for performance-relevant parts of KATC.
+
+Usage: ./Benchmarks.py -l de <benchmark>
+"""
+import concurrent.futures
+import os
+import shutil
+import tempfile
+import time
+from ansicolor import black, red
+from CacheStorage import open_cache_file, stored_filename, strip_compression_suffix, list_cache_files
+from XLIFFReader import iterate_xliff_entries, stream_xliff_entries, parsedXLIFFCache
+
+def drop_from_page_cache(filename):
+    """
+    Evict a file from the OS page cache so the next read is a cold read.
+    Does not require root privileges (in contrast to drop_caches).
+    """
+    with open(filename, "rb") as infile:
+        os.posix_fadvise(infile.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+def evaluate_files(rules, directory, filenames, num_threads):
+    """
+    Apply the rules to the files in directory like the renderer does
+    (without rendering the output). Returns the number of hits.
+    """
+    from RuleEngine import RuleEvaluator, evaluate_file
+    # A new evaluator does not know any string yet
+    evaluator = RuleEvaluator(rules)
+    def evaluate(filename):
+        relpath = os.path.relpath(strip_compression_suffix(filename), directory)
+        return evaluate_file(evaluator, filename, relpath)
+    with concurrent.futures.ThreadPoolExecutor(num_threads) as executor:
+        return sum(len(result[1]) for result in executor.map(evaluate, filenames)
+                   if result is not None)
+
+def benchmark_storage(args):
+    """
+    Compare the cold-cache read & parse time (the storage-dependent part of
+    a render) and the cold-cache render time for raw, gzip and zstd storage
+    of cache/<lang>. Neither the OS page cache nor the parsed XLIFF cache
+    contain the files for the cold runs.
+    """
+    from Rules import importRulesForLanguage
+    rules, _ = importRulesForLanguage(args.language)
+    rules = sorted(rules, reverse=True)
+    langdir = os.path.join("cache", args.language)
+    srcfiles = sorted(list_cache_files(langdir, ".xliff"))
+    if args.limit:
+        srcfiles = srcfiles[:args.limit]
+    print(black("Benchmarking storage using {} files from {}".format(len(srcfiles), langdir), bold=True))
+    with tempfile.TemporaryDirectory(dir="cache") as tmpdir:
+        # Create a copy of all files in every storage variant
+        variants = {}
+        for compression in [None, "gzip", "zstd"]:
+            name = compression or "raw"
+            variants[name] = []
+            for srcfile in srcfiles:
+                relpath = os.path.relpath(strip_compression_suffix(srcfile), langdir)
+                dstfile = stored_filename(os.path.join(tmpdir, name, relpath), compression)
+                os.makedirs(os.path.dirname(dstfile), exist_ok=True)
+                with open_cache_file(srcfile) as infile, open_cache_file(dstfile, "wb") as outfile:
+                    shutil.copyfileobj(infile, outfile)
+                variants[name].append(dstfile)
+        # Dirty pages can't be evicted
+        os.sync()
+        parsedDirectory = parsedXLIFFCache.directory
+        try:
+            for name, filenames in variants.items():
+                for filename in filenames:
+                    drop_from_page_cache(filename)
+                size = sum(os.path.getsize(filename) for filename in filenames)
+                start = time.perf_counter()
+                num_entries = sum(1 for filename in filenames
+                                  for _ in iterate_xliff_entries(filename))
+                parseDuration = time.perf_counter() - start
+                # Render with an empty parsed XLIFF cache
+                parsedXLIFFCache.directory = os.path.join(tmpdir, "parsed-" + name)
+                for filename in filenames:
+                    drop_from_page_cache(filename)
+                start = time.perf_counter()
+                num_hits = evaluate_files(rules, os.path.join(tmpdir, name), filenames, args.num_threads)
+                renderDuration = time.perf_counter() - start
+                print("{:>5}: {:8.1f} MiB, {} entries, {} hits, {:.2f} s cold read & parse, {:.2f} s cold render".format(
+                    name, size / (1024 * 1024), num_entries, num_hits, parseDuration, renderDuration))
+        finally:
+            parsedXLIFFCache.directory = parsedDirectory
+
+def read_unique_entries(args):
+    """Read the unique translated entries of cache/<lang> (like the renderer evaluates them)"""
+    srcfiles = sorted(list_cache_files(os.path.join("cache", args.language), ".xliff"))
+    if args.limit:
+        srcfiles = srcfiles[:args.limit]
+    entries = {}
+    for filename in srcfiles:
+        for entry in stream_xliff_entries(filename, ignore_untranslated=True):
+            entries.setdefault((entry.english, entry.translated, str(entry.note or "")), entry)
+    print(black("Read {} unique entries from {} files".format(len(entries), len(srcfiles)), bold=True))
+    return list(entries.values())
+
+def benchmark_regexset(args):
+    """
+    Compare applying every RE2 regex rule to every entry with applying
+    only the rules the combined RE2 set (see RegexSet) matched.
+    """
+    from Rules import importRulesForLanguage, cleanupTranslatedString
+    from RegexSet import RuleRegexSet
+    rules, _ = importRulesForLanguage(args.language)
+    rules = [rule.split_filename_gates()[1] for rule in rules]
+    regexSet = RuleRegexSet([rule.set_patterns() for rule in rules])
+    setRuleIdxs = sorted(set(range(len(rules))) - regexSet.unconditional)
+    setRules = [rules[ruleIdx] for ruleIdx in setRuleIdxs]
+    if not setRules:
+        print(red("No rules in the RE2 set (is google-re2 installed?)", bold=True))
+        return
+    print(black("{} of {} rules are in the RE2 set".format(len(setRules), len(rules)), bold=True))
+    texts = [(cleanupTranslatedString(entry.translated), entry.english, str(entry.note or ""))
+             for entry in read_unique_entries(args)]
+    # Current approach: Every rule searches every entry
+    start = time.perf_counter()
+    perRuleHits = [[list(rule(msgstr, msgid, tcomment)) for rule in setRules]
+                   for msgstr, msgid, tcomment in texts]
+    perRuleDuration = time.perf_counter() - start
+    # RE2 set: Only the rules whose patterns matched are applied
+    start = time.perf_counter()
+    setHits = []
+    for msgstr, msgid, tcomment in texts:
+        candidates = regexSet.candidates(msgstr, msgid)
+        setHits.append([list(rule(msgstr, msgid, tcomment)) if ruleIdx in candidates else []
+                        for ruleIdx, rule in zip(setRuleIdxs, setRules)])
+    setDuration = time.perf_counter() - start
+    numHits = sum(len(ruleHits) for entryHits in perRuleHits for ruleHits in entryHits)
+    print("Per rule: {:.2f} s, RE2 set: {:.2f} s ({:.1f}x), {} hits{}".format(
+        perRuleDuration, setDuration, perRuleDuration / setDuration, numHits,
+        "" if perRuleHits == setHits else red(" (hits differ!)", bold=True)))
+
+def benchmark_prepare(args):
+    """
+    Compare the number of regex calls per entry when every rule prepares the
+    entry itself (apply_to_xliff_entry) with preparing every entry once (PreparedEntry).
+    """
+    # Must be set before Rules is imported
+    os.environ["KATC_COUNT_REGEX_CALLS"] = "1"
+    from Rules import importRulesForLanguage, reCompiler, PreparedEntry
+    if not reCompiler.count_calls:
+        print(red("Rules has been imported before enabling the regex call counter", bold=True))
+        return
+    rules, _ = importRulesForLanguage(args.language)
+    rules = [rule.split_filename_gates()[1] for rule in rules]
+    entries = read_unique_entries(args)
+    # Every rule cleans up the msgstr & extracts the images itself
+    reCompiler.calls.clear()
+    start = time.perf_counter()
+    perRuleHits = [[list(rule.apply_to_xliff_entry(entry, None)) for rule in rules] for entry in entries]
+    perRuleDuration = time.perf_counter() - start
+    perRuleCalls = dict(reCompiler.calls)
+    # Prepare every entry once
+    reCompiler.calls.clear()
+    start = time.perf_counter()
+    preparedHits = []
+    for entry in entries:
+        prepared = PreparedEntry(entry)
+        preparedHits.append([list(rule.apply_to_prepared_entry(prepared, None)) for rule in rules])
+    preparedDuration = time.perf_counter() - start
+    preparedCalls = dict(reCompiler.calls)
+    for name, calls, duration in [("Per rule", perRuleCalls, perRuleDuration),
+                                  ("Prepared", preparedCalls, preparedDuration)]:
+        print("{}: {:.1f} regex calls per entry ({} RE2, {} re), {:.2f} s".format(
+            name, sum(calls.values()) / len(entries), calls.get("re2", 0), calls.get("re", 0), duration))
+    same = [[[hit[1:] for hit in ruleHits] for ruleHits in entryHits] for entryHits in perRuleHits] == \
+           [[[hit[1:] for hit in ruleHits] for ruleHits in entryHits] for entryHits in preparedHits]
+    if not same:
+        print(red("Hits differ!", bold=True))
+
+def benchmark_textlist(args):
+    """
+    Compare matching a word list (default: the Wikipedia typo list of
+    TextListRule) as one large regex alternation with a WordListMatcher.
+    """
+    import re
+    from Rules import reCompiler, cleanupTranslatedString
+    from StringMatcher import WordListMatcher
+    filename = args.file or os.path.join("cache", "de-typos.txt")
+    if not os.path.isfile(filename):
+        print(red("Unable to find text list file {}".format(filename), bold=True))
+        return
+    with open(filename) as infile:
+        terms = sorted({line.strip() for line in infile} - {""})
+    print(black("{} terms in {}".format(len(terms), filename), bold=True))
+    texts = [cleanupTranslatedString(entry.translated) for entry in read_unique_entries(args)]
+    # Same regex as TextListRule used to build
+    regex = "|".join(r"\b{0}\b".format(term.replace(" ", r"\s+")) for term in terms)
+    builders = [("regex", lambda: reCompiler.compile(regex)),
+                ("re", lambda: re.compile(regex)),
+                # Same semantics as "regex" (as used by TextListRule) & "re"
+                ("WordListMatcher", lambda: WordListMatcher(terms, compiler=reCompiler)),
+                ("WordListMatcher (re)", lambda: WordListMatcher(terms))]
+    reference = None
+    for name, builder in builders:
+        start = time.perf_counter()
+        matcher = builder()
+        buildDuration = time.perf_counter() - start
+        if name == "regex":
+            name = "RE2" if reCompiler.is_re2(matcher) else "re (fallback)"
+        start = time.perf_counter()
+        hits = [sorted(hit[0] if isinstance(hit, tuple) else hit for hit in matcher.findall(text))
+                for text in texts]
+        duration = time.perf_counter() - start
+        if reference is None:
+            reference = hits
+        numDiffering = sum(1 for textHits, referenceHits in zip(hits, reference)
+                           if textHits != referenceHits)
+        print("{:>20}: build {:.2f} s, match {:.2f} s, {} hits{}".format(
+            name, buildDuration, duration, sum(len(textHits) for textHits in hits),
+            red(" ({} texts differ)".format(numDiffering), bold=True) if numDiffering else ""))
+
+def benchmark_plans(args):
+    """
+    Compare applying the wrapped rules as nested generators with
+    applying their flattened RulePlans (see RulePlan).
+    """
+    from Rules import importRulesForLanguage, PreparedEntry
+    from RulePlan import RulePlan
+    rules, _ = importRulesForLanguage(args.language)
+    rules = [rule.split_filename_gates()[1] for rule in rules]
+    plans = [plan for plan in (RulePlan(rule) for rule in rules) if not plan.flat]
+    print(black("{} of {} rules have wrappers to flatten".format(len(plans), len(rules)), bold=True))
+    entries = [PreparedEntry(entry) for entry in read_unique_entries(args)]
+    start = time.perf_counter()
+    nestedHits = [[list(plan.rule(prepared.translated, prepared.english, prepared.note)) for plan in plans]
+                  for prepared in entries]
+    nestedDuration = time.perf_counter() - start
+    start = time.perf_counter()
+    planHits = [[plan.evaluate(prepared.translated, prepared.english, prepared.note) for plan in plans]
+                for prepared in entries]
+    planDuration = time.perf_counter() - start
+    print("Nested: {:.2f} s, flattened: {:.2f} s ({:.1f}x), {} hits{}".format(
+        nestedDuration, planDuration, nestedDuration / planDuration,
+        sum(len(ruleHits) for entryHits in nestedHits for ruleHits in entryHits),
+        "" if nestedHits == planHits else red(" (hits differ!)", bold=True)))
+
+benchmarks = {
+    "storage": benchmark_storage,
+    "regexset": benchmark_regexset,
+    "prepare": benchmark_prepare,
+    "textlist": benchmark_textlist,
+    "plans": benchmark_plans,
+}
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-l', '--language', default="de", help='The language directory to use (e.g. de, es)')
+    parser.add_argument('-n', '--limit', type=int, default=0, help='Only use the first N files (0 => all)')
+    parser.add_argument('-j', '--num-threads', type=int, default=2, help='Number of threads for the storage benchmark render')
+    parser.add_argument('-f', '--file', help='The word list for the textlist benchmark (default: cache/de-typos.txt)')
+    parser.add_argument('benchmark', choices=sorted(benchmarks.keys()), help='The benchmark to run')
+    args = parser.parse_args()
+    benchmarks[args.benchmark](args)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Transparent storage for the files in the cache/ download tree.
+
+Files may be stored raw or compressed (gzip or zstd). The compression
+is identified by the filename suffix, e.g. foo.xliff.gz.
+Readers open the files as (decompressing) binary streams, nothing is
+decompressed to disk.
+
+Instead of a directory tree (e.g. cache/de), a language can also be
+stored as a single packed archive (cache/de.pack). The pack is an
+uncompressed ZIP file whose member table maps the path inside the
+language directory to the (possibly compressed) file data.
+Files inside the pack are addressed by the same paths as if the
+directory existed, e.g. cache/de/1_high_priority_platform/foo.xliff
+"""
+import calendar
+import gzip
+import hashlib
+import os
+import threading
+import zipfile
+import zlib
+
+compressionSuffixes = {
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+
+def strip_compression_suffix(filename):
+    """Get the filename without the compression suffix, e.g. foo.xliff.gz => foo.xliff"""
+    for suffix in compressionSuffixes.values():
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
+
+def stored_filename(filename, compression=None):
+    """Get the filename a file is stored as for the given compression (None => raw)"""
+    if compression is None:
+        return filename
+    return filename + compressionSuffixes[compression]
+
+def has_extension(filename, *extensions):
+    """Check if the given (possibly compressed) file has one of the given extensions"""
+    return strip_compression_suffix(filename).endswith(extensions)
+
+def compress_bytes(data, compression=None):
+    """Compress in-memory data like open_cache_file() would"""
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    elif compression == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return data
+
+def compress_chunks(chunks, compression=None):
+    """
+    Compress an iterable of byte chunks like compress_bytes(),
+    without joining the uncompressed chunks first.
+    """
+    if compression == "gzip":
+        # wbits=31 => gzip container
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    elif compression == "zstd":
+        import zstandard
+        compressor = zstandard.ZstdCompressor(level=10).compressobj()
+    else:
+        return b"".join(chunks)
+    return b"".join([compressor.compress(chunk) for chunk in chunks] + [compressor.flush()])
+
+def _wrap_stream(filename, stream, mode="rb"):
+    """Wrap a raw binary stream in a (de)compressor depending on the filename"""
+    if filename.endswith(compressionSuffixes["gzip"]):
+        # Level 6 is a good tradeoff for the highly repetitive XML
+        gz = gzip.GzipFile(fileobj=stream, mode=mode, compresslevel=6)
+        # Close the underlying stream when closing the GzipFile
+        gz.myfileobj = stream
+        return gz
+    elif filename.endswith(compressionSuffixes["zstd"]):
+        import zstandard
+        if mode == "rb":
+            return zstandard.ZstdDecompressor().stream_reader(stream, closefd=True)
+        else:
+            return zstandard.ZstdCompressor(level=10).stream_writer(stream, closefd=True)
+    return stream
+
+def open_cache_file(filename, mode="rb"):
+    """
+    Open a file in the cache directory as binary stream.
+    Compressed files are decompressed (or compressed if writing) on the fly.
+    Files inside a pack are read from the pack.
+    mode is either "rb" or "wb" (writing is not supported for packs).
+    """
+    if mode == "rb":
+        member = _find_pack_member(filename)
+        if member is not None:
+            pack, name = member
+            # The member name has the compression suffix, even if filename doesn't
+            return _wrap_stream(name, pack.open(name))
+    try:
+        return _wrap_stream(filename, open(filename, mode), mode)
+    except FileNotFoundError:
+        # Maybe in a pack this process does not know yet
+        if mode == "rb" and _find_pack_member(filename, discover=True) is not None:
+            return open_cache_file(filename, mode)
+        raise
+
+def stat_cache_file(filename):
+    """
+    Get the (size, mtime in ns) of a stored (possibly packed) file
+    """
+    member = _find_pack_member(filename)
+    if member is None and not os.path.exists(filename):
+        member = _find_pack_member(filename, discover=True)
+    if member is not None:
+        pack, name = member
+        info = pack.getinfo(name)
+        return info.file_size, calendar.timegm(info.date_time) * 10**9
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+def hash_cache_file(filename):
+    """
+    Get a digest of the stored content of a (possibly packed) file.
+    For packed files, this is the CRC32 from the pack's member table,
+    so no data needs to be read.
+    """
+    member = _find_pack_member(filename)
+    if member is not None:
+        pack, name = member
+        return pack.getinfo(name).CRC.to_bytes(4, "little")
+    sha = hashlib.sha1()
+    with open(filename, "rb") as infile:
+        for block in iter(lambda: infile.read(1 << 20), b""):
+            sha.update(block)
+    return sha.digest()
+
+def pack_filename(directory):
+    """Get the filename of the pack for the given directory, e.g. cache/de => cache/de.pack"""
+    return os.path.normpath(directory) + ".pack"
+
+class CachePack(object):
+    """
+    Read access to a pack. Members are indexed by their path inside the
+    packed directory, with and without compression suffix.
+    """
+    def __init__(self, directory):
+        self.directory = os.path.normpath(directory)
+        self.filename = pack_filename(directory)
+        self._zip = zipfile.ZipFile(self.filename, "r")
+        self.members = self._zip.namelist()
+        # Uncompressed path => member name
+        self._index = {strip_compression_suffix(name): name for name in self.members}
+        self.pid = os.getpid()
+
+    def find(self, relpath):
+        """Find the member name for a path relative to the packed directory or None"""
+        if relpath in self._index:
+            return self._index[relpath]
+        return relpath if relpath in self.members else None
+
+    def getinfo(self, name):
+        return self._zip.getinfo(name)
+
+    def open(self, name):
+        return self._zip.open(name)
+
+    def filenames(self):
+        """Iterate the virtual filenames of all members"""
+        for name in self.members:
+            yield os.path.join(self.directory, name)
+
+# Directory => CachePack (or None if there is no pack)
+_packs = {}
+_packsLock = threading.Lock()
+
+def get_pack(directory):
+    """
+    Get the CachePack for a directory or None if there is no pack.
+    Packs are opened only once per process.
+    """
+    directory = os.path.normpath(directory)
+    pack = _packs.get(directory)
+    # Forked processes must not share the file offset with their parent
+    if pack is not None and pack.pid != os.getpid():
+        pack = None
+    if pack is None and (directory not in _packs or _packs[directory] is not None):
+        with _packsLock:
+            pack = CachePack(directory) if os.path.isfile(pack_filename(directory)) else None
+            _packs[directory] = pack
+    return pack
+
+def _find_pack_member(filename, discover=False):
+    """
+    Find the (CachePack, member name) for the given filename or None if
+    the file is not packed. Unless discover is set, only packs already
+    known to this process are considered, so this does not cost any syscalls.
+    """
+    directory = os.path.dirname(os.path.normpath(filename))
+    # Stop after the first component of relative paths and before the root of absolute ones
+    while directory and os.path.dirname(directory) != directory:
+        pack = get_pack(directory) if discover else _packs.get(directory)
+        if pack is not None:
+            if pack.pid != os.getpid():
+                pack = get_pack(directory)
+            name = pack.find(os.path.relpath(filename, directory))
+            if name is not None:
+                return pack, name
+        directory = os.path.dirname(directory)
+    return None
+
+def list_cache_files(directory, *extensions):
+    """
+    List the (virtual) filenames of all files in the given cache directory
+    which have one of the given extensions (ignoring compression suffixes).
+    If there is a pack for the directory, it is used instead of walking the directory.
+    """
+    pack = get_pack(directory)
+    if pack is not None:
+        return [filename for filename in pack.filenames() if has_extension(filename, *extensions)]
+    return [os.path.join(curdir, f)
+            for (curdir, _, files) in os.walk(directory)
+            for f in files if has_extension(f, *extensions)]
+
+class CachePackWriter(object):
+    """
+    Writes a new pack for a directory. Members are added with their path
+    relative to the packed directory (including any compression suffix).
+
+    On close(), members of the previous pack which have not been written
+    are copied over, so partial (filtered) updates are possible.
+    The pack is replaced atomically.
+    """
+    def __init__(self, directory):
+        self.directory = os.path.normpath(directory)
+        self.filename = pack_filename(directory)
+        self._tmpname = self.filename + ".tmp"
+        self._zip = zipfile.ZipFile(self._tmpname, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+        self._written = set()
+
+    def add(self, relpath, data):
+        self._zip.writestr(relpath, data)
+        self._written.add(strip_compression_suffix(relpath))
+
+    def close(self):
+        if os.path.isfile(self.filename):
+            with zipfile.ZipFile(self.filename, "r") as oldzip:
+                for info in oldzip.infolist():
+                    if strip_compression_suffix(info.filename) not in self._written:
+                        self._zip.writestr(info, oldzip.read(info))
+        self._zip.close()
+        os.replace(self._tmpname, self.filename)
+        # Reopen on next access
+        with _packsLock:
+            _packs.pop(self.directory, None)
+
+def remove_other_variants(filename, compression=None):
+    """
+    Remove all stored variants of filename (uncompressed filename)
+    except the one for the given compression.
+    This avoids having the same file twice in the cache directory.
+    """
+    keep = stored_filename(filename, compression)
+    for variant in [filename] + [filename + suffix for suffix in compressionSuffixes.values()]:
+        if variant != keep and os.path.isfile(variant):
+            os.remove(variant)
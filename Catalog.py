@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Catalogue of the downloaded files of a language.
+
+The catalogue is written by update-translations and contains one
+record per file (Crowdin ID, path, sizes, mtime of the stored file,
+content hash, unit counts and download timestamp). This allows planning
+work without parsing any file.
+"""
+import datetime
+import hashlib
+import os
+import simplejson as json
+from ansicolor import black, red
+from lxml import etree
+from CacheStorage import has_extension, stat_cache_file, strip_compression_suffix
+
+def catalog_filename(lang):
+    return os.path.join("cache", "catalog-{}.json".format(lang))
+
+class XLIFFUnitCounter(object):
+    """
+    Incrementally counts the (total, untranslated, approved) trans-units
+    of XLIFF data which is fed chunk by chunk.
+    Only attributes are evaluated, no text is extracted.
+    """
+    def __init__(self):
+        self.total = self.untranslated = self.approved = 0
+        self._parser = etree.XMLPullParser(events=("end",), tag=("{*}trans-unit", "{*}target"), huge_tree=True)
+
+    def _process_events(self):
+        for _, elem in self._parser.read_events():
+            if etree.QName(elem).localname == "target":
+                if elem.get("state") == "needs-translation":
+                    self.untranslated += 1
+                continue
+            self.total += 1
+            if elem.get("approved") == "yes":
+                self.approved += 1
+            # Free already processed units
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+    def feed(self, data):
+        """Raises lxml.etree.XMLSyntaxError for invalid data"""
+        self._parser.feed(data)
+        self._process_events()
+
+    def close(self):
+        """Get the (total, untranslated, approved) counts"""
+        self._parser.close()
+        self._process_events()
+        return self.total, self.untranslated, self.approved
+
+def count_xliff_units(stream):
+    """Count the (total, untranslated, approved) trans-units in a XLIFF stream"""
+    counter = XLIFFUnitCounter()
+    for block in iter(lambda: stream.read(1 << 20), b""):
+        counter.feed(block)
+    return counter.close()
+
+class CatalogRecordBuilder(object):
+    """
+    Creates the catalogue record for a file while it is being downloaded.
+    The (uncompressed) content is passed to update() chunk by chunk,
+    so it never needs to be held in memory.
+    path is the path inside the language directory (without compression suffix).
+    """
+    def __init__(self, fileid, path):
+        self.fileid = fileid
+        self.path = path
+        self.size = 0
+        self._sha1 = hashlib.sha1()
+        self._counter = XLIFFUnitCounter() if has_extension(path, ".xliff") else None
+
+    def update(self, data):
+        self.size += len(data)
+        self._sha1.update(data)
+        if self._counter is not None:
+            try:
+                self._counter.feed(data)
+            except etree.XMLSyntaxError:
+                print(red("Can't count units of {}: Invalid XLIFF".format(self.path)))
+                self._counter = None
+
+    def record(self, stored_size, mtime):
+        """
+        Get the record once all data has been passed to update().
+        stored_size and mtime (ns) are the stat_cache_file() of the stored file.
+        """
+        counts = (None, None, None)
+        if self._counter is not None:
+            try:
+                counts = self._counter.close()
+            except etree.XMLSyntaxError:
+                print(red("Can't count units of {}: Invalid XLIFF".format(self.path)))
+        total, untranslated, approved = counts
+        return {
+            "id": self.fileid,
+            "path": self.path,
+            "size": self.size,
+            "stored_size": stored_size,
+            "mtime": mtime,
+            "sha1": self._sha1.hexdigest(),
+            "total": total,
+            "untranslated": untranslated,
+            "approved": approved,
+            "downloaded": datetime.datetime.now().strftime("%y-%m-%d %H:%M:%S")
+        }
+
+class FileCatalog(object):
+    """
+    The catalogue of a language: path => record.
+    Paths are relative to the language directory, i.e. the paths Crowdin uses.
+    """
+    def __init__(self, lang):
+        self.lang = lang
+        self.langdir = os.path.join("cache", lang)
+        self.filename = catalog_filename(lang)
+        if os.path.isfile(self.filename):
+            with open(self.filename) as infile:
+                self.records = json.load(infile)
+        else:
+            self.records = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def update(self, records):
+        """Add or replace the given records and save the catalogue"""
+        for record in records:
+            self.records[record["path"]] = record
+        with open(self.filename, "w") as outfile:
+            json.dump(self.records, outfile)
+
+    def lookup(self, filename):
+        """
+        Get the record for a (possibly compressed or packed) file in the
+        language directory. Returns None if there is no record or if the file
+        has been changed since the record was written (i.e. if its stored size
+        or mtime differs). Records without mtime (written by older versions)
+        are considered outdated.
+        """
+        relpath = os.path.relpath(strip_compression_suffix(filename), self.langdir)
+        record = self.records.get(relpath)
+        if record is None:
+            return None
+        try:
+            size, mtime = stat_cache_file(filename)
+        except (OSError, KeyError):
+            return None
+        if size != record["stored_size"] or mtime != record.get("mtime"):
+            return None
+        return record
+
+    def size(self, filename):
+        """The uncompressed size of a file (0 if unknown)"""
+        record = self.lookup(filename)
+        return 0 if record is None else record["size"]
+
+    def largest_first(self, filenames):
+        """Sort filenames so that the largest files come first. Unknown files come last"""
+        return sorted(filenames, key=self.size, reverse=True)
+
+    def is_fully_translated(self, filename):
+        """True if the catalogue knows the file has no untranslated units"""
+        record = self.lookup(filename)
+        return record is not None and record["untranslated"] == 0
+
+def performCatalog(args):
+    catalog = FileCatalog(args.language)
+    if not catalog.records:
+        print(red("No catalogue for {} - run update-translations first".format(args.language), bold=True))
+        return
+    records = list(catalog.records.values())
+    # Apply filter (same semantics as for the other commands)
+    for subfilt1 in (args.filter or []):
+        for subfilt2 in subfilt1: # argparse creates nested list
+            records = [record for record in records
+                       if subfilt2 in record["path"] or subfilt2 in record["path"].replace(".xliff", ".pot")]
+    if args.untranslated:
+        records = [record for record in records if record["untranslated"]]
+    records.sort(key=lambda record: record[args.sort] or 0, reverse=True)
+    # Print table
+    print(black("{:>10} {:>7} {:>7} {:>7}  {:<17}  {}".format(
+        "Size", "Total", "Untr.", "Appr.", "Downloaded", "Path"), bold=True))
+    for record in records[:args.limit] if args.limit else records:
+        print("{:>10} {:>7} {:>7} {:>7}  {:<17}  {}".format(
+            record["size"], record["total"] or 0, record["untranslated"] or 0,
+            record["approved"] or 0, record["downloaded"], record["path"]))
+    # Print totals
+    print(black("{} files, {} bytes, {} units, {} untranslated, {} approved".format(
+        len(records), sum(record["size"] for record in records),
+        sum(record["total"] or 0 for record in records),
+        sum(record["untranslated"] or 0 for record in records),
+        sum(record["approved"] or 0 for record in records)), bold=True))
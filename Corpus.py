@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Memory-mapped per-language corpus store.
+
+All entries of cache/<lang> are compacted into a single file which
+can be mapped into any number of worker processes. The OS page cache
+is shared between them, so workers don't need to parse XLIFF or
+receive pickled strings.
+
+File layout (all integers little endian):
+    Header      magic, version, #files, #entries, offsets of the sections
+    String heap UTF-8 encoded strings, identical strings are stored once
+    Entry table One fixed-size record per entry (see _entryStruct)
+    File table  JSON list of {"path", "start", "end"} (entry index range)
+                plus the stored filename relative to cache/<lang> and
+                the fingerprint (size, mtime) the file had when compacted
+"""
+import json
+import mmap
+import os
+import struct
+import tempfile
+from ansicolor import black, red
+from lxml import etree
+from XLIFFReader import XLIFFEntry, findXLIFFFiles, stream_xliff_entries
+from CacheStorage import strip_compression_suffix, stat_cache_file
+
+_magic = b"KATCCORP"
+_version = 2
+# magic, version, #files, #entries, entry table ofs, file table ofs, file table length
+_headerStruct = struct.Struct("<8sIIIQQQ")
+# file index, flags, (offset, length) for id, english, translated, note
+_entryStruct = struct.Struct("<IIQIQIQIQI")
+
+_flagUntranslated = 1
+_flagApproved = 2
+
+class CorpusNote(object):
+    """
+    A note (tcomment) in the string heap of a corpus which is only
+    decoded when it is converted using str().
+    key is the (offset, length) in the heap. As identical strings are
+    stored only once, equal keys mean equal notes.
+    """
+    __slots__ = ["key", "_corpus"]
+
+    def __init__(self, corpus, key):
+        self._corpus = corpus
+        self.key = key
+
+    def __str__(self):
+        return self._corpus._string(*self.key)
+
+    def __bool__(self):
+        return self.key[1] > 0
+
+def corpus_filename(lang):
+    return os.path.join("cache", "{}.corpus".format(lang))
+
+class CorpusWriter(object):
+    """
+    Writes a corpus file. Strings are appended to the heap as entries
+    are added. The entry records and a dict of every unique string
+    (to store identical strings once) are kept in memory.
+
+    The file is written to a temporary file which replaces the corpus
+    on close(). Use as context manager to delete it if an exception occurs:
+        with CorpusWriter(filename) as writer:
+            writer.add_file(path, entries)
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.directory = os.path.dirname(filename) or "."
+        os.makedirs(self.directory, exist_ok=True)
+        fd, self._tmpname = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        self._outfile = os.fdopen(fd, "w+b")
+        self._outfile.write(b"\0" * _headerStruct.size)
+        self._strings = {}  # str => (offset, length)
+        self._entries = bytearray()
+        self.num_entries = 0
+        self.files = []
+
+    def _add_string(self, s):
+        try:
+            return self._strings[s]
+        except KeyError:
+            encoded = s.encode("utf-8")
+            ref = (self._outfile.tell(), len(encoded))
+            self._outfile.write(encoded)
+            self._strings[s] = ref
+            return ref
+
+    def add_file(self, path, entries, filename=None, fingerprint=None):
+        """
+        Add the entries of a file with the given relative path.
+        filename (the stored filename relative to cache/<lang>) and
+        fingerprint (see stat_cache_file()) are used to detect outdated corpora.
+        """
+        fileidx = len(self.files)
+        start = self.num_entries
+        try:
+            for entry in entries:
+                flags = (_flagUntranslated if entry.is_untranslated else 0) | \
+                        (_flagApproved if entry.is_approved else 0)
+                self._entries += _entryStruct.pack(fileidx, flags,
+                    *self._add_string(entry.id),
+                    *self._add_string(entry.english),
+                    *self._add_string(entry.translated),
+                    *self._add_string(entry.note or ""))
+                self.num_entries += 1
+        except BaseException:
+            # e.g. a broken XLIFF file: Drop its entries (their strings stay in the heap)
+            del self._entries[start * _entryStruct.size:]
+            self.num_entries = start
+            raise
+        self.files.append({"path": path, "start": start, "end": self.num_entries,
+                           "filename": filename or path, "fingerprint": fingerprint})
+
+    @property
+    def num_strings(self):
+        return len(self._strings)
+
+    def close(self):
+        entriesOffset = self._outfile.tell()
+        self._outfile.write(self._entries)
+        filesOffset = self._outfile.tell()
+        filesJSON = json.dumps(self.files).encode("utf-8")
+        self._outfile.write(filesJSON)
+        # Fill in the header
+        self._outfile.seek(0)
+        self._outfile.write(_headerStruct.pack(_magic, _version,
+            len(self.files), self.num_entries,
+            entriesOffset, filesOffset, len(filesJSON)))
+        self._outfile.close()
+        os.replace(self._tmpname, self.filename)
+
+    def discard(self):
+        """Close & delete the temporary file instead of writing the corpus"""
+        if self._outfile.closed:
+            return
+        self._outfile.close()
+        os.remove(self._tmpname)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+class Corpus(object):
+    """
+    Read-only, memory-mapped view on a corpus file.
+    Strings are only decoded when an entry is accessed.
+
+    Pickling a Corpus only transfers the filename, the unpickled
+    instance maps the same file again.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as infile:
+            self._mm = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.num_files, self.num_entries, self._entriesOffset, \
+            filesOffset, filesLength = _headerStruct.unpack_from(self._mm, 0)
+        if magic != _magic or version != _version:
+            raise ValueError("{} is not a corpus file (version {})".format(filename, _version))
+        self.files = json.loads(self._mm[filesOffset:filesOffset + filesLength].decode("utf-8"))
+        self._fileIndex = {fileinfo["path"]: idx for idx, fileinfo in enumerate(self.files)}
+
+    def __getstate__(self):
+        return self.filename
+
+    def __setstate__(self, filename):
+        self.__init__(filename)
+
+    def __len__(self):
+        return self.num_entries
+
+    def _string(self, offset, length):
+        return self._mm[offset:offset + length].decode("utf-8")
+
+    def entry_file_index(self, idx):
+        """Get the index of the file in self.files the given entry belongs to"""
+        return _entryStruct.unpack_from(self._mm, self._entriesOffset + idx * _entryStruct.size)[0]
+
+    def entry(self, idx, lazy_notes=False):
+        """
+        Get the entry with the given index.
+        If lazy_notes is set, the note is a CorpusNote instead of a string.
+        """
+        if idx < 0 or idx >= self.num_entries:
+            raise IndexError(idx)
+        _, flags, idofs, idlen, englofs, engllen, translofs, transllen, noteofs, notelen = \
+            _entryStruct.unpack_from(self._mm, self._entriesOffset + idx * _entryStruct.size)
+        return XLIFFEntry(self._string(idofs, idlen),
+            self._string(englofs, engllen),
+            self._string(translofs, transllen),
+            bool(flags & _flagUntranslated),
+            bool(flags & _flagApproved),
+            CorpusNote(self, (noteofs, notelen)) if lazy_notes else self._string(noteofs, notelen))
+
+    def signature(self):
+        """Identifies the snapshot of the corpus (for indices built from it)"""
+        stat = os.stat(self.filename)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def entry_refs(self):
+        """
+        Yield (msgid reference, msgstr reference, is untranslated) for every entry.
+        References are the (offset, length) of the string in the heap, so
+        identical strings have the same reference. Use string() to decode.
+        """
+        for idx in range(self.num_entries):
+            record = _entryStruct.unpack_from(self._mm, self._entriesOffset + idx * _entryStruct.size)
+            yield record[4:6], record[6:8], bool(record[1] & _flagUntranslated)
+
+    def string(self, ref):
+        """Decode a string heap reference, see entry_refs()"""
+        return self._string(*ref)
+
+    def __getitem__(self, idx):
+        return self.entry(idx)
+
+    def stale_files(self, directory):
+        """
+        Get the paths of all files whose stored file in directory (cache/<lang>)
+        has been changed or removed since the corpus was compacted.
+        """
+        stale = []
+        for fileinfo in self.files:
+            try:
+                fingerprint = stat_cache_file(os.path.join(directory, fileinfo["filename"]))
+            except (OSError, KeyError):
+                fingerprint = None
+            if fileinfo["fingerprint"] is None or list(fingerprint or ()) != fileinfo["fingerprint"]:
+                stale.append(fileinfo["path"])
+        return stale
+
+    def __iter__(self):
+        for idx in range(self.num_entries):
+            yield self[idx]
+
+    def __contains__(self, path):
+        return path in self._fileIndex
+
+    def file_entries(self, path, ignore_untranslated=False, lazy_notes=False):
+        """
+        Get the entries of the file with the given relative path
+        (relative to cache/<lang>, i.e. the path Crowdin uses).
+        Raises KeyError if the file is not part of the corpus.
+        See entry() for lazy_notes.
+        """
+        fileinfo = self.files[self._fileIndex[path]]
+        for idx in range(fileinfo["start"], fileinfo["end"]):
+            flags = _entryStruct.unpack_from(self._mm, self._entriesOffset + idx * _entryStruct.size)[1]
+            if ignore_untranslated and flags & _flagUntranslated:
+                continue
+            yield self.entry(idx, lazy_notes)
+
+def open_corpus(lang, check=True):
+    """
+    Open the corpus for the given language or return None if it does not exist.
+    Unless check is disabled, outdated corpora (see Corpus.stale_files()) are
+    not used either, so the files are read instead of outdated strings.
+    """
+    filename = corpus_filename(lang)
+    if not os.path.isfile(filename):
+        return None
+    try:
+        corpus = Corpus(filename)
+    except ValueError as ex:
+        print(red("{} - run 'katc.py compact' again".format(ex), bold=True))
+        return None
+    if check:
+        stale = corpus.stale_files(os.path.join("cache", lang))
+        if stale:
+            print(red("The corpus for {} is outdated ({} file(s) changed since compacting, e.g. {}) - run 'katc.py compact' again".format(
+                lang, len(stale), stale[0]), bold=True))
+            return None
+    return corpus
+
+def build_corpus(lang, filt=None):
+    """
+    Compact all XLIFF files in cache/<lang> into the corpus file for lang.
+    Invalid XLIFF files are skipped (like when rendering).
+    """
+    langdir = os.path.join("cache", lang)
+    with CorpusWriter(corpus_filename(lang)) as writer:
+        for filename in sorted(findXLIFFFiles(langdir, filt=filt)):
+            relpath = os.path.relpath(strip_compression_suffix(filename), langdir)
+            fingerprint = stat_cache_file(filename)
+            try:
+                writer.add_file(relpath, stream_xliff_entries(filename),
+                                os.path.relpath(filename, langdir), fingerprint)
+            except etree.XMLSyntaxError as ex:
+                print(red("File {} is not valid XLIFF - Ignoring: {}".format(relpath, ex), bold=True))
+    return writer
+
+def performCompactCorpus(args):
+    print(black("Compacting cache/{} into {}...".format(args.language, corpus_filename(args.language)), bold=True))
+    writer = build_corpus(args.language, filt=args.filter)
+    print(black("Compacted {} entries from {} files ({} unique strings)".format(
+        writer.num_entries, len(writer.files), writer.num_strings), bold=True))
+    # The indices belong to the corpus snapshot
+    from WordIndex import build_word_index
+    from TrigramIndex import build_trigram_index
+    corpus = open_corpus(args.language, check=False)
+    index = build_word_index(args.language, corpus)
+    print(black("Indexed {} words of {} unique msgids".format(len(index.postings), len(index)), bold=True))
+    index = build_trigram_index(args.language, corpus)
+    print(black("Indexed {} trigrams of {} unique strings".format(len(index.table), len(index)), bold=True))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Columnar (Parquet) export of the rule hits of a render.
+
+One row per hit. The file is written in row groups while the render
+is running, so the hits are never collected in memory as a table.
+All languages share the same schema, so e.g. output/*/hits.parquet
+can be aggregated in a single scan:
+
+    import pyarrow.dataset as ds
+    table = ds.dataset(glob.glob("output/*/hits.parquet")).to_table()
+    table.group_by(["language", "severity"]).aggregate([("rule", "count")])
+
+Requires pyarrow (only imported when an export is requested).
+"""
+import os
+from ansicolor import black
+
+def hit_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("language", pa.string()),
+        ("file", pa.string()),
+        ("directory", pa.string()),
+        ("unit_id", pa.string()),
+        ("rule", pa.string()),
+        ("severity", pa.int8()),
+        ("hit", pa.string()),
+        ("timestamp", pa.timestamp("s")),
+    ])
+
+class ParquetHitWriter(object):
+    """
+    Writes hits to a Parquet file, one row group per add_file() call.
+    Columns with many repeating values are dictionary-encoded.
+    """
+    def __init__(self, filename, lang, timestamp):
+        import pyarrow.parquet as pq
+        self.filename = filename
+        self.lang = lang
+        self.timestamp = timestamp
+        self.num_hits = 0
+        self._tmpname = filename + ".tmp"
+        self._writer = pq.ParquetWriter(self._tmpname, hit_schema(), compression="zstd",
+            use_dictionary=["language", "file", "directory", "rule", "hit"])
+
+    def add_file(self, relpath, ruleHits, unit_id):
+        """
+        Add the hits of a single file as a row group.
+        ruleHits is a rule => hitlist map, unit_id maps a hit to the trans-unit ID.
+        """
+        import pyarrow as pa
+        rules, severities, hits, unitIds = [], [], [], []
+        for rule, ruleHitList in ruleHits.items():
+            for hit in ruleHitList:
+                rules.append(rule.machine_name)
+                severities.append(int(rule.severity))
+                hits.append(str(hit.hit))
+                unitIds.append(unit_id(hit))
+        if not hits:
+            return
+        num = len(hits)
+        table = pa.Table.from_arrays([
+            pa.array([self.lang] * num, pa.string()),
+            pa.array([relpath] * num, pa.string()),
+            pa.array([os.path.dirname(relpath)] * num, pa.string()),
+            pa.array(unitIds, pa.string()),
+            pa.array(rules, pa.string()),
+            pa.array(severities, pa.int8()),
+            pa.array(hits, pa.string()),
+            pa.array([self.timestamp] * num, pa.timestamp("s")),
+        ], schema=hit_schema())
+        self._writer.write_table(table)
+        self.num_hits += num
+
+    def close(self):
+        self._writer.close()
+        self._writer = None
+        os.replace(self._tmpname, self.filename)
+        print(black("Wrote {} hits to {}".format(self.num_hits, self.filename), bold=True))
+
+    def abort(self):
+        """Close the writer and delete the partial output (e.g. if the render failed)"""
+        if self._writer is None: # Already closed
+            return
+        try:
+            self._writer.close()
+        finally:
+            self._writer = None
+            os.remove(self._tmpname)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Literal prefilter for rules.
+
+Most rule regexes can only match if the text contains one of a few
+literal substrings, e.g. "school" for r"\b[S]chool\b" or
+{"green", "red"} for r"\b(Green|red)\b".
+required_literals() extracts such a set from a regex using the parser of
+the re module. The RulePrefilter scans the msgstr & msgid of an entry once
+(see StringMatcher) and determines which rules can possibly hit.
+
+All literals and texts are compared case-insensitively (see normalize_text()),
+which is correct for case-sensitive and IGNORECASE regexes alike.
+
+The rules compile their regexes using RE2 if possible, which reads some
+syntax differently than the re parser (e.g. [[:alpha:]] is a POSIX class
+in RE2, but a nested set in re). No literals are extracted from such regexes.
+"""
+import re
+import warnings
+from StringMatcher import MultiStringMatcher
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError: # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+# Minimum length of the literals. Shorter literals occur in almost every string.
+minLiteralLength = 2
+
+# Syntax the re parser does not read like RE2: POSIX classes ([[:alpha:]]),
+# Unicode classes (\p{L}, \P{L}), \C and named backreferences
+_foreignSyntax = re.compile(r"\[:|\\[pPC]|\(\?P=")
+
+def _case_equivalences():
+    """Groups of characters that IGNORECASE regexes consider equal besides lower() (e.g. i and ı)"""
+    try:
+        from re._casefix import _EXTRA_CASES
+        return [(char,) + extra for char, extra in _EXTRA_CASES.items()]
+    except ImportError:
+        import sre_compile
+        return getattr(sre_compile, "_equivalences", [])
+
+def _build_equivalence_table():
+    table = {}
+    for group in _case_equivalences():
+        members = [chr(char) for char in group]
+        members += [member.casefold() for member in members if len(member.casefold()) == 1]
+        canonical = min(members)
+        for member in members:
+            table.setdefault(ord(member), canonical)
+    return table
+
+_equivalenceTable = _build_equivalence_table()
+
+def normalize_text(text):
+    """Case-normalize a text or literal for the prefilter"""
+    return text.casefold().translate(_equivalenceTable)
+
+_zeroWidthOps = {sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT}
+_repeatOps = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT}
+_possessiveRepeat = getattr(sre_constants, "POSSESSIVE_REPEAT", None)
+if _possessiveRepeat is not None:
+    _repeatOps.add(_possessiveRepeat)
+
+def _selectivity(literals):
+    """Higher is better: The length of the shortest alternative"""
+    return min(len(literal) for literal in literals)
+
+def _class_char(items):
+    """
+    If a character class only matches case variants of a single character
+    (e.g. [Ss]), return that character, else None.
+    """
+    if not items or any(op != sre_constants.LITERAL for op, _ in items):
+        return None
+    chars = {normalize_text(chr(av)) for _, av in items}
+    return chars.pop() if len(chars) == 1 else None
+
+def _sequence_literals(items):
+    """
+    Required literals of a sequence of parsed regex items.
+    Returns a set of strings (one of which must occur) or None.
+    """
+    candidates = []
+    run = []
+    def end_run():
+        if run:
+            candidates.append({"".join(run)})
+            run.clear()
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            run.append(chr(av))
+        elif op == sre_constants.IN and _class_char(av) is not None:
+            run.append(_class_char(av)) # e.g. [Ss]
+        elif op in _zeroWidthOps:
+            continue # Does not consume characters, so the run continues
+        else:
+            end_run()
+            candidates.append(_item_literals(op, av))
+    end_run()
+    candidates = [literals for literals in candidates if literals]
+    if not candidates:
+        return None
+    return max(candidates, key=_selectivity)
+
+def _item_literals(op, av):
+    if op == sre_constants.SUBPATTERN:
+        return _sequence_literals(av[-1])
+    elif op in _repeatOps:
+        low, _, item = av
+        return _sequence_literals(item) if low >= 1 else None
+    elif op == getattr(sre_constants, "ATOMIC_GROUP", None):
+        return _sequence_literals(av)
+    elif op == sre_constants.BRANCH:
+        literals = set()
+        for branch in av[1]:
+            branchLiterals = _sequence_literals(branch)
+            if branchLiterals is None:
+                return None
+            literals |= branchLiterals
+        return literals
+    return None
+
+def required_literals(regex, flags=0):
+    """
+    Get a set of literals (normalized using normalize_text()) one of which
+    any string must contain for the regex to match (re.search).
+    Returns None if no such set can be determined or if it is not selective.
+    """
+    if _foreignSyntax.search(regex):
+        return None
+    try:
+        # re warns about syntax it might read differently in the future (e.g. nested sets)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", FutureWarning)
+            parsed = sre_parse.parse(regex, flags)
+    except Exception: # Not parseable by re (e.g. RE2-only syntax) or FutureWarning
+        return None
+    # Verbose mode & co are handled by the parser. Inline flags don't matter
+    # as the prefilter is case-insensitive anyway.
+    literals = _sequence_literals(list(parsed))
+    if literals is None:
+        return None
+    literals = {normalize_text(literal) for literal in literals}
+    if _selectivity(literals) < minLiteralLength:
+        return None
+    return literals
+
+class RulePrefilter(object):
+    """
+    Determines the candidate rules for an entry.
+
+    requirements is a list with one (msgstr literals, msgid literals) tuple
+    per rule (see Rule.required_literals()). A rule is a candidate if the
+    msgstr contains one of the msgstr literals and the msgid one of the msgid
+    literals. None means there is no requirement for that string.
+    """
+    def __init__(self, requirements):
+        self.num_rules = len(requirements)
+        self.unconditional = set()
+        sides = ([], []) # (literal, rule index) for msgstr & msgid
+        self.requiredSides = []
+        for ruleIdx, requirement in enumerate(requirements):
+            required = 0
+            for side, literals in enumerate(requirement):
+                if literals is not None:
+                    required += 1
+                    sides[side].extend((literal, ruleIdx) for literal in literals)
+            self.requiredSides.append(required)
+            if not required:
+                self.unconditional.add(ruleIdx)
+        self.matchers = []
+        self.literalRules = []
+        for pairs in sides:
+            # literal => rule indices
+            byLiteral = {}
+            for literal, ruleIdx in pairs:
+                byLiteral.setdefault(literal, set()).add(ruleIdx)
+            self.matchers.append(MultiStringMatcher(byLiteral.keys()))
+            self.literalRules.append(list(byLiteral.values()))
+
+    @property
+    def num_filtered(self):
+        """Number of rules which are subject to the prefilter"""
+        return self.num_rules - len(self.unconditional)
+
+    def candidates(self, msgstr, msgid):
+        """Get the set of indices of the rules which might hit"""
+        satisfied = {}
+        for side, text in enumerate((msgstr, msgid)):
+            if not len(self.matchers[side]):
+                continue
+            rules = set()
+            for literalIdx in self.matchers[side].find_all(normalize_text(text)):
+                rules |= self.literalRules[side][literalIdx]
+            for ruleIdx in rules:
+                satisfied[ruleIdx] = satisfied.get(ruleIdx, 0) + 1
+        # Rules with two requirements need both sides
+        return self.unconditional | {ruleIdx for ruleIdx, count in satisfied.items()
+                                     if count == self.requiredSides[ruleIdx]}
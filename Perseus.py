@@ -21,6 +21,58 @@ def getCachedKAPerseusCommands():
             cacheout.write("\n".join(cmds))
         return cmds
 
+class PerseusCommandStripper(object):
+    """
+    Removes \\command occurrences of a list of Perseus commands from a string.
+
+    Instead of one str.replace() per command, the string is scanned once:
+    At each backslash, the longest command starting there is removed.
+    The result for the last string is memoized, so all rules sharing a
+    stripper (see get_perseus_stripper()) strip each msgstr only once.
+    """
+    def __init__(self, commands):
+        self.commands = frozenset(cmd for cmd in commands if cmd)
+        self.lengths = sorted({len(cmd) for cmd in self.commands}, reverse=True)
+        self._last = (None, None)
+
+    def _command_length(self, text, start):
+        """Length of the longest command starting at text[start] or 0"""
+        for length in self.lengths:
+            if text[start:start + length] in self.commands:
+                return length
+        return 0
+
+    def strip(self, text):
+        lastText, lastResult = self._last
+        if text == lastText:
+            return lastResult
+        result = text
+        if "\\" in text:
+            parts = []
+            pos = 0
+            idx = text.find("\\")
+            while idx != -1:
+                length = self._command_length(text, idx + 1)
+                if length:
+                    parts.append(text[pos:idx])
+                    pos = idx + 1 + length
+                    idx = text.find("\\", pos)
+                else:
+                    idx = text.find("\\", idx + 1)
+            parts.append(text[pos:])
+            result = "".join(parts)
+        self._last = (text, result)
+        return result
+
+_strippers = {}
+
+def get_perseus_stripper(commands):
+    """Get the shared PerseusCommandStripper for a list of commands"""
+    key = tuple(commands)
+    if key not in _strippers:
+        _strippers[key] = PerseusCommandStripper(key)
+    return _strippers[key]
+
 
 if __name__ == "__main__":
     print(getCachedKAPerseusCommands())
\ No newline at end of file
@@ -3,6 +3,7 @@ from check import *
 from ansicolor import black
 import polib
 from Languages import findAvailableLanguages
+from CacheStorage import open_cache_file
 
 def loadTranslations(conn, recordTable=1, indexTable=2):
     """
@@ -30,7 +31,8 @@ def loadTranslations(conn, recordTable=1, indexTable=2):
             #  avoid tons of Python function calls.
             # The large values are be handled in C++ code efficiently.
             print("\tProcessing {}".format(filename))
-            po = polib.pofile(filename)
+            with open_cache_file(filename) as infile:
+                po = polib.pofile(infile.read().decode("utf-8"))
             # Write table 1
             values = {entry.msgid: lang + "\x1D" + entry.msgstr
                       for entry in po if entry.msgstr.strip()}
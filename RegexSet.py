@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Combined matching of the RE2 regexes of a rule set.
+
+Without it, every regex rule searches each string in a separate RE2 call.
+A RuleRegexSet adds the patterns of all rules to one RE2 set
+(google-re2's re2.Set), which finds all matching patterns in a single
+pass over the string. Only the rules whose patterns matched need to be
+applied (which runs findall() to extract the hits).
+
+Only regexes which the rules have actually compiled with RE2 (see
+CompatibilityRegexCompiler) are added, so the set has the same semantics
+as the rules. Compatibility mode regexes, e.g. with lookbehinds, are not
+subject to the set.
+
+Requires google-re2 (optional). Without it, RuleRegexSet is disabled.
+"""
+import re
+
+# Python flags which can be expressed as RE2 inline flags
+_inlineFlags = [(re.IGNORECASE, "i"), (re.MULTILINE, "m"), (re.DOTALL, "s")]
+# Python flags which don't change RE2 semantics
+_neutralFlags = re.UNICODE
+
+def re2_inline_pattern(regex, flags):
+    """
+    Convert a (regex, Python flags) pair to a single RE2 pattern
+    (for RE2 sets & Arrow). Returns None if the flags can't be represented.
+    """
+    inline = ""
+    for flag, char in _inlineFlags:
+        if flags & flag:
+            inline += char
+            flags &= ~flag
+    if flags & ~_neutralFlags:
+        return None
+    return "(?{}:{})".format(inline, regex) if inline else regex
+
+def _make_set(patterns):
+    """
+    Build an RE2 set from a list of patterns.
+    Returns (set, set index => pattern index) or None if google-re2 is not
+    installed or if RE2 can't compile the set (e.g. if it exceeds RE2's memory
+    budget). The rules are then applied without the set.
+    Patterns which RE2 can't parse are skipped.
+    """
+    try:
+        import re2
+    except ImportError:
+        return None
+    options = re2.Options()
+    options.log_errors = False
+    regexSet = re2.Set.SearchSet(options)
+    indices = []
+    for idx, pattern in enumerate(patterns):
+        try:
+            regexSet.Add(pattern)
+        except re2.error:
+            continue
+        indices.append(idx)
+    try:
+        regexSet.Compile()
+    except re2.error:  # "failed to compile Set"
+        return None
+    return regexSet, indices
+
+class RuleRegexSet(object):
+    """
+    Determines the candidate rules for an entry using RE2 sets.
+
+    requirements is a list with one (msgstr pattern, msgid pattern) tuple
+    per rule (see Rule.set_patterns()). A rule is a candidate if the msgstr
+    matches the msgstr pattern and the msgid the msgid pattern.
+    None means there is no requirement for that string.
+    """
+    def __init__(self, requirements):
+        self.num_rules = len(requirements)
+        sides = ([], []) # (pattern, rule index) for msgstr & msgid
+        for ruleIdx, requirement in enumerate(requirements):
+            for side, pattern in enumerate(requirement):
+                if pattern is not None:
+                    sides[side].append((re2_inline_pattern(*pattern), ruleIdx))
+        self.sets = []
+        self.patternRules = [] # per side: set index => rule index
+        requiredSides = [0] * self.num_rules
+        for pairs in sides:
+            pairs = [(pattern, ruleIdx) for pattern, ruleIdx in pairs if pattern is not None]
+            made = _make_set([pattern for pattern, _ in pairs]) if pairs else None
+            if made is None:
+                self.sets.append(None)
+                self.patternRules.append([])
+                continue
+            regexSet, indices = made
+            self.sets.append(regexSet)
+            self.patternRules.append([pairs[idx][1] for idx in indices])
+            for idx in indices:
+                requiredSides[pairs[idx][1]] += 1
+        self.requiredSides = requiredSides
+        self.unconditional = {ruleIdx for ruleIdx, required in enumerate(requiredSides) if not required}
+
+    @property
+    def num_filtered(self):
+        """Number of rules which are subject to the set"""
+        return self.num_rules - len(self.unconditional)
+
+    def candidates(self, msgstr, msgid):
+        """Get the set of indices of the rules which might hit"""
+        if not self.num_filtered:
+            return set(range(self.num_rules))
+        satisfied = {}
+        for side, text in enumerate((msgstr, msgid)):
+            if self.sets[side] is None:
+                continue
+            for setIdx in self.sets[side].Match(text) or (): # None if nothing matched
+                ruleIdx = self.patternRules[side][setIdx]
+                satisfied[ruleIdx] = satisfied.get(ruleIdx, 0) + 1
+        return self.unconditional | {ruleIdx for ruleIdx, count in satisfied.items()
+                                     if count == self.requiredSides[ruleIdx]}
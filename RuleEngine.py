@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Evaluation of a rule set over the translated entries of XLIFF files.
+
+The renderer uses this both in its own threads and in worker processes.
+Worker processes receive the rule set once (pickled, see Rule.__reduce__)
+in their initializer, so they neither import the language module nor
+download the rules from Google Docs.
+
+Most strings occur in many files (e.g. "Check your answer"), so the
+RuleEvaluator memoizes the hits of the content rules per unique
+(english, translated, note) and only checks the filename gates
+(see Rule.split_filename_gates) per occurrence. Optionally, the hits
+are also stored in a persistent RuleHitCache across render runs.
+Rules which can't hit because their required literals don't occur in
+the entry are skipped (see LiteralPrefilter). If google-re2 is installed,
+the RE2 regexes of the remaining rules are matched in a single pass
+and only the rules which matched are applied (see RegexSet).
+Substring rules are not applied one by one: A single scan per entry
+determines all substring rules which hit (see SubstringSet).
+Wrapped rules are applied as flat RulePlans instead of nested generators.
+Some rules can be checked for all entries beforehand, e.g. column-wise
+(see ArrowEngine) or using an index (see WordIndex). The resulting
+RuleMatches restrict these rules to the entries they matched.
+"""
+import collections
+import gc
+import hashlib
+import pickle
+import threading
+from ansicolor import red
+from lxml import etree
+from XLIFFReader import stream_xliff_entries
+from Corpus import CorpusNote
+from Rules import PreparedEntry
+from LiteralPrefilter import RulePrefilter
+from RegexSet import RuleRegexSet
+from SubstringSet import RuleSubstringSet
+from RulePlan import RulePlan
+
+def content_fingerprints(rules):
+    """Fingerprints of the content rules (without filename gates) of a rule set"""
+    return [rule.split_filename_gates()[1].fingerprint for rule in rules]
+
+def diff_rule_sets(previous, current):
+    """
+    Compare two lists of (rule name, fingerprint).
+    Returns the names of the (added, changed, removed) rules.
+    """
+    previous, current = dict(previous), dict(current)
+    added = [name for name in current if name not in previous]
+    changed = [name for name in current if name in previous and current[name] != previous[name]]
+    removed = [name for name in previous if name not in current]
+    return added, changed, removed
+
+def text_key(text):
+    """Hash of a msgid or msgstr for RuleMatches"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+class RuleMatches(object):
+    """
+    Precomputed candidate entries for some of the content rules of a
+    RuleEvaluator. rules is the set of indices of these rules, matches maps
+    a key to the tuple of these rules which can hit the entry (keys without
+    any such rule are not stored). Keys are RuleEvaluator.entry_key()
+    or, if field is "english" or "translated", text_key() of that field.
+
+    If corpus_only is set, the matches only cover the entries of the corpus
+    snapshot they were computed from (e.g. using an index of the corpus).
+    Entries read from other files are not restricted then.
+    """
+    def __init__(self, rules, matches, field=None, corpus_only=False):
+        self.rules = frozenset(rules)
+        self.matches = matches
+        self.field = field
+        self.corpus_only = corpus_only
+
+    def excluded(self, entry, key, in_corpus=True):
+        """
+        The set of rules which can't hit the entry with the given entry key.
+        in_corpus tells whether the entry was read from the corpus.
+        """
+        if self.corpus_only and not in_corpus:
+            return frozenset()
+        if self.field is not None:
+            key = text_key(getattr(entry, self.field))
+        return self.rules.difference(self.matches.get(key, ()))
+
+def read_translated_entries(filename, relpath, corpus=None):
+    """
+    Read the translated entries of a file, preferrably from the corpus.
+    Notes of corpus entries are only decoded when used.
+    """
+    if corpus is not None and relpath in corpus:
+        return corpus.file_entries(relpath, ignore_untranslated=True, lazy_notes=True)
+    return stream_xliff_entries(filename, ignore_untranslated=True)
+
+class RuleEvaluator(object):
+    """
+    Applies a rule set to entries. The hits of the content rules are
+    memoized per unique entry content, so repeated strings are only evaluated once.
+    Thread-safe: Concurrent misses for the same string just evaluate it twice.
+
+    The memo keeps the memo_size most recently used entries (with or without hits).
+    Every memoized entry costs roughly 200 bytes plus its hits, and every worker
+    process has its own memo. Entries evicted from the memo are evaluated again
+    (or read from the hit cache) when they occur again.
+
+    hitCache is an optional RuleHitCache for the content_fingerprints() of the rules.
+    For cached entries, only the rules which the entry has not been evaluated
+    with (i.e. new or changed rules) are applied.
+
+    ruleMatches is a list of RuleMatches computed for the same rules & entries.
+
+    If verify_plans is set, the nested rules are applied as well and their
+    hits are compared with the hits of the RulePlans (for testing).
+    """
+    def __init__(self, rules, hitCache=None, ruleMatches=(), verify_plans=False, memo_size=100000):
+        self.rules = rules
+        self.hitCache = hitCache
+        self.ruleMatches = ruleMatches
+        split = [rule.split_filename_gates() for rule in rules]
+        self.gates = [gates for gates, _ in split]
+        self.contentRules = [content for _, content in split]
+        self.contentFingerprints = [rule.fingerprint for rule in self.contentRules]
+        self.plans = [RulePlan(rule) for rule in self.contentRules]
+        self.verify_plans = verify_plans
+        self.substringSet = RuleSubstringSet([rule.substring_needle() for rule in self.contentRules])
+        # The rules of the substring set are candidates if they hit (see candidates()),
+        # so the prefilter never selects them (no literal can satisfy an empty set)
+        self.prefilter = RulePrefilter([(frozenset(), None) if ruleIdx in self.substringSet.rules
+                                        else rule.required_literals()
+                                        for ruleIdx, rule in enumerate(self.contentRules)])
+        self.regexSet = RuleRegexSet([rule.set_patterns() for rule in self.contentRules])
+        self.regexSetRules = set(range(len(self.contentRules))) - self.regexSet.unconditional
+        # Only decode notes for the key if any rule depends on them
+        self.use_notes = any(rule.uses_tcomment for rule in self.contentRules)
+        # LRU: entry key => tuple of (rule index, hit, origImages, translatedImages)
+        self.memo = collections.OrderedDict()
+        self.memo_size = memo_size
+        self._memoLock = threading.Lock()
+
+    def entry_key(self, entry):
+        """Hash of the content of an entry which rules depend on"""
+        key = hashlib.blake2b(digest_size=16)
+        key.update(entry.english.encode("utf-8"))
+        key.update(b"\0")
+        key.update(entry.translated.encode("utf-8"))
+        if self.use_notes:
+            key.update(b"\0")
+            key.update(str(entry.note).encode("utf-8"))
+        return key.digest()
+
+    def candidates(self, prepared, key, in_corpus=True):
+        """
+        Get the set of indices of the content rules which might hit a PreparedEntry.
+        in_corpus tells whether the entry was read from the corpus (see RuleMatches).
+        """
+        candidates = self.prefilter.candidates(prepared.translated, prepared.english)
+        if len(self.substringSet):
+            candidates |= self.substringSet.hits(prepared.translated, prepared.translatedLower)
+        for ruleMatches in self.ruleMatches:
+            candidates -= ruleMatches.excluded(prepared.entry, key, in_corpus)
+        # The RE2 set only pays off if there are candidates it can rule out
+        if not candidates.isdisjoint(self.regexSetRules):
+            candidates &= self.regexSet.candidates(prepared.translated, prepared.english)
+        return candidates
+
+    def content_hits(self, entry, stats=None, in_corpus=True):
+        """
+        Get the content hits of an entry.
+        Returns (hits, source) where source is "memo", "cache" (all rules cached),
+        "partial" (some rules cached) or "evaluated".
+        If given, the number of rules applied & skipped by candidates() are
+        counted in the stats Counter. in_corpus tells whether the entry was
+        read from the corpus (see RuleMatches). The memoized hits are valid
+        for either, as RuleMatches only exclude rules which can't hit.
+        """
+        key = self.entry_key(entry)
+        with self._memoLock:
+            hits = self.memo.get(key)
+            if hits is not None:
+                self.memo.move_to_end(key)
+        if hits is not None:
+            return hits, "memo"
+        cached = self.hitCache.get(key) if self.hitCache is not None else None
+        evaluated, cachedHits = cached if cached is not None else (frozenset(), {})
+        hits = []
+        ruleHitMap = {} # fingerprint => hits for the cache
+        missing = False
+        prepared = candidates = None
+        for ruleIdx, (rule, fingerprint) in enumerate(zip(self.contentRules, self.contentFingerprints)):
+            if fingerprint in evaluated:
+                ruleHits = cachedHits.get(fingerprint, ())
+            else: # New or changed rule
+                missing = True
+                if candidates is None:
+                    # Prepare the entry once for all rules
+                    prepared = PreparedEntry(entry)
+                    candidates = self.candidates(prepared, key, in_corpus)
+                if ruleIdx not in candidates:
+                    ruleHits = ()
+                elif ruleIdx in self.substringSet.needles:
+                    ruleHits = tuple((hit, prepared.origImages, prepared.translatedImages) for hit in
+                        self.substringSet.rule_hits(ruleIdx, prepared.translated, prepared.translatedLower))
+                else:
+                    ruleHits = self.plans[ruleIdx].apply_to_prepared_entry(prepared)
+                    if self.verify_plans:
+                        ruleHits = self.verify_plan(ruleIdx, prepared, ruleHits, stats)
+                if stats is not None:
+                    stats["rules applied" if ruleIdx in candidates else "rules skipped"] += 1
+            if ruleHits:
+                ruleHitMap[fingerprint] = ruleHits
+                hits += [(ruleIdx,) + ruleHit for ruleHit in ruleHits]
+        hits = tuple(hits)
+        with self._memoLock:
+            self.memo[key] = hits
+            if len(self.memo) > self.memo_size:
+                self.memo.popitem(last=False)
+        if missing and self.hitCache is not None:
+            self.hitCache.put(key, ruleHitMap)
+        if cached is None:
+            return hits, "evaluated"
+        return hits, ("partial" if missing else "cache")
+
+    def verify_plan(self, ruleIdx, prepared, planHits, stats=None):
+        """
+        Compare the hits of a RulePlan with the hits of the nested rule.
+        Prints & counts ("plan mismatches") differences. Returns the nested hits.
+        """
+        rule = self.contentRules[ruleIdx]
+        ruleHits = tuple((hit, origImages, translatedImages)
+            for _, hit, _, origImages, translatedImages in rule.apply_to_prepared_entry(prepared, None))
+        if ruleHits != planHits:
+            print(red("Flattened plan of rule '{}' differs for '{}': {} instead of {}".format(
+                rule.name, prepared.english, [hit for hit, _, _ in planHits], [hit for hit, _, _ in ruleHits]), bold=True))
+            if stats is not None:
+                stats["plan mismatches"] += 1
+        return ruleHits
+
+    def gates_accept(self, ruleIdx, relpath):
+        return all(gate.accepts_filename(relpath) for gate in self.gates[ruleIdx])
+
+def evaluate_file(evaluator, filename, relpath, corpus=None):
+    """
+    Apply all rules of the RuleEvaluator to the translated entries of a file.
+
+    Returns (entries, hits, stats): entries is the list of XLIFFEntrys with at least
+    one hit, hits is a list of (rule index, entry index, hit, origImages, translatedImages)
+    and stats is a collections.Counter of the content_hits() sources plus "entries"
+    Returns None if the file is not valid XLIFF.
+    """
+    entries = []
+    hits = []
+    stats = collections.Counter()
+    print(filename)
+    # Files which are not part of the corpus are read from the XLIFF file
+    inCorpus = corpus is not None and relpath in corpus
+    try:
+        for entry in read_translated_entries(filename, relpath, corpus):
+            contentHits, source = evaluator.content_hits(entry, stats, inCorpus)
+            stats[source] += 1
+            entryIdx = None
+            # Fan out to this occurrence
+            for ruleIdx, hit, origImages, translatedImages in contentHits:
+                if not evaluator.gates_accept(ruleIdx, relpath):
+                    continue
+                # Only entries with hits are returned
+                if entryIdx is None:
+                    entryIdx = len(entries)
+                    entries.append(entry)
+                hits.append((ruleIdx, entryIdx, hit, origImages, translatedImages))
+    except etree.XMLSyntaxError:
+        print(red("File {} is not valid XLIFF - Ignoring.".format(relpath)))
+        return None
+    if evaluator.hitCache is not None:
+        evaluator.hitCache.flush()
+    gc.collect()
+    stats["entries"] = stats["memo"] + stats["cache"] + stats["partial"] + stats["evaluated"]
+    return entries, hits, stats
+
+# State of a worker process, see init_worker()
+_workerEvaluator = None
+_workerCorpus = None
+
+def serialize_rules(rules):
+    """Serialize a rule set for init_worker()"""
+    return pickle.dumps(rules, protocol=pickle.HIGHEST_PROTOCOL)
+
+def init_worker(ruleSpec, corpus=None, hitCache=None, ruleMatches=(), verify_plans=False):
+    """
+    Process pool initializer: Compile the rule set once per worker.
+    Every worker memoizes the unique strings it has seen.
+    """
+    global _workerEvaluator, _workerCorpus
+    _workerEvaluator = RuleEvaluator(pickle.loads(ruleSpec), hitCache, ruleMatches, verify_plans)
+    _workerCorpus = corpus
+
+def evaluate_file_in_worker(filename, relpath):
+    """
+    evaluate_file() using the rule set of this worker process.
+    Lazy corpus notes are returned as their key, as they refer
+    to the worker's mapping of the corpus.
+    """
+    result = evaluate_file(_workerEvaluator, filename, relpath, _workerCorpus)
+    if result is None:
+        return None
+    entries, hits, stats = result
+    entries = [entry._replace(note=entry.note.key) if isinstance(entry.note, CorpusNote) else entry
+               for entry in entries]
+    return entries, hits, stats
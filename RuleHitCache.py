@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Persistent, content-addressed cache of rule hits across render runs.
+
+For every (entry key, language), the cache stores the content hits
+(see RuleEngine.RuleEvaluator) by rule fingerprint (see Rule.fingerprint),
+plus the set of rule fingerprints the entry has been evaluated with.
+When rules are added or changed, only those rules need to be evaluated,
+the hits of unchanged rules are reused and those of removed rules are dropped.
+Filename gates are applied after the content rules, so the hits don't
+depend on the filename.
+
+The cache is a single SQLite file. It does not use a write-ahead log,
+so it can be shared by multiple machines over a network filesystem
+(given working POSIX locks). Rows which have not been used for
+max_age days are evicted by evict().
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+_schema = """
+CREATE TABLE IF NOT EXISTS rulesets (
+    id INTEGER PRIMARY KEY,
+    fingerprints BLOB NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS hits (
+    entry BLOB NOT NULL,
+    lang TEXT NOT NULL,
+    ruleset INTEGER NOT NULL,
+    hits BLOB NOT NULL,
+    day INTEGER NOT NULL,
+    PRIMARY KEY (entry, lang)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS runs (
+    lang TEXT PRIMARY KEY,
+    rules BLOB NOT NULL
+);
+"""
+
+def _today():
+    return int(time.time() // 86400)
+
+class RuleHitCache(object):
+    """
+    A hit cache for the given language and (ordered) list of rule fingerprints.
+
+    Thread- and fork-safe: Every thread & process uses its own connection.
+    Writes are buffered and committed by flush(). close() closes the
+    connections of all threads of the current process.
+    """
+    def __init__(self, filename, lang, fingerprints, max_age=30):
+        self.filename = filename
+        self.lang = lang
+        self.fingerprints = fingerprints
+        self.max_age = max_age
+        self.day = _today()
+        self._local = threading.local()
+        self._connections = [] # (pid, connection) of all threads
+        self._connectionsLock = threading.Lock()
+        self._rulesets = {} # ID => frozenset of fingerprints
+        conn = self._connect()
+        with conn:
+            conn.executescript(_schema)
+            # Register the current rule set
+            blob = b"".join(sorted(bytes.fromhex(fingerprint) for fingerprint in set(fingerprints)))
+            conn.execute("INSERT OR IGNORE INTO rulesets (fingerprints) VALUES (?)", (blob,))
+            self.ruleset, = conn.execute("SELECT id FROM rulesets WHERE fingerprints = ?", (blob,)).fetchone()
+        conn.close()
+        self._rulesets[self.ruleset] = frozenset(fingerprints)
+
+    def __getstate__(self):
+        return (self.filename, self.lang, self.fingerprints, self.max_age)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+        # Only used by the thread which opened it, but closed by close()
+        conn = sqlite3.connect(self.filename, timeout=300, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        return conn
+
+    @property
+    def _state(self):
+        """Connection & write buffers of the current thread"""
+        state = getattr(self._local, "state", None)
+        if state is None or state["pid"] != os.getpid():
+            state = {"pid": os.getpid(), "conn": self._connect(), "puts": [], "touches": []}
+            self._local.state = state
+            with self._connectionsLock:
+                self._connections.append((state["pid"], state["conn"]))
+        return state
+
+    def evaluated_fingerprints(self, ruleset):
+        """Get the set of rule fingerprints for a rule set ID"""
+        fingerprints = self._rulesets.get(ruleset)
+        if fingerprints is None:
+            blob, = self._state["conn"].execute(
+                "SELECT fingerprints FROM rulesets WHERE id = ?", (ruleset,)).fetchone()
+            fingerprints = frozenset(blob[i:i + 20].hex() for i in range(0, len(blob), 20))
+            self._rulesets[ruleset] = fingerprints
+        return fingerprints
+
+    def get(self, entry):
+        """
+        Get (set of evaluated rule fingerprints, fingerprint => hits) for an entry
+        key or None if the entry is not in the cache. Only rules with hits are stored.
+        """
+        state = self._state
+        row = state["conn"].execute("SELECT ruleset, hits, day FROM hits WHERE entry = ? AND lang = ?",
+                                    (entry, self.lang)).fetchone()
+        if row is None:
+            return None
+        ruleset, hits, day = row
+        # Protect from eviction
+        if day != self.day:
+            state["touches"].append((self.day, entry, self.lang))
+        return self.evaluated_fingerprints(ruleset), pickle.loads(hits)
+
+    def put(self, entry, hits):
+        """Store the hits (fingerprint => hits) of all current rules for an entry key"""
+        self._state["puts"].append((entry, self.lang, self.ruleset,
+            pickle.dumps(hits, protocol=pickle.HIGHEST_PROTOCOL), self.day))
+
+    def flush(self):
+        """Write the buffered changes of the current thread"""
+        state = self._state
+        if not state["puts"] and not state["touches"]:
+            return
+        with state["conn"] as conn:
+            conn.executemany("INSERT OR REPLACE INTO hits VALUES (?, ?, ?, ?, ?)", state["puts"])
+            conn.executemany("UPDATE hits SET day = ? WHERE entry = ? AND lang = ?", state["touches"])
+        state["puts"].clear()
+        state["touches"].clear()
+
+    def previous_rules(self):
+        """Get the (name, fingerprint) list recorded by the last record_rules() or []"""
+        row = self._state["conn"].execute("SELECT rules FROM runs WHERE lang = ?", (self.lang,)).fetchone()
+        return [] if row is None else pickle.loads(row[0])
+
+    def record_rules(self, rules):
+        """Record the (name, fingerprint) list of the rules of this run"""
+        with self._state["conn"] as conn:
+            conn.execute("INSERT OR REPLACE INTO runs VALUES (?, ?)", (self.lang, pickle.dumps(rules)))
+
+    def close(self):
+        """
+        Close the connections of all threads of this process.
+        Unflushed writes are lost, so flush() first. Using the cache
+        afterwards opens new connections.
+        """
+        pid = os.getpid()
+        with self._connectionsLock:
+            # Connections inherited from the parent process belong to it
+            connections = [conn for connPid, conn in self._connections if connPid == pid]
+            self._connections = []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+    def evict(self):
+        """Remove rows which have not been used for max_age days and unused rule sets"""
+        with self._state["conn"] as conn:
+            count = conn.execute("DELETE FROM hits WHERE day < ?", (self.day - self.max_age,)).rowcount
+            conn.execute("DELETE FROM rulesets WHERE id != ? AND id NOT IN (SELECT DISTINCT ruleset FROM hits)",
+                         (self.ruleset,))
+            return count
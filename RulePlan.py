@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Flat evaluation plans for wrapped rules.
+
+Rules are often nested, e.g.
+IgnoreByMsgidRegexWrapper(IgnoreByMsgstrRegexWrapper(SimpleRegexRule(...))).
+Applied as is, every wrapper is a generator which re-yields the hits of its
+child. A RulePlan flattens such a chain (see Rule.plan_step()) into a list of
+steps: The exclusion predicates of the wrappers and the core rule (the first
+rule in the chain which is not a flattenable wrapper). The plan is evaluated
+in a single loop without nested generators.
+
+As the rule has no hits if any predicate is true or if the core rule has no
+hits, the steps can be evaluated in any order. Every plan measures the cost
+(time per evaluation, sampled) and the selectivity (rate of rejected
+entries) of its steps and runs the steps with the lowest cost per rejection
+first. Wrappers which transform the msgstr (e.g. removing Perseus commands)
+are applied when a step below them needs the msgstr.
+
+RuleEvaluator(verify_plans=True) compares the hits of every plan with the
+hits of the nested rule (see 'katc.py render --verify-plans').
+"""
+import time
+
+# Time the steps of every Nth evaluation of a plan
+_sampleInterval = 64
+
+class _Step(object):
+    """A predicate of a wrapper or the core rule (field "core") including its statistics"""
+    __slots__ = ["field", "function", "stage", "runs", "rejections", "timedRuns", "time"]
+
+    def __init__(self, field, function, stage):
+        self.field = field
+        self.function = function
+        self.stage = stage # The number of msgstr transforms above the step
+        self.runs = self.rejections = self.timedRuns = 0
+        self.time = 0.
+
+    def cost_per_rejection(self):
+        cost = self.time / self.timedRuns if self.timedRuns else 0.
+        # Smoothed, so steps which never reject are not infinitely expensive
+        return cost * (self.runs + 2) / (self.rejections + 1)
+
+class RulePlan(object):
+    """
+    Flattened wrapper chain of a rule. evaluate() returns the same hits as
+    list(rule(...)). Thread-safe: The statistics are approximate then.
+    """
+    def __init__(self, rule):
+        self.rule = rule
+        self.transforms = []
+        steps = []
+        node = rule
+        while True:
+            step = node.plan_step()
+            if step is None:
+                break
+            kind, field, function = step
+            if kind == "transform":
+                self.transforms.append(function)
+            else:
+                steps.append(_Step(field, function, len(self.transforms)))
+            node = node.child
+        self.core = node
+        # Initially in the nested order
+        steps.append(_Step("core", node, len(self.transforms)))
+        self.steps = tuple(steps)
+        self.runs = 0
+        # Rules without wrappers to flatten are applied directly
+        self.flat = len(steps) == 1 and not self.transforms
+
+    def _reorder(self):
+        self.steps = tuple(sorted(self.steps, key=_Step.cost_per_rejection))
+
+    def evaluate(self, msgstr, msgid, tcomment="", filename=None):
+        """Get the list of hits of the rule"""
+        if self.flat:
+            return list(self.core(msgstr, msgid, tcomment, filename))
+        self.runs += 1
+        timed = self.runs % _sampleInterval == 0
+        msgstrs = [msgstr] # By stage, computed on demand
+        hits = None
+        for step in self.steps:
+            if timed:
+                startTime = time.perf_counter()
+            field = step.field
+            if field == "msgstr" or field == "core":
+                while len(msgstrs) <= step.stage:
+                    msgstrs.append(self.transforms[len(msgstrs) - 1](msgstrs[-1]))
+            if field == "core":
+                hits = list(self.core(msgstrs[step.stage], msgid, tcomment, filename))
+                rejected = not hits
+            elif field == "msgstr":
+                rejected = step.function(msgstrs[step.stage])
+            elif field == "msgid":
+                rejected = step.function(msgid)
+            elif field == "tcomment":
+                rejected = step.function(tcomment)
+            else:
+                rejected = step.function(filename)
+            step.runs += 1
+            if timed:
+                step.time += time.perf_counter() - startTime
+                step.timedRuns += 1
+            if rejected:
+                step.rejections += 1
+                hits = []
+                break
+        if timed:
+            self._reorder()
+        return hits
+
+    def apply_to_prepared_entry(self, prepared, filename=None):
+        """Get the hits of the rule for a PreparedEntry as (hit, origImages, translatedImages) tuples"""
+        return tuple((hit, prepared.origImages, prepared.translatedImages) for hit in
+                     self.evaluate(prepared.translated, prepared.english, prepared.note, filename))
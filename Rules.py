@@ -2,10 +2,12 @@
 # coding: utf-8
 import re
 import cffi_re2
+import copy
+import hashlib
 import os
 import sys
 import fnmatch
-from collections import defaultdict
+from collections import defaultdict, Counter
 from enum import IntEnum
 import importlib
 from ansicolor import black, red, blue
@@ -14,6 +16,9 @@ from io import StringIO
 import sre_constants
 import csv
 from Perseus import *
+from LiteralPrefilter import required_literals, normalize_text, minLiteralLength
+from RegexSet import re2_inline_pattern
+from StringMatcher import WordListMatcher
 
 class Severity(IntEnum):
     # Notice should be used for rules where a significant number of unfixable false-positives are expected
@@ -43,22 +48,112 @@ class CompatibilityRegexCompiler(object):
     
     Additionally, all regexes are wrapped in parentheses so for findall() there is always
     the entire group available.
+
+    Identical regexes (pattern & flags) are compiled only once and shared
+    by all rules using them (see MemoRegex).
+
+    If count_calls is set, the compiled regexes count their calls
+    (search, findall etc) in self.calls (see CountingRegex).
     """
-    def __init__(self):
+    def __init__(self, count_calls=False):
         self.numRegex = 0
         self.numCompatRegex = 0
+        self.count_calls = count_calls
+        self.calls = Counter() # "re2" / "re" => number of calls
+        self._compiled = {} # (regex, flags) => MemoRegex
     def compile(self, rgx, flags=0):
         rgx = "({0})".format(rgx)
         self.numRegex += 1
+        shared = self._compiled.get((rgx, flags))
+        if shared is not None:
+            if not self.is_re2(shared):
+                self.numCompatRegex += 1
+            return shared
         try:
-            return cffi_re2.compile(rgx, flags)
+            compiled = cffi_re2.compile(rgx, flags)
         except ValueError:
             # Enable this for debugging
             # print("Regex in compatibility mode: {0}".format(rgx))
             self.numCompatRegex += 1
-            return re.compile(rgx, flags)
-
-reCompiler = CompatibilityRegexCompiler()
+            compiled = re.compile(rgx, flags)
+        if self.count_calls:
+            compiled = CountingRegex(compiled, self.calls)
+        shared = self._compiled[(rgx, flags)] = MemoRegex(compiled)
+        return shared
+    @property
+    def numUniqueRegex(self):
+        return len(self._compiled)
+    @staticmethod
+    def is_re2(compiled):
+        """True if a regex returned by compile() has been compiled by RE2"""
+        while hasattr(compiled, "wrapped"):
+            compiled = compiled.wrapped
+        return not isinstance(compiled, re.Pattern)
+
+class MemoRegex(object):
+    """
+    A compiled regex shared by all rules using the same pattern & flags.
+    search() & findall() remember their last string & result, so if several
+    rules search the same string (i.e. the current entry), the regex only runs once.
+    Thread-safe: The memo is a single tuple which is replaced atomically.
+    """
+    __slots__ = ["wrapped", "_lastSearch", "_lastFindall"]
+    def __init__(self, wrapped):
+        self.wrapped = wrapped
+        self._lastSearch = self._lastFindall = (None, None)
+    def search(self, string, *args, **kwargs):
+        if args or kwargs: # pos/endpos
+            return self.wrapped.search(string, *args, **kwargs)
+        lastString, result = self._lastSearch
+        if lastString != string:
+            result = self.wrapped.search(string)
+            self._lastSearch = (string, result)
+        return result
+    def findall(self, string, *args, **kwargs):
+        if args or kwargs:
+            return self.wrapped.findall(string, *args, **kwargs)
+        lastString, result = self._lastFindall
+        if lastString != string:
+            result = tuple(self.wrapped.findall(string))
+            self._lastFindall = (string, result)
+        # The caller gets its own list
+        return list(result)
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+class CountingRegex(object):
+    """
+    Instrumentation: A compiled regex which counts its calls by engine.
+    Enabled by setting the KATC_COUNT_REGEX_CALLS environment variable
+    before Rules is imported.
+    """
+    __slots__ = ["wrapped", "_calls", "_engine"]
+    def __init__(self, wrapped, calls):
+        self.wrapped = wrapped
+        self._calls = calls
+        self._engine = "re2" if CompatibilityRegexCompiler.is_re2(wrapped) else "re"
+    def search(self, *args, **kwargs):
+        self._calls[self._engine] += 1
+        return self.wrapped.search(*args, **kwargs)
+    def match(self, *args, **kwargs):
+        self._calls[self._engine] += 1
+        return self.wrapped.match(*args, **kwargs)
+    def findall(self, *args, **kwargs):
+        self._calls[self._engine] += 1
+        return self.wrapped.findall(*args, **kwargs)
+    def finditer(self, *args, **kwargs):
+        self._calls[self._engine] += 1
+        return self.wrapped.finditer(*args, **kwargs)
+    def sub(self, *args, **kwargs):
+        self._calls[self._engine] += 1
+        return self.wrapped.sub(*args, **kwargs)
+    def split(self, *args, **kwargs):
+        self._calls[self._engine] += 1
+        return self.wrapped.split(*args, **kwargs)
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+reCompiler = CompatibilityRegexCompiler(count_calls=bool(os.environ.get("KATC_COUNT_REGEX_CALLS")))
 
 __cleanupRegex = reCompiler.compile(r'<(a|span|div|table)\s*([a-z-]+=("[^"]+"|\'[^\']+\')\s*)*>(.+?)</(a|span|div|table)>\s*', re.MULTILINE)
 __cleanupDetectRegex = reCompiler.compile(r"<(a|span|div|table)")
@@ -77,17 +172,91 @@ def importRulesForLanguage(lang, basedir="."):
     moduleName = "rules.{}".format(lang)
     print(black("Reading rules from {}".format(moduleName), bold=True))
     langModule = importlib.import_module(moduleName)
-    print(black("Found {} rules for language {} ({} in compatibility mode)".format(len(langModule.rules), lang, reCompiler.numCompatRegex), bold=True))
+    print(black("Found {} rules for language {} ({} in compatibility mode, {} unique regexes)".format(
+        len(langModule.rules), lang, reCompiler.numCompatRegex, reCompiler.numUniqueRegex), bold=True))
     return langModule.rules, langModule.rule_errors
 
+def _setPattern(compiled, regex, flags):
+    """The (regex, flags) for Rule.set_patterns() if RE2 compiled the regex, else None"""
+    return (regex, flags) if reCompiler.is_re2(compiled) else None
+
+def _vectorPattern(compiled, regex, flags):
+    """The RE2 pattern for Rule.vector_checks() if RE2 compiled the regex, else None"""
+    return re2_inline_pattern(regex, flags) if reCompiler.is_re2(compiled) else None
+
 _extractImgRegex = reCompiler.compile(r"(https?://ka-perseus-graphie\.s3\.amazonaws\.com/[0-9a-f]{40,40}\.(png|svg))")
 
+class PreparedEntry(object):
+    """
+    The views of a XLIFF entry which rules work on, computed once per entry:
+    The cleaned up msgstr (translated), the msgid (english), the note
+    and (computed on first use) the lowercase msgstr & the images in both strings.
+    """
+    __slots__ = ["entry", "english", "translated", "note", "_translatedLower",
+                 "_origImages", "_translatedImages"]
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.english = entry.english
+        self.translated = cleanupTranslatedString(entry.translated)
+        self.note = entry.note or ""
+        self._translatedLower = self._origImages = self._translatedImages = None
+
+    @property
+    def translatedLower(self):
+        if self._translatedLower is None:
+            self._translatedLower = self.translated.lower()
+        return self._translatedLower
+
+    @property
+    def origImages(self):
+        if self._origImages is None:
+            self._origImages = tuple(h[0] for h in _extractImgRegex.findall(self.english))
+        return self._origImages
+
+    @property
+    def translatedImages(self):
+        if self._translatedImages is None:
+            self._translatedImages = tuple(h[0] for h in _extractImgRegex.findall(self.translated))
+        return self._translatedImages
+
+def _constructRule(cls, args, kwargs):
+    return cls(*args, **kwargs)
+
+def _stableRepr(obj):
+    """
+    repr() of a rule constructor argument that does not depend on
+    the process (set order, object addresses). Rules are represented by their fingerprint.
+    """
+    if isinstance(obj, Rule):
+        return obj.fingerprint
+    elif isinstance(obj, (list, tuple)):
+        return "[{}]".format(",".join(_stableRepr(item) for item in obj))
+    elif isinstance(obj, (set, frozenset)):
+        return "{{{}}}".format(",".join(sorted(_stableRepr(item) for item in obj)))
+    elif isinstance(obj, dict):
+        return "{{{}}}".format(",".join(sorted("{}:{}".format(_stableRepr(key), _stableRepr(value))
+                                                for key, value in obj.items())))
+    return repr(obj)
+
 class Rule(object):
     """
     A baseclass for rules.
     Remember to implement __call__(self, msgstr, msgid),
     which must return the hit or None if no hit is found.
     """
+    def __new__(cls, *args, **kwargs):
+        rule = super().__new__(cls)
+        # Constructor arguments (including child rules), used for pickling
+        rule.init_args = (args, kwargs)
+        return rule
+    def __reduce__(self):
+        """
+        Rules are pickled as their constructor arguments and re-created
+        when unpickling, as compiled (RE2) regexes can't be pickled.
+        """
+        args, kwargs = self.init_args
+        return (_constructRule, (type(self), args, kwargs))
     def __init__(self, name, severity=Severity.standard):
         self.name = name
         # If you need to save some state, you can do it here.
@@ -127,6 +296,114 @@ class Rule(object):
             "color": self.getBootstrapColor(),
         }
 
+    # True for wrappers which only decide by filename, see accepts_filename()
+    is_filename_gate = False
+
+    def required_literals(self):
+        """
+        Get (msgstr literals, msgid literals): The rule can only hit if the
+        (cleaned up) msgstr contains one of the msgstr literals and the msgid
+        one of the msgid literals (see LiteralPrefilter). None means no requirement.
+        Wrappers which only suppress hits have the requirements of their child.
+        """
+        child = getattr(self, "child", None)
+        return child.required_literals() if child is not None else (None, None)
+
+    def set_patterns(self):
+        """
+        Get (msgstr pattern, msgid pattern): The rule can only hit if the
+        (cleaned up) msgstr matches the msgstr pattern and the msgid the
+        msgid pattern (see RegexSet). Patterns are (regex, flags) tuples and
+        only given for regexes compiled by RE2. None means no requirement.
+        """
+        child = getattr(self, "child", None)
+        return child.set_patterns() if child is not None else (None, None)
+
+    def vector_checks(self):
+        """
+        Get a list of checks which must all be true for the rule to hit
+        (see ArrowEngine) or None if the rule can't be checked column-wise.
+        Checks are (field, kind, pattern, negate) tuples: field is "msgstr"
+        (cleaned up) or "msgid", kind is "regex" (RE2 with inline flags),
+        "substring" or "isubstring" (case-insensitive).
+        """
+        child = getattr(self, "child", None)
+        return child.vector_checks() if child is not None else None
+
+    def plan_step(self):
+        """
+        For wrappers which can be flattened into a RulePlan: Get either
+        ("exclude", field, predicate) if the wrapper yields no hits when
+        predicate(value of the field) is true, or ("transform", "msgstr", function)
+        if it applies the child to function(msgstr). Fields are "msgstr", "msgid",
+        "tcomment" and "filename". None for rules which are not such wrappers.
+        """
+        return None
+
+    def substring_needle(self):
+        """
+        Get (substring, case insensitive) if the rule hits exactly when the
+        (cleaned up) msgstr contains the substring (lowercase if case insensitive),
+        with the substring as the only hit (see SubstringSet). None otherwise.
+        Wrappers return None, as they might change the strings or hits.
+        """
+        return None
+
+    def fingerprint_data(self):
+        """
+        Additional data the hits depend on, besides the constructor arguments
+        (e.g. the content of a text list file). Must be a string.
+        """
+        return ""
+
+    @property
+    def fingerprint(self):
+        """
+        Stable hash (hex) of the rule definition: Its type, constructor
+        arguments (including child rules) and fingerprint_data().
+        Rules with the same fingerprint generate the same hits.
+        """
+        fingerprint = getattr(self, "_fingerprint", None)
+        if fingerprint is None:
+            args, kwargs = self.init_args
+            desc = "{}({},{}){}".format(type(self).__name__, _stableRepr(args),
+                                        _stableRepr(kwargs), self.fingerprint_data())
+            fingerprint = hashlib.sha1(desc.encode("utf-8")).hexdigest()
+            self._fingerprint = fingerprint
+        return fingerprint
+
+    @property
+    def uses_tcomment(self):
+        """Whether the hits of this rule (including its children) depend on the tcomment"""
+        child = getattr(self, "child", None)
+        return child.uses_tcomment if child is not None else False
+
+    def _with_child(self, child):
+        """Copy of this wrapper with a different child rule"""
+        rule = copy.copy(self)
+        rule.__dict__.pop("_fingerprint", None)
+        rule.child = child
+        args, kwargs = self.init_args
+        rule.init_args = (tuple(child if arg is self.child else arg for arg in args),
+                          {key: child if arg is self.child else arg for key, arg in kwargs.items()})
+        return rule
+
+    def split_filename_gates(self):
+        """
+        Split the wrapper chain of this rule into the filename gates
+        (see is_filename_gate) and the content rule, which does not depend
+        on the filename. Gates don't modify the strings, so checking all gates
+        before applying the content rule is equivalent to applying this rule.
+        Returns (list of gates, content rule)
+        """
+        child = getattr(self, "child", None)
+        if child is None:
+            return [], self
+        gates, content = child.split_filename_gates()
+        if self.is_filename_gate:
+            return [self] + gates, content
+        return gates, (self if content is child else self._with_child(content))
+
     def __lt__(self, other):
         if self.severity != other.severity:
             return self.severity < other.severity
@@ -139,14 +416,16 @@ class Rule(object):
         """
         if ignore_untranslated and entry.is_untranslated:
             return
-        # Translated string cleanup
-        translated = cleanupTranslatedString(entry.translated)
-        # Apply the rule
-        for hit in self(translated, entry.english, entry.note or "", filename=filename):
-            #Find images in both original and new string
-            origImages = [h[0] for h in _extractImgRegex.findall(entry.english)]
-            translatedImages = [h[0] for h in _extractImgRegex.findall(translated)]
-            yield (entry, hit, filename, origImages, translatedImages)
+        yield from self.apply_to_prepared_entry(PreparedEntry(entry), filename)
+
+    def apply_to_prepared_entry(self, prepared, filename):
+        """
+        Apply to a PreparedEntry. When applying many rules to an entry,
+        prepare it only once.
+        Yields tuples entry, hit, filename, origImages, translatedImages
+        """
+        for hit in self(prepared.translated, prepared.english, prepared.note, filename=filename):
+            yield (prepared.entry, hit, filename, prepared.origImages, prepared.translatedImages)
 
     def apply_to_po(self, po, filename="[unknown file]", ignore_untranslated=True):
         """
@@ -179,9 +458,17 @@ class SimpleRegexRule(Rule):
         super().__init__(name, severity)
         self.re = reCompiler.compile(regex, flags)
         self.regex_str = regex
+        self.flags = flags
     @property
     def description(self):
         return "Matches regular expression '%s'" % self.regex_str
+    def required_literals(self):
+        return (required_literals(self.regex_str, self.flags), None)
+    def set_patterns(self):
+        return (_setPattern(self.re, self.regex_str, self.flags), None)
+    def vector_checks(self):
+        pattern = _vectorPattern(self.re, self.regex_str, self.flags)
+        return None if pattern is None else [("msgstr", "regex", pattern, False)]
     def __call__(self, msgstr, msgid, tcomment="", filename=None):
         for hit in self.re.findall(msgstr):
             if isinstance(hit, tuple):  # Regex has groups
@@ -202,6 +489,13 @@ class SimpleSubstringRule(Rule):
     @property
     def description(self):
         return "Matches substring '%s'" % self.substr
+    def required_literals(self):
+        literal = normalize_text(self.substr)
+        return ({literal} if len(literal) >= minLiteralLength else None, None)
+    def vector_checks(self):
+        return [("msgstr", "isubstring" if self.ci else "substring", self.substr, False)]
+    def substring_needle(self):
+        return (self.substr, self.ci)
     def __call__(self, msgstr, msgid, tcomment="", filename=None):
         # Case-insensitive preprocessing
         if self.ci:
@@ -221,11 +515,25 @@ class TranslationConstraintRule(Rule):
         super().__init__(name, severity)
         self.reOrig = reCompiler.compile(regexOrig, flags)
         self.reTranslated = reCompiler.compile(regexTranslated, flags)
+        self.flags = flags
         self.regex_orig_str = regexOrig
         self.regex_translated_str = regexTranslated
     @property
     def description(self):
         return "Matches '%s' if translated as '%s'" % (self.regex_orig_str, self.regex_translated_str)
+    def required_literals(self):
+        return (None, required_literals(self.regex_orig_str, self.flags))
+    def set_patterns(self):
+        return (None, _setPattern(self.reOrig, self.regex_orig_str, self.flags))
+    def vector_checks(self):
+        orig = _vectorPattern(self.reOrig, self.regex_orig_str, self.flags)
+        translated = _vectorPattern(self.reTranslated, self.regex_translated_str, self.flags)
+        if orig is None:
+            return None
+        checks = [("msgid", "regex", orig, False)]
+        if translated is not None:
+            checks.append(("msgstr", "regex", translated, True))
+        return checks
     def __call__(self, msgstr, msgid, tcomment="", filename=None):
         if self.reOrig.search(msgid) and not self.reTranslated.search(msgstr):
             yield "[failed constraint]"
@@ -242,11 +550,18 @@ class NegativeTranslationConstraintRule(Rule):
         super().__init__(name, severity)
         self.reOrig = reCompiler.compile(regexOrig, flags)
         self.reTranslated = reCompiler.compile(regexTranslated, flags)
+        self.flags = flags
         self.regex_orig_str = regexOrig
         self.regex_translated_str = regexTranslated
     @property
     def description(self):
         return "Matches '%s' if NOT translated as '%s'" % (self.regex_orig_str, self.regex_translated_str)
+    def required_literals(self):
+        return (required_literals(self.regex_translated_str, self.flags),
+                required_literals(self.regex_orig_str, self.flags))
+    def set_patterns(self):
+        return (_setPattern(self.reTranslated, self.regex_translated_str, self.flags),
+                _setPattern(self.reOrig, self.regex_orig_str, self.flags))
     def __call__(self, msgstr, msgid, tcomment="", filename=None):
         if self.reOrig.search(msgid) and self.reTranslated.search(msgstr):
             yield "[failed constraint]"
@@ -261,11 +576,16 @@ class DynamicTranslationIdentityRule(Rule):
         super().__init__(name, severity)
         self.regex_str = regex
         self.regex = reCompiler.compile(regex, flags)
+        self.flags = flags
         self.negative = negative
         self.group = group
     @property
     def description(self):
         return "Matches a match for '%s' if %spresent in the translated string" % (self.regex_str, "NOT " if self.negative else "")
+    def required_literals(self):
+        return (None, required_literals(self.regex_str, self.flags))
+    def set_patterns(self):
+        return (None, _setPattern(self.regex, self.regex_str, self.flags))
     def __call__(self, msgstr, msgid, tcomment="", filename=None):
         matches = self.regex.findall(msgid)
         if not matches: return
@@ -296,11 +616,12 @@ class ExactCopyRule(Rule):
     This can be used, for example, to ensure GUI elements, numbers or URLs are the same in
     both the translated text and the original.
     """
-    def __init__(self, name, regex, severity=Severity.standard, aliases=defaultdict(str), ignore_whitespace=False, group=None):
+    def __init__(self, name, regex, severity=Severity.standard, aliases=None, ignore_whitespace=False, group=None):
         super().__init__(name, severity)
         self.regex = reCompiler.compile(regex)
         self.regex_str = regex
-        self.aliases = aliases
+        # Never modified, as the aliases are part of the rule fingerprint
+        self.aliases = {} if aliases is None else aliases
         self.group = group
         self.ignore_whitespace = ignore_whitespace
     @property
@@ -310,8 +631,8 @@ class ExactCopyRule(Rule):
         origMatches = self.regex.findall(msgid)
         translatedMatches = self.regex.findall(msgstr)
         # Apply aliases
-        origMatches = [self.aliases[x] or x for x in origMatches]
-        translatedMatches = [self.aliases[x] or x for x in translatedMatches]
+        origMatches = [self.aliases.get(x) or x for x in origMatches]
+        translatedMatches = [self.aliases.get(x) or x for x in translatedMatches]
         # Check length
         if len(origMatches) > len(translatedMatches):
             yield "{0} english matches but only {1} translated matches".format(
@@ -364,8 +685,13 @@ class IgnoreByFilenameRegexWrapper(Rule):
             return "%s (only applied to filenames matching '%s')" % (self.child.description, self.filename_regex_str)
         else:
             return "%s (ignored for filenames matching '%s')" % (self.child.description, self.filename_regex_str)
+    is_filename_gate = True
+    def accepts_filename(self, filename):
+        return bool(self.filename_regex.match(filename)) == self.invert
+    def plan_step(self):
+        return ("exclude", "filename", lambda filename: not self.accepts_filename(filename))
     def __call__(self, msgstr, msgid, tcomment="", filename=None):
-        if bool(self.filename_regex.match(filename)) != self.invert:
+        if not self.accepts_filename(filename):
             return None
         yield from self.child(msgstr, msgid, tcomment, filename)
 
@@ -381,8 +707,13 @@ class IgnoreByFilenameListWrapper(Rule):
     @property
     def description(self):
         return "%s (ignored for files %s)" % (self.child.description, str(list(self.filenames)))
+    is_filename_gate = True
+    def accepts_filename(self, filename):
+        return filename not in self.filenames
+    def plan_step(self):
+        return ("exclude", "filename", self.filenames.__contains__)
     def __call__(self, msgstr, msgid, tcomment="", filename=None):
-        if filename in self.filenames:
+        if not self.accepts_filename(filename):
             return None
         yield from self.child(msgstr, msgid, tcomment, filename)
 
@@ -405,6 +736,8 @@ class IgnoreByMsgidRegexWrapper(Rule):
     @property
     def description(self):
         return "%s (ignored for msgids matching '%s')" % (self.child.description, self.msgid_regex_str)
+    def plan_step(self):
+        return ("exclude", "msgid", self.msgid_regex.search)
     def __call__(self, msgstr, msgid, tcomment="", filename=None):
         if self.msgid_regex.search(msgid):
             return None
@@ -430,6 +763,8 @@ class IgnoreByMsgstrRegexWrapper(Rule):
     @property
     def description(self):
         return "%s (ignored for msgids matching '%s')" % (self.child.description, self.msgid_regex_str)
+    def plan_step(self):
+        return ("exclude", "msgstr", self.msgstr_regex.search)
     def __call__(self, msgstr, msgid, tcomment="", filename=None):
         if self.msgstr_regex.search(msgstr):
             return None
@@ -454,8 +789,16 @@ class IgnoreByTcommentRegexWrapper(Rule):
     @property
     def description(self):
         return "%s (ignored for tcomments matching '%s')" % (self.child.description, self.tcomment_regex_str)
+    @property
+    def uses_tcomment(self):
+        return True
+    def matches_tcomment(self, tcomment):
+        # tcomment might be a lazily loaded note (see Corpus.CorpusNote)
+        return self.tcommentRegex.search(str(tcomment))
+    def plan_step(self):
+        return ("exclude", "tcomment", self.matches_tcomment)
     def __call__(self, msgstr, msgid, tcomment="", filename=None):
-        if self.tcommentRegex.search(tcomment):
+        if self.matches_tcomment(tcomment):
             return None
         yield from self.child(msgstr, msgid, tcomment, filename)
 
@@ -466,36 +809,46 @@ class TextListRule(Rule):
 
     If the file does not exist, this method prints a red bold error message and does not
     generate any rule hits
+
+    The strings are matched as whole words using a WordListMatcher, which
+    scales to large lists (in contrast to one large regex alternation).
     """
     def __init__(self, name, filename, severity=Severity.standard, flags=re.UNICODE):
         super().__init__(name, severity)
         self.filename = filename
         regexes = set()
+        self.regexes = regexes
+        self.flags = flags
         self.valid = False
         # Check if file exists
         if os.path.isfile(filename):
+            terms = set()
             with open(filename) as infile:
                 for line in infile:
-                    rgx = line.strip().replace(" ", r"\s+")
+                    term = line.strip()
+                    if not term:
+                        continue
+                    terms.add(term)
                     # Don't match in the middle of a word
-                    rgx = r"\b{0}\b".format(rgx)
-                    regexes.add(rgx)
-            # Build large regex from all sub.regexes
-            self.regex = reCompiler.compile("|".join(regexes), flags=flags)
+                    regexes.add(r"\b{0}\b".format(term.replace(" ", r"\s+")))
+            # Same semantics as the alternation of all terms compiled by reCompiler
+            self.matcher = WordListMatcher(terms, flags=flags, compiler=reCompiler)
             self.valid = True
         else:  # File does not exist
             print(red("Unable to find text list file %s" % filename, bold=True))
     @property
     def description(self):
         return "Matches one of the strings in file %s" % self.filename
+    def required_literals(self):
+        if not self.valid:
+            return (None, None)
+        return (required_literals("|".join(self.regexes), self.flags), None)
+    def fingerprint_data(self):
+        return "\n".join(sorted(self.regexes))
     def __call__(self, msgstr, msgid, tcomment="", filename=None):
         if not self.valid:
             return
-        for hit in self.regex.findall(msgstr):
-            if isinstance(hit, tuple):  # Regex has groups
-                yield hit[0]
-            else:
-                yield hit
+        yield from self.matcher.findall(msgstr)
 
 
 def findRule(rules, name):
@@ -549,12 +902,24 @@ class IgnorePerseusCommandsRuleWrapper(Rule):
         super().__init__(child.name)
         self.child = child
         self.perseusList = getCachedKAPerseusCommands()
+        self.stripper = get_perseus_stripper(self.perseusList)
     @property
     def description(self):
         return "%s (ignored for Perseus commands)" % (self.child.description)
+    def required_literals(self):
+        # Removing the commands might join literals in the msgstr
+        return (None, self.child.required_literals()[1])
+    def set_patterns(self):
+        return (None, self.child.set_patterns()[1])
+    def vector_checks(self):
+        checks = [check for check in (self.child.vector_checks() or []) if check[0] == "msgid"]
+        return checks or None
+    def fingerprint_data(self):
+        return "\n".join(self.perseusList)
+    def plan_step(self):
+        return ("transform", "msgstr", self.stripper.strip)
     def __call__(self, msgstr, msgid, tcomment="", filename=None):
-        for cmd in self.perseusList:
-            msgstr = msgstr.replace("\\{0}".format(cmd), "")
+        msgstr = self.stripper.strip(msgstr)
         yield from self.child(msgstr, msgid, tcomment, filename)
 
 def readRulesFromGDocs(ssid):
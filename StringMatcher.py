@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+r"""
+Multi-needle substring matching (Aho-Corasick).
+
+A MultiStringMatcher finds which of a (large) set of needles occur in a
+text in a single pass over the text, regardless of the number of needles.
+If pyahocorasick is installed, its C automaton is used,
+otherwise a pure-Python automaton.
+
+A WordListMatcher builds on it to find whole words & phrases of a word list,
+like a \b(word1|word2|...)\b regex.
+"""
+import re
+
+class PurePythonAutomaton(object):
+    """
+    Aho-Corasick automaton. States are integers, 0 is the root.
+    The output of a state contains the needles of all its fail states,
+    so no fail chain needs to be followed when collecting matches.
+    """
+    def __init__(self, needles):
+        self._goto = [{}]
+        self._output = [()]
+        # Build the trie
+        for idx, needle in enumerate(needles):
+            state = 0
+            for char in needle:
+                nextState = self._goto[state].get(char)
+                if nextState is None:
+                    nextState = len(self._goto)
+                    self._goto.append({})
+                    self._output.append(())
+                    self._goto[state][char] = nextState
+                state = nextState
+            self._output[state] += ((idx, len(needle)),)
+        # Compute the fail links (BFS)
+        self._fail = [0] * len(self._goto)
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, nextState in self._goto[state].items():
+                queue.append(nextState)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[nextState] = fail if fail != nextState else 0
+                self._output[nextState] += self._output[self._fail[nextState]]
+
+    def iter(self, text):
+        """Yield (end index, (needle index, needle length)) for every occurrence"""
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for pos, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for match in output[state]:
+                yield pos, match
+
+def _make_automaton(needles):
+    try:
+        import ahocorasick
+    except ImportError:
+        return PurePythonAutomaton(needles)
+    automaton = ahocorasick.Automaton()
+    for idx, needle in enumerate(needles):
+        automaton.add_word(needle, (idx, len(needle)))
+    automaton.make_automaton()
+    return automaton
+
+class MultiStringMatcher(object):
+    """
+    Finds occurrences of a fixed list of needles (non-empty strings) in texts.
+    Needles are identified by their index in the list.
+    """
+    def __init__(self, needles):
+        self.needles = list(needles)
+        # pyahocorasick can't build an automaton without words
+        self._automaton = _make_automaton(self.needles) if self.needles else None
+
+    def __len__(self):
+        return len(self.needles)
+
+    def find_all(self, text):
+        """Get the set of indices of the needles which occur in text"""
+        if self._automaton is None:
+            return set()
+        return {idx for _, (idx, _) in self._automaton.iter(text)}
+
+    def iter_matches(self, text):
+        """Yield (start, end, needle index) for every (possibly overlapping) occurrence"""
+        if self._automaton is None:
+            return
+        for end, (idx, length) in self._automaton.iter(text):
+            yield end + 1 - length, end + 1, idx
+
+# Characters with a special meaning in word list terms (which are regexes)
+_specialChars = set(".^$*+?{}[]\\|()")
+# Whitespace other than single spaces
+_irregularWhitespace = re.compile(r"\s\s|[^\S ]")
+_whitespace = re.compile(r"\s+")
+# The same for RE2, whose \s only matches ASCII whitespace
+_irregularASCIIWhitespace = re.compile(r"[\t\n\f\r ]{2}|[\t\n\f\r]")
+_asciiWhitespace = re.compile(r"[\t\n\f\r ]+")
+
+def _is_word_char(char):
+    """Same as \\w in (unicode) re regexes"""
+    return char.isalnum() or char == "_"
+
+def _is_ascii_word_char(char):
+    """Same as \\w in RE2 regexes (ASCII only)"""
+    return char < "\x80" and (char.isalnum() or char == "_")
+
+def _is_boundary(text, pos, is_word_char=_is_word_char):
+    """Same as \\b at the given position in (unicode) re regexes (or RE2 regexes, see is_word_char)"""
+    before = pos > 0 and is_word_char(text[pos - 1])
+    after = pos < len(text) and is_word_char(text[pos])
+    return before != after
+
+def _is_plain_term(term):
+    """Whether a term is a literal (with single spaces) the automaton can match"""
+    return not (_specialChars.intersection(term) or _irregularWhitespace.search(term))
+
+def _collapse_whitespace(text, whitespace=_whitespace):
+    """
+    Replace every whitespace run of the text by a single space.
+    Returns (collapsed text, original index of every character of the collapsed text).
+    """
+    parts, offsets = [], []
+    pos = 0
+    for match in whitespace.finditer(text):
+        parts.append(text[pos:match.start()])
+        offsets.extend(range(pos, match.start()))
+        parts.append(" ")
+        offsets.append(match.start())
+        pos = match.end()
+    parts.append(text[pos:])
+    offsets.extend(range(pos, len(text)))
+    return "".join(parts), offsets
+
+class WordListMatcher(object):
+    """
+    Finds whole-word occurrences of the terms of a word list in texts.
+    Equivalent to re.findall(r"\\bterm1\\b|\\bterm2\\b|...") where a space in a term
+    matches any whitespace run (\\s+), with two differences:
+    Of several terms matching at the same position, the longest one wins
+    (instead of the first one in the alternation) and the hits are always
+    the whole matches (even if a term contains groups).
+
+    Literal terms are matched using a MultiStringMatcher in a single pass,
+    so the time per text does not depend on the number of terms.
+    Word boundaries are checked afterwards. The (few) terms using regex
+    syntax are combined into one regex.
+
+    By default, the regex is compiled using re, so word characters (\\w, \\b)
+    and whitespace are Unicode. If a CompatibilityRegexCompiler (see Rules)
+    is given as compiler, the regex is compiled using it instead. If it compiles
+    the regex using RE2 (or if there are only literal terms), the literal terms
+    are matched with RE2 semantics as well: Only ASCII characters are word
+    characters, e.g. "teh" is a whole word in "üteh", and only ASCII whitespace
+    matches a space. This is what the alternation of all terms would match
+    unless it exceeds RE2's memory budget (then re would have been used).
+    """
+    def __init__(self, terms, flags=re.UNICODE, compiler=None):
+        terms = sorted({term for term in terms if term})
+        # The automaton is case-sensitive
+        literal = not (flags & ~re.UNICODE)
+        plainTerms = [term for term in terms if literal and _is_plain_term(term)]
+        regexTerms = [term for term in terms if not (literal and _is_plain_term(term))]
+        self.numTerms = len(terms)
+        self.matcher = MultiStringMatcher(plainTerms)
+        self.hasSpaces = any(" " in term for term in plainTerms)
+        self.regex = None
+        if regexTerms:
+            regex = "|".join(r"\b{0}\b".format(term.replace(" ", r"\s+")) for term in regexTerms)
+            self.regex = re.compile(regex, flags) if compiler is None else compiler.compile(regex, flags)
+        # Match the literal terms like the regex engine
+        self.ascii = compiler is not None and (self.regex is None or compiler.is_re2(self.regex))
+        self._isWordChar = _is_ascii_word_char if self.ascii else _is_word_char
+        self._irregularWhitespace = _irregularASCIIWhitespace if self.ascii else _irregularWhitespace
+        self._whitespace = _asciiWhitespace if self.ascii else _whitespace
+
+    def __len__(self):
+        return self.numTerms
+
+    def _plain_matches(self, text):
+        """All (start, end) of whole-word plain term occurrences, leftmost & longest first"""
+        view, offsets = text, None
+        if self.hasSpaces and self._irregularWhitespace.search(text):
+            view, offsets = _collapse_whitespace(text, self._whitespace)
+        matches = []
+        isWordChar = self._isWordChar
+        for start, end, _ in self.matcher.iter_matches(view):
+            if offsets is not None:
+                start, end = offsets[start], offsets[end - 1] + 1
+            if _is_boundary(text, start, isWordChar) and _is_boundary(text, end, isWordChar):
+                matches.append((start, end))
+        matches.sort(key=lambda match: (match[0], -match[1]))
+        return matches
+
+    def iter_spans(self, text):
+        """Yield the (start, end) of the non-overlapping occurrences (like re.finditer)"""
+        matches = self._plain_matches(text)
+        matchIdx = 0
+        regexMatch = None
+        searchRegex = self.regex is not None
+        pos = 0
+        while pos <= len(text):
+            while matchIdx < len(matches) and matches[matchIdx][0] < pos:
+                matchIdx += 1
+            plainMatch = matches[matchIdx] if matchIdx < len(matches) else None
+            if searchRegex and (regexMatch is None or regexMatch.start() < pos):
+                regexMatch = self.regex.search(text, pos)
+                searchRegex = regexMatch is not None
+            if regexMatch is not None and (plainMatch is None or
+                    (regexMatch.start(), -regexMatch.end()) < (plainMatch[0], -plainMatch[1])):
+                match = (regexMatch.start(), regexMatch.end())
+            elif plainMatch is not None:
+                match = plainMatch
+            else:
+                return
+            yield match
+            pos = match[1] if match[1] > match[0] else match[1] + 1
+
+    def findall(self, text):
+        """Get the list of the non-overlapping occurrences (like re.findall)"""
+        return [text[start:end] for start, end in self.iter_spans(text)]
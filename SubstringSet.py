@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Batched evaluation of substring rules (see SimpleSubstringRule).
+
+Without it, every substring rule searches the msgstr of each entry
+(and case-insensitive rules lowercase it first). A RuleSubstringSet adds
+the substrings of all such rules to two multi-needle matchers (see
+StringMatcher): One for the case-sensitive substrings, which scans the
+msgstr, and one for the case-insensitive ones, which scans the lowercase
+msgstr (computed once per entry, see PreparedEntry.translatedLower).
+One scan per entry yields exactly the substring rules which hit, so the
+time per entry hardly grows with the number of substring rules.
+"""
+from StringMatcher import MultiStringMatcher
+
+class RuleSubstringSet(object):
+    """
+    Determines which substring rules hit an entry.
+
+    needles is a list with one (substring, case insensitive) tuple or None
+    per rule (see Rule.substring_needle()). Case-insensitive substrings
+    must already be lowercase.
+    """
+    def __init__(self, needles):
+        self.needles = {ruleIdx: needle for ruleIdx, needle in enumerate(needles)
+                        if needle is not None}
+        # Every string contains the empty string
+        self.always = {ruleIdx for ruleIdx, (substring, _) in self.needles.items() if not substring}
+        self.matchers = []
+        self.substringRules = [] # per case: substring index => rule indices
+        for caseInsensitive in (False, True):
+            bySubstring = {} # substring => rule indices
+            for ruleIdx, needle in enumerate(needles):
+                if needle is not None and needle[0] and needle[1] == caseInsensitive:
+                    bySubstring.setdefault(needle[0], []).append(ruleIdx)
+            self.matchers.append(MultiStringMatcher(bySubstring.keys()))
+            self.substringRules.append(list(bySubstring.values()))
+
+    @property
+    def rules(self):
+        """The indices of the rules in the set"""
+        return self.needles.keys()
+
+    def __len__(self):
+        return len(self.needles)
+
+    def rule_hits(self, ruleIdx, msgstr, msgstrLower):
+        """Get the hits of a single rule of the set (like the rule would yield them)"""
+        substring, caseInsensitive = self.needles[ruleIdx]
+        return (substring,) if substring in (msgstrLower if caseInsensitive else msgstr) else ()
+
+    def hits(self, msgstr, msgstrLower):
+        """Get the set of indices of the rules which hit a (cleaned up) msgstr"""
+        result = set(self.always)
+        for matcher, substringRules, text in zip(self.matchers, self.substringRules, (msgstr, msgstrLower)):
+            if not len(matcher):
+                continue
+            for substringIdx in matcher.find_all(text):
+                result.update(substringRules[substringIdx])
+        return result
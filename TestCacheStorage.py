@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Tests for CacheStorage: Compressed files and packs.
+
+Run using ./TestCacheStorage.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from CacheStorage import *
+
+class CacheStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.langdir = os.path.join(self.tmpdir, "cache", "de")
+        os.makedirs(os.path.dirname(self.langdir))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_file(self, relpath, data, compression=None):
+        filename = stored_filename(os.path.join(self.langdir, relpath), compression)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open_cache_file(filename, "wb") as outfile:
+            outfile.write(data)
+        return filename
+
+    def write_pack(self, members):
+        writer = CachePackWriter(self.langdir)
+        for relpath, data in members.items():
+            writer.add(relpath, data)
+        writer.close()
+
+    def read(self, filename):
+        with open_cache_file(filename) as infile:
+            return infile.read()
+
+    def test_compressed_files(self):
+        for compression in [None, "gzip"]:
+            filename = self.write_file("a.xliff", b"<xliff/>", compression)
+            self.assertEqual(self.read(filename), b"<xliff/>")
+            self.assertEqual(list_cache_files(self.langdir, ".xliff"), [filename])
+            os.remove(filename)
+
+    def test_read_pack_members(self):
+        self.write_pack({
+            "dir/a.xliff": b"<a/>",
+            "b.xliff.gz": compress_bytes(b"<b/>", "gzip"),
+            "c.txt": b"c"})
+        a = os.path.join(self.langdir, "dir", "a.xliff")
+        # Compressed members are addressed with & without suffix
+        b = os.path.join(self.langdir, "b.xliff.gz")
+        self.assertEqual(self.read(a), b"<a/>")
+        self.assertEqual(self.read(b), b"<b/>")
+        self.assertEqual(self.read(os.path.join(self.langdir, "b.xliff")), b"<b/>")
+        self.assertEqual(sorted(list_cache_files(self.langdir, ".xliff")), sorted([a, b]))
+        self.assertEqual(stat_cache_file(a)[0], 4)
+        self.assertEqual(len(hash_cache_file(a)), 4)  # CRC32
+
+    def test_missing_files(self):
+        # Must not loop forever for absolute paths which are not in a pack
+        filename = os.path.join(self.tmpdir, "nonexistent", "a.xliff")
+        self.assertTrue(os.path.isabs(filename))
+        with self.assertRaises(FileNotFoundError):
+            open_cache_file(filename)
+        with self.assertRaises(FileNotFoundError):
+            stat_cache_file(filename)
+        self.write_pack({"a.xliff": b"<a/>"})
+        with self.assertRaises(FileNotFoundError):
+            open_cache_file(os.path.join(self.langdir, "b.xliff"))
+
+    def test_partial_pack_update(self):
+        self.write_pack({"a.xliff": b"old a", "b.xliff": b"old b"})
+        # Only a is re-downloaded (compressed this time)
+        self.write_pack({"a.xliff.gz": compress_bytes(b"new a", "gzip")})
+        self.assertEqual(self.read(os.path.join(self.langdir, "a.xliff")), b"new a")
+        self.assertEqual(self.read(os.path.join(self.langdir, "b.xliff")), b"old b")
+        self.assertEqual(len(list_cache_files(self.langdir, ".xliff")), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Tests for Corpus: Compacting a language, detecting outdated corpora
+and the rule matches of the indices of a corpus (WordIndex, TrigramIndex).
+
+Run using ./TestCorpus.py
+"""
+import json
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from TestSupport import write_xliff, nested_hits, evaluator_hits
+
+_files = {
+    "a.xliff": [
+        ("1", "Hello world", "Hallo Welt", "Greeting"),
+        ("2", "Untranslated", None, ""),
+    ],
+    os.path.join("sub", "b.xliff"): [
+        ("3", "Check your answer", "Überprüfe deine Antwort", ""),
+        ("4", "Hello world", "Hallo Welt", ""),
+    ],
+}
+
+class CorpusTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # The corpus & the XLIFF files use paths relative to the working directory
+        cls.olddir = os.getcwd()
+        cls.tmpdir = tempfile.mkdtemp()
+        os.chdir(cls.tmpdir)
+        os.makedirs("cache")
+        with open(os.path.join("cache", "languages.json"), "w") as outfile:
+            json.dump({"de": 1}, outfile)
+        # findXLIFFFiles() only uses files in the filemap
+        with open(os.path.join("cache", "translation-filemap-de.json"), "w") as outfile:
+            json.dump({"a.pot": {"id": 1}, "b.pot": {"id": 2}, "c.pot": {"id": 3}, "d.pot": {"id": 4}}, outfile)
+        cls.files = []
+        for relpath, units in sorted(_files.items()):
+            filename = os.path.join("cache", "de", relpath)
+            write_xliff(filename, units)
+            cls.files.append((filename, relpath))
+        # One compressed file
+        from CacheStorage import open_cache_file
+        cls.compressed = os.path.join("cache", "de", "c.xliff.gz")
+        with open(cls.files[0][0], "rb") as infile:
+            data = infile.read()
+        with open_cache_file(cls.compressed, "wb") as outfile:
+            outfile.write(data.replace(b"Hello", b"Howdy"))
+        cls.files.append((cls.compressed, "c.xliff"))
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls.olddir)
+        shutil.rmtree(cls.tmpdir)
+
+    def setUp(self):
+        from Corpus import build_corpus
+        build_corpus("de")
+
+    def test_roundtrip(self):
+        from Corpus import open_corpus
+        from XLIFFReader import read_xliff_entries
+        corpus = open_corpus("de")
+        self.assertIsNotNone(corpus)
+        self.assertEqual(sorted(fileinfo["path"] for fileinfo in corpus.files),
+                         sorted(relpath for _, relpath in self.files))
+        for filename, relpath in self.files:
+            self.assertIn(relpath, corpus)
+            self.assertEqual(list(corpus.file_entries(relpath)), read_xliff_entries(filename))
+            self.assertEqual(list(corpus.file_entries(relpath, ignore_untranslated=True)),
+                             read_xliff_entries(filename, ignore_untranslated=True))
+        self.assertEqual(len(corpus), sum(len(units) for units in _files.values()) + 2)
+        self.assertEqual(corpus.stale_files(os.path.join("cache", "de")), [])
+
+    def test_broken_files(self):
+        from Corpus import build_corpus, open_corpus, CorpusWriter
+        from XLIFFReader import XLIFFEntry
+        # A truncated file is skipped, all other files are compacted
+        broken = os.path.join("cache", "de", "d.xliff")
+        with open(self.files[0][0]) as infile:
+            data = infile.read()
+        with open(broken, "w") as outfile:
+            outfile.write(data[:data.index("</trans-unit>") + 20])
+        self.addCleanup(os.remove, broken)
+        writer = build_corpus("de")
+        self.assertEqual(writer.num_entries, sum(len(units) for units in _files.values()) + 2)
+        corpus = open_corpus("de")
+        self.assertNotIn("d.xliff", corpus)
+        self.assertEqual(sorted(fileinfo["path"] for fileinfo in corpus.files),
+                         sorted(relpath for _, relpath in self.files))
+        self.assertEqual([name for name in os.listdir("cache") if name.endswith(".tmp")], [])
+        # An exception discards the temporary file
+        with self.assertRaises(RuntimeError):
+            with CorpusWriter(os.path.join("cache", "broken.corpus")) as writer:
+                writer.add_file("a.xliff", [XLIFFEntry("1", "a", "b", False, False, "")])
+                raise RuntimeError("Compaction failed")
+        self.assertFalse(os.path.exists(os.path.join("cache", "broken.corpus")))
+        self.assertEqual([name for name in os.listdir("cache") if name.endswith(".tmp")], [])
+
+    def test_outdated_files(self):
+        from Corpus import open_corpus
+        for filename, relpath in self.files:
+            stat = os.stat(filename)
+            os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            self.assertIsNone(open_corpus("de"))
+            self.assertEqual(open_corpus("de", check=False).stale_files(os.path.join("cache", "de")), [relpath])
+            os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            self.assertIsNotNone(open_corpus("de"))
+        # Removed file
+        filename, relpath = self.files[-1]
+        os.rename(filename, filename + ".bak")
+        try:
+            self.assertIsNone(open_corpus("de"))
+            self.assertEqual(open_corpus("de", check=False).stale_files(os.path.join("cache", "de")), [relpath])
+        finally:
+            os.rename(filename + ".bak", filename)
+
+    def test_outdated_version(self):
+        from Corpus import open_corpus, corpus_filename, _headerStruct, _magic, _version
+        with open(corpus_filename("de"), "r+b") as outfile:
+            header = list(_headerStruct.unpack(outfile.read(_headerStruct.size)))
+            self.assertEqual(header[:2], [_magic, _version])
+            header[1] = _version - 1
+            outfile.seek(0)
+            outfile.write(_headerStruct.pack(*header))
+        self.assertIsNone(open_corpus("de"))
+        self.assertIsNone(open_corpus("de", check=False))
+
+    def test_index_matches_outside_corpus(self):
+        from Corpus import Corpus, CorpusWriter
+        from XLIFFReader import stream_xliff_entries
+        from Rules import SimpleRegexRule, TranslationConstraintRule
+        from RuleEngine import RuleEvaluator
+        from WordIndex import WordIndex, compute_msgid_matches
+        from TrigramIndex import build_trigram_index, compute_trigram_matches
+        rules = [
+            TranslationConstraintRule("answer", r"\banswer\b", r"\bAntwort\b", flags=re.UNICODE | re.IGNORECASE),
+            # Not RE2 compatible => trigram index
+            SimpleRegexRule("Welt", r"Welt(?= )"),
+            TranslationConstraintRule("your answer", r"(?<=your )answer", r"Antwort"),
+        ]
+        # A new file, which is not part of the (outdated) corpus
+        extra = os.path.join("cache", "de", "extra.xliff")
+        write_xliff(extra, [("5", "Type your answer here", "Gib deine Lösung ein, Welt !", "")])
+        self.addCleanup(os.remove, extra)
+        files = self.files + [(extra, "extra.xliff")]
+        reference = nested_hits(rules, files)
+        self.assertEqual({key[2] for key in reference if key[0] == "extra.xliff"}, {0, 1, 2})
+        # Corpus & indices of all other files
+        writer = CorpusWriter(os.path.join("cache", "sub.corpus"))
+        for filename, relpath in self.files:
+            writer.add_file(relpath, stream_xliff_entries(filename))
+        writer.close()
+        corpus = Corpus(os.path.join("cache", "sub.corpus"))
+        evaluator = RuleEvaluator(rules)
+        wordMatches = compute_msgid_matches(WordIndex.build(corpus), evaluator)
+        self.assertEqual(wordMatches.rules, {0, 2})
+        trigramMatches = compute_trigram_matches(build_trigram_index("sub", corpus), evaluator)
+        self.assertEqual([matches.rules for matches in trigramMatches], [{1}, {2}])
+        for ruleMatches in [[wordMatches], trigramMatches]:
+            hits, _ = evaluator_hits(RuleEvaluator(rules, ruleMatches=ruleMatches), files, corpus=corpus)
+            self.assertEqual(hits, reference)
+
+if __name__ == "__main__":
+    unittest.main()
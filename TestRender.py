@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Smoke test for rendering the hits of a language (check.JSONHitRenderer).
+
+Run using ./TestRender.py
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from TestSupport import write_xliff
+
+class RenderTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # All paths used by the renderer are relative to the working directory
+        cls.olddir = os.getcwd()
+        cls.tmpdir = tempfile.mkdtemp()
+        os.chdir(cls.tmpdir)
+        os.makedirs("cache")
+        with open(os.path.join("cache", "languages.json"), "w") as outfile:
+            json.dump({"xx": 1}, outfile)
+        with open(os.path.join("cache", "translation-filemap-xx.json"), "w") as outfile:
+            json.dump({"a.pot": {"id": 1, "path": "a.pot"}}, outfile)
+        write_xliff(os.path.join("cache", "xx", "a.xliff"), [
+            ("1", "Hello", "Hallo Welt", "Greeting"),
+            ("2", "World", "Welt", ""),
+        ])
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls.olddir)
+        shutil.rmtree(cls.tmpdir)
+
+    def test_render(self):
+        import check
+        from Rules import SimpleSubstringRule
+        hitting = SimpleSubstringRule("Hallo", "Hallo")
+        nonHitting = SimpleSubstringRule("Nothing", "zzz")
+        check.importRulesForLanguage = lambda lang: ([hitting, nonHitting], [])
+        renderer = check.JSONHitRenderer("output", "xx", num_processes=1)
+        renderer.computeRuleHitsForFileSet({os.path.join("cache", "xx", "a.xliff"): 1})
+        # Rules without hits must be part of the stats
+        self.assertEqual(renderer.statsByFileAndRule["a.xliff"], {hitting: 1, nonHitting: 0})
+        self.assertEqual(renderer.totalStatsByRule, {hitting: 1, nonHitting: 0})
+        renderer.exportHitsAsJSON()
+        with open(os.path.join("output", "xx", "index.json")) as infile:
+            index = json.load(infile)
+        self.assertEqual([(info["name"], info["num_hits"]) for info in index["stats"]], [("Hallo", 1)])
+        with open(os.path.join("output", "xx", hitting.machine_name + ".json")) as infile:
+            hits = json.load(infile)["hits"]
+        self.assertFalse(os.path.exists(os.path.join("output", "xx", nonHitting.machine_name + ".json")))
+        self.assertEqual(len(hits), 1)
+        self.assertEqual(hits[0]["msgstr"], "Hallo Welt")
+        # The note is referred to by its ID in notes.json
+        with open(os.path.join("output", "xx", "notes.json")) as infile:
+            notes = json.load(infile)
+        self.assertEqual(notes[hits[0]["noteId"]], "Greeting")
+        self.assertTrue(os.path.isfile(os.path.join("output", "xx", "a.xliff", "index.json")))
+
+    def test_parquet_abort(self):
+        try:
+            import pyarrow
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        from HitExport import ParquetHitWriter
+        filename = os.path.join("output", "hits.parquet")
+        os.makedirs("output", exist_ok=True)
+        writer = ParquetHitWriter(filename, "xx", 0)
+        writer.abort()
+        writer.abort()
+        self.assertFalse(os.path.exists(filename))
+        self.assertFalse(os.path.exists(filename + ".tmp"))
+
+if __name__ == "__main__":
+    unittest.main()
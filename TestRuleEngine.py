@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Tests for RuleEngine: The RuleEvaluator pipeline (memo, prefilter, RE2 set,
+substring set, RulePlans, hit cache & Arrow matches) must produce
+the same hits as applying the nested rules to every entry.
+
+Run using ./TestRuleEngine.py
+"""
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from TestSupport import write_xliff, nested_hits, evaluator_hits
+
+# Shared by several files, so the memo is used
+_commonUnits = [
+    ("1", "Hello world", "Hallo  Welt", "Greeting"),
+    ("2", "Check your answer", "Überprüfe deine Antwort", ""),
+    ("3", "You have 3 apples ![](https://cdn.kastatic.org/a.png)",
+          "Du hast 4 Äpfel ![](https://cdn.kastatic.org/a.png)", ""),
+]
+_files = {
+    "a.xliff": _commonUnits + [
+        ("4", "Press $\\text{OK}$", "Drücke $\\text{Okay}$, hallo", ""),
+        ("5", "Untranslated answer", None, ""),
+        ("6", "The answer is 42", "Die Lösung ist 42", "Hello"),
+    ],
+    os.path.join("sub", "b.xliff"): _commonUnits + [
+        ("7", "Hello again", "Hallo Welt, HALLO", ""),
+        ("8", "3 apples and 4 apples", "3 Äpfel und 5 Äpfel", ""),
+    ],
+    "learn.c.xliff": _commonUnits + [
+        ("9", "World", "Welt  Welt", "Greeting"),
+        ("10", "See ![](https://cdn.kastatic.org/x.png)", "Siehe ![](https://cdn.kastatic.org/y.png)", ""),
+    ],
+}
+
+def make_rules(changed=False):
+    """A rule set covering all rule types & wrappers. changed: Change one rule & add one"""
+    from Rules import (SimpleRegexRule, SimpleSubstringRule, TranslationConstraintRule,
+        NegativeTranslationConstraintRule, DynamicTranslationIdentityRule, ExactCopyRule,
+        IgnoreByFilenameRegexWrapper, IgnoreByFilenameListWrapper, IgnoreByMsgidRegexWrapper,
+        IgnoreByMsgstrRegexWrapper, IgnoreByTcommentRegexWrapper, IgnorePerseusCommandsRuleWrapper)
+    rules = [
+        SimpleSubstringRule("Hallo", "Hallo"),
+        SimpleSubstringRule("hallo (ci)", "hallo", case_insensitive=True),
+        SimpleRegexRule("Double space", r"\s\s"),
+        SimpleRegexRule("Umlaut word", r"(Ä|Ü)(\w+)"),
+        TranslationConstraintRule("answer", r"\banswer\b", r"\bAntwort\b", flags=re.UNICODE | re.IGNORECASE),
+        NegativeTranslationConstraintRule("apples", r"apples", r"Äpfel"),
+        DynamicTranslationIdentityRule("Same text", r"\\text\{[^}]*\}"),
+        ExactCopyRule("Numbers", r"\d+"),
+        ExactCopyRule("Images", r"!\[\]\([^)]*\)", aliases={"x": "y"}),
+        IgnoreByFilenameRegexWrapper(r"^learn\.", SimpleRegexRule("Welt", r"Welt")),
+        IgnoreByFilenameRegexWrapper(r"^sub/", SimpleSubstringRule("Welt (sub only)", "Welt"), invert=True),
+        IgnoreByFilenameListWrapper([os.path.join("sub", "b.xliff")], SimpleSubstringRule("Antwort", "Antwort")),
+        IgnoreByMsgidRegexWrapper(r"Hello", SimpleRegexRule("Welt (not greeting)", r"\bWelt\b")),
+        IgnoreByMsgstrRegexWrapper(r"HALLO", SimpleSubstringRule("Hallo (not shouted)", "Hallo")),
+        IgnoreByTcommentRegexWrapper(r"Greeting", SimpleSubstringRule("Welt (no note)", "Welt")),
+        IgnorePerseusCommandsRuleWrapper(SimpleRegexRule("Text command", r"\\text")),
+        IgnoreByFilenameRegexWrapper(r"^learn\.", IgnoreByMsgidRegexWrapper(r"apples",
+            IgnorePerseusCommandsRuleWrapper(SimpleRegexRule("Nested", r"\bWelt|Okay")))),
+    ]
+    if changed:
+        rules[2] = SimpleRegexRule("Double space", r"\s\s+")
+        rules.append(SimpleRegexRule("Number", r"\d+"))
+    return rules
+
+class RuleEngineTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Rules & the XLIFF cache use paths relative to the working directory
+        cls.olddir = os.getcwd()
+        cls.tmpdir = tempfile.mkdtemp()
+        os.chdir(cls.tmpdir)
+        os.makedirs("cache")
+        with open(os.path.join("cache", "languages.json"), "w") as outfile:
+            json.dump({"xx": 1}, outfile)
+        with open(os.path.join("cache", "perseus-commands.txt"), "w") as outfile:
+            outfile.write("\\text\n\\frac")
+        cls.files = []
+        for relpath, units in sorted(_files.items()):
+            filename = os.path.join("cache", "xx", relpath)
+            write_xliff(filename, units)
+            cls.files.append((filename, relpath))
+        cls.rules = make_rules()
+        cls.reference = nested_hits(cls.rules, cls.files)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls.olddir)
+        shutil.rmtree(cls.tmpdir)
+
+    def test_reference(self):
+        # Every rule hits somewhere, every file has hits
+        self.assertEqual({key[2] for key in self.reference}, set(range(len(self.rules))))
+        self.assertEqual({key[0] for key in self.reference}, {relpath for _, relpath in self.files})
+
+    def test_pipeline(self):
+        from RuleEngine import RuleEvaluator
+        evaluator = RuleEvaluator(self.rules, verify_plans=True)
+        hits, stats = evaluator_hits(evaluator, self.files)
+        self.assertEqual(hits, self.reference)
+        self.assertEqual(stats["plan mismatches"], 0)
+        self.assertGreater(stats["memo"], 0)
+        self.assertGreater(stats["rules skipped"], 0)
+
+    def test_memo_size(self):
+        from RuleEngine import RuleEvaluator
+        evaluator = RuleEvaluator(self.rules, memo_size=2)
+        hits, _ = evaluator_hits(evaluator, self.files)
+        self.assertEqual(hits, self.reference)
+        self.assertEqual(len(evaluator.memo), 2)
+
+    def test_prefilter_posix_class(self):
+        # The re parser reads [[:alpha:]] as a nested set, RE2 as a POSIX class
+        from Rules import SimpleRegexRule, reCompiler
+        from RuleEngine import RuleEvaluator
+        from LiteralPrefilter import required_literals
+        rules = [SimpleRegexRule("POSIX class", r"[[:alpha:]]ü")]
+        if not reCompiler.is_re2(rules[0].re):
+            self.skipTest("RE2 is not installed")
+        self.assertIsNone(required_literals(rules[0].regex_str))
+        reference = nested_hits(rules, self.files)
+        self.assertTrue(reference)
+        hits, _ = evaluator_hits(RuleEvaluator(rules), self.files)
+        self.assertEqual(hits, reference)
+
+    def test_worker(self):
+        from RuleEngine import init_worker, evaluate_file_in_worker, serialize_rules
+        init_worker(serialize_rules(self.rules))
+        hits, _ = evaluator_hits(None, self.files, evaluate_file_in_worker)
+        self.assertEqual(hits, self.reference)
+
+    def test_hit_cache(self):
+        from RuleEngine import RuleEvaluator, content_fingerprints
+        from RuleHitCache import RuleHitCache
+        cacheFile = os.path.join(self.tmpdir, "hits.sqlite")
+        self.addCleanup(os.remove, cacheFile)
+        # Cold, then warm cache (new evaluators, so nothing is memoized)
+        for source in ["evaluated", "cache"]:
+            hitCache = RuleHitCache(cacheFile, "xx", content_fingerprints(self.rules))
+            hits, stats = evaluator_hits(RuleEvaluator(self.rules, hitCache), self.files)
+            self.assertEqual(hits, self.reference)
+            self.assertEqual(stats[source] + stats["memo"], stats["entries"])
+            # close() closes the connections of all threads
+            connections = [conn for _, conn in hitCache._connections]
+            self.assertTrue(connections)
+            hitCache.close()
+            self.assertEqual(hitCache._connections, [])
+            for conn in connections:
+                self.assertRaises(sqlite3.ProgrammingError, conn.execute, "SELECT 1")
+        # Incremental: Only the changed & added rules are evaluated
+        rules = make_rules(changed=True)
+        hitCache = RuleHitCache(cacheFile, "xx", content_fingerprints(rules))
+        hits, stats = evaluator_hits(RuleEvaluator(rules, hitCache), self.files)
+        self.assertEqual(hits, nested_hits(rules, self.files))
+        self.assertEqual(stats["partial"] + stats["memo"], stats["entries"])
+        self.assertEqual(stats["rules applied"] + stats["rules skipped"], 2 * stats["partial"])
+
+    def test_arrow(self):
+        try:
+            import pyarrow
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        from RuleEngine import RuleEvaluator
+        from ArrowEngine import compute_vector_matches
+        ruleMatches = compute_vector_matches(RuleEvaluator(self.rules), self.files)
+        self.assertTrue(ruleMatches.rules)
+        hits, _ = evaluator_hits(RuleEvaluator(self.rules, ruleMatches=[ruleMatches]), self.files)
+        self.assertEqual(hits, self.reference)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Tests for StringMatcher: MultiStringMatcher & WordListMatcher.
+
+Run using ./TestStringMatcher.py
+"""
+import re
+import unittest
+from StringMatcher import *
+
+class FakeCompiler(object):
+    """
+    Stands in for a CompatibilityRegexCompiler. RE2 is emulated
+    using ASCII-only re regexes, so cffi_re2 is not required.
+    """
+    def __init__(self, re2=True):
+        self.re2 = re2
+    def compile(self, rgx, flags=0):
+        return re.compile(rgx, (flags & ~re.UNICODE) | re.ASCII) if self.re2 else re.compile(rgx, flags)
+    def is_re2(self, regex):
+        return self.re2
+
+def regex_findall(terms, text, flags=re.UNICODE):
+    """Hits of the (longest first) regex alternation the matcher replaces"""
+    terms = sorted(terms, key=len, reverse=True)
+    regex = "|".join(r"\b{0}\b".format(term.replace(" ", r"\s+")) for term in terms)
+    return re.findall(regex, text, flags)
+
+def regex_findall_ascii(terms, text):
+    return regex_findall(terms, text, re.ASCII)
+
+class MultiStringMatcherTest(unittest.TestCase):
+    def test_matches(self):
+        matcher = MultiStringMatcher(["he", "she", "hers"])
+        self.assertEqual(sorted(matcher.iter_matches("ushers")), [(1, 4, 1), (2, 4, 0), (2, 6, 2)])
+        self.assertEqual(matcher.find_all("ushers"), {0, 1, 2})
+        self.assertEqual(matcher.find_all("his"), set())
+
+class WordListMatcherTest(unittest.TestCase):
+    def test_whole_words(self):
+        matcher = WordListMatcher(["teh", "adn"])
+        self.assertEqual(matcher.findall("teh cat adn tehdog"), ["teh", "adn"])
+        self.assertEqual(matcher.findall("_teh 1adn"), [])
+
+    def test_umlaut_boundaries(self):
+        text = "üteh tehä teh"
+        # re: umlauts are word characters
+        matcher = WordListMatcher(["teh"])
+        self.assertFalse(matcher.ascii)
+        self.assertEqual(matcher.findall(text), ["teh"])
+        self.assertEqual(matcher.findall(text), regex_findall(["teh"], text))
+        # RE2: only ASCII characters are word characters
+        matcher = WordListMatcher(["teh"], compiler=FakeCompiler())
+        self.assertTrue(matcher.ascii)
+        self.assertEqual(matcher.findall(text), ["teh", "teh", "teh"])
+        self.assertEqual(matcher.findall(text), regex_findall_ascii(["teh"], text))
+        # Regex terms RE2 can't compile fall back to re, and so do the plain terms
+        matcher = WordListMatcher(["teh", "t(?=eh)eh"], compiler=FakeCompiler(re2=False))
+        self.assertFalse(matcher.ascii)
+        self.assertEqual(matcher.findall(text), ["teh"])
+
+    def test_whitespace_collapsing(self):
+        matcher = WordListMatcher(["a lot", "alot"])
+        # Hits are the original text
+        self.assertEqual(matcher.findall("a  lot, a\nlot, a\tlot, alot"),
+                         ["a  lot", "a\nlot", "a\tlot", "alot"])
+        # Non-ASCII whitespace only matches a space with re
+        text = "a lot, a  lot"
+        self.assertEqual(matcher.findall(text), ["a lot", "a  lot"])
+        self.assertEqual(WordListMatcher(["a lot"], compiler=FakeCompiler()).findall(text), [])
+
+    def test_regex_term_merging(self):
+        terms = ["foo", "foo bar", r"fo+ ba[rz] baz", r"ba[rz]"]
+        matcher = WordListMatcher(terms)
+        self.assertIsNotNone(matcher.regex)
+        # Leftmost, then longest, across plain & regex terms
+        text = "foo bar baz, foo bar, baz foo, fooo baz baz"
+        self.assertEqual(matcher.findall(text),
+                         ["foo bar baz", "foo bar", "baz", "foo", "fooo baz baz"])
+        self.assertEqual(matcher.findall(text), regex_findall(terms, text))
+
+    def test_flags(self):
+        # Case-insensitive lists are matched by the regex only
+        matcher = WordListMatcher(["teh"], flags=re.UNICODE | re.IGNORECASE)
+        self.assertEqual(matcher.findall("Teh TEH"), ["Teh", "TEH"])
+
+    def test_regex_equivalence(self):
+        terms = ["teh", "adn", "a lot", "alot", "wierd", r"recie?ve", "über", "straße"]
+        texts = ["Teh teh adn, a lot of a  lot alot.", "Wierd wierd! Ich recieve & recive.",
+                 "über-teh, dasüber straße_ straße", "ä teh ö adn_ x", ""]
+        for text in texts:
+            self.assertEqual(WordListMatcher(terms).findall(text), regex_findall(terms, text))
+            self.assertEqual(WordListMatcher(terms, compiler=FakeCompiler()).findall(text),
+                             regex_findall_ascii(terms, text))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Fixtures shared by the Test*.py modules (not a test itself).
+"""
+import collections
+import os
+
+def write_xliff(filename, units):
+    """Write a XLIFF file with the given (id, english, translated, note) units. translated=None: untranslated"""
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "w") as outfile:
+        outfile.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                      '<xliff xmlns="urn:oasis:names:tc:xliff:document:1.2" version="1.2">'
+                      '<file original="a.pot" target-language="xx"><body>\n')
+        for unitId, english, translated, note in units:
+            target = ('<target state="needs-translation">{}</target>'.format(english) if translated is None
+                      else '<target state="translated">{}</target>'.format(translated))
+            outfile.write('<trans-unit id="{}"><source>{}</source>{}<note>{}</note></trans-unit>\n'.format(
+                unitId, english, target, note))
+        outfile.write('</body></file></xliff>\n')
+
+def nested_hits(rules, files):
+    """
+    Reference hits of the (filename, relpath) list: Apply every (nested) rule to every entry.
+    Returns a Counter of (relpath, unit ID, rule index, hit, origImages, translatedImages)
+    """
+    from XLIFFReader import read_xliff_entries
+    hits = collections.Counter()
+    for filename, relpath in files:
+        for entry in read_xliff_entries(filename):
+            for ruleIdx, rule in enumerate(rules):
+                for _, hit, _, origImages, translatedImages in rule.apply_to_xliff_entry(entry, relpath):
+                    hits[(relpath, entry.id, ruleIdx, hit, tuple(origImages), tuple(translatedImages))] += 1
+    return hits
+
+def evaluator_hits(evaluator, files, evaluate=None, corpus=None):
+    """
+    Hits (like nested_hits()) & total stats of the (filename, relpath) list
+    using evaluate_file() or, if given, evaluate(filename, relpath)
+    """
+    from RuleEngine import evaluate_file
+    hits = collections.Counter()
+    stats = collections.Counter()
+    for filename, relpath in files:
+        if evaluate is None:
+            entries, fileHits, fileStats = evaluate_file(evaluator, filename, relpath, corpus)
+        else:
+            entries, fileHits, fileStats = evaluate(filename, relpath)
+        stats.update(fileStats)
+        for ruleIdx, entryIdx, hit, origImages, translatedImages in fileHits:
+            hits[(relpath, entries[entryIdx].id, ruleIdx, hit, tuple(origImages), tuple(translatedImages))] += 1
+    return hits, stats
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Tests for XLIFFReader: Streaming XLIFF entries and writing XLIFF output.
+
+Run using ./TestXLIFFReader.py
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from lxml import etree
+
+_xliff = """<?xml version="1.0" encoding="UTF-8"?>
+<xliff xmlns="urn:oasis:names:tc:xliff:document:1.2" xmlns:x="urn:example" version="1.2">
+  <file original="a.pot" source-language="en" target-language="xx" datatype="po">
+    <header><tool tool-id="crowdin"/></header>
+    <body>
+      <trans-unit id="1" resname="greeting" x:flag="yes">
+        <source>Hello <g id="b">world</g></source>
+        <target state="needs-translation" xml:lang="xx">Hello <g id="b">world</g></target>
+        <note>Greeting</note>
+      </trans-unit>
+      <trans-unit id="2" approved="yes">
+        <source>Check your answer</source>
+        <target state="translated">Überprüfe deine Antwort</target>
+      </trans-unit>
+      <trans-unit id="3">
+        <source>Next</source>
+        <target state="needs-translation">Next</target>
+        <note>Button</note>
+      </trans-unit>
+    </body>
+  </file>
+</xliff>
+"""
+
+class XLIFFReaderTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # The XLIFFReader imports use paths relative to the working directory
+        cls.olddir = os.getcwd()
+        cls.tmpdir = tempfile.mkdtemp()
+        os.chdir(cls.tmpdir)
+        os.makedirs("cache")
+        with open(os.path.join("cache", "languages.json"), "w") as outfile:
+            json.dump({"xx": 1}, outfile)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls.olddir)
+        shutil.rmtree(cls.tmpdir)
+
+    def setUp(self):
+        self.infilename = os.path.join(self.tmpdir, "in.xliff")
+        self.outfilename = os.path.join(self.tmpdir, "out", "out.xliff")
+        with open(self.infilename, "w") as outfile:
+            outfile.write(_xliff)
+
+    def tearDown(self):
+        os.remove(self.infilename)
+        shutil.rmtree(os.path.dirname(self.outfilename), ignore_errors=True)
+
+    def test_read_entries(self):
+        from XLIFFReader import read_xliff_entries
+        entries = read_xliff_entries(self.infilename, cache=None)
+        self.assertEqual([entry.id for entry in entries], ["1", "2", "3"])
+        self.assertEqual(entries[0].english, "Hello world")
+        self.assertTrue(entries[0].is_untranslated)
+        self.assertEqual(entries[0].note, "Greeting")
+        self.assertEqual(entries[1].translated, "Überprüfe deine Antwort")
+        self.assertTrue(entries[1].is_approved)
+        self.assertEqual([entry.id for entry in read_xliff_entries(
+            self.infilename, ignore_untranslated=True, cache=None)], ["2"])
+
+    def test_parsed_cache(self):
+        from XLIFFReader import ParsedXLIFFCache, read_xliff_entries, stream_xliff_entries
+        cache = ParsedXLIFFCache(os.path.join(self.tmpdir, "parsed"), chunk_size=2)
+        self.addCleanup(shutil.rmtree, cache.directory, ignore_errors=True)
+        reference = read_xliff_entries(self.infilename, cache=None)
+        # A partially consumed stream is not stored
+        stream = stream_xliff_entries(self.infilename, cache=cache)
+        self.assertEqual(next(stream), reference[0])
+        stream.close()
+        self.assertIsNone(cache.iterate(self.infilename))
+        self.assertFalse([name for name in os.listdir(cache.directory) if name.endswith(".tmp")])
+        # A fully consumed one is (in several chunks)
+        self.assertEqual(list(stream_xliff_entries(self.infilename, cache=cache)), reference)
+        self.assertEqual(cache.get(self.infilename), reference)
+        self.assertEqual(list(stream_xliff_entries(self.infilename, ignore_untranslated=True, cache=cache)),
+                         [reference[1]])
+        # Only the mtime changed => still valid
+        stat = os.stat(self.infilename)
+        os.utime(self.infilename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertEqual(cache.get(self.infilename), reference)
+        # Same size & different content => invalid
+        with open(self.infilename, "w") as outfile:
+            outfile.write(_xliff.replace("Next", "Nope"))
+        os.utime(self.infilename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10**9))
+        self.assertIsNone(cache.get(self.infilename))
+        self.assertEqual(read_xliff_entries(self.infilename, cache=cache)[2].english, "Nope")
+        self.assertEqual(cache.get(self.infilename)[2].english, "Nope")
+
+    def test_writer(self):
+        from XLIFFReader import XLIFFWriter, read_xliff_entries
+        entries = read_xliff_entries(self.infilename, cache=None)
+        with XLIFFWriter(self.infilename, self.outfilename) as writer:
+            writer.write(entries[0], "Hallo Welt")
+            writer.write(entries[2], "Weiter")
+        self.assertEqual(writer.count, 2)
+        with open(self.outfilename, "rb") as infile:
+            data = infile.read()
+        # Namespaces are only declared by the root element
+        self.assertEqual(data.count(b"xmlns="), 1)
+        self.assertEqual(data.count(b"xmlns:x="), 1)
+        root = etree.fromstring(data)
+        ns = {"x": "urn:oasis:names:tc:xliff:document:1.2"}
+        self.assertEqual(root.find("x:file", ns).get("datatype"), "po")
+        self.assertIsNotNone(root.find("x:file/x:header/x:tool", ns))
+        units = root.findall("x:file/x:body/x:trans-unit", ns)
+        self.assertEqual([unit.get("id") for unit in units], ["1", "3"])
+        # All attributes & the inline markup of the source are preserved
+        self.assertEqual(units[0].get("resname"), "greeting")
+        self.assertEqual(units[0].get("{urn:example}flag"), "yes")
+        self.assertIsNotNone(units[0].find("x:source/x:g", ns))
+        target = units[0].find("x:target", ns)
+        self.assertEqual((target.get("state"), target.text, len(target)), ("translated", "Hallo Welt", 0))
+        self.assertEqual(target.get("{http://www.w3.org/XML/1998/namespace}lang"), "xx")
+        self.assertEqual(units[0].findall("x:note", ns), [])
+        written = read_xliff_entries(self.outfilename, cache=None)
+        self.assertEqual([(entry.english, entry.translated, entry.is_untranslated) for entry in written],
+                         [("Hello world", "Hallo Welt", False), ("Next", "Weiter", False)])
+
+    def test_writer_without_units(self):
+        from XLIFFReader import XLIFFWriter
+        with XLIFFWriter(self.infilename, self.outfilename):
+            pass
+        self.assertFalse(os.path.exists(self.outfilename))
+
+    def test_writer_discards_partial_output(self):
+        from XLIFFReader import XLIFFWriter, read_xliff_entries
+        entries = read_xliff_entries(self.infilename, cache=None)
+        with self.assertRaises(RuntimeError):
+            with XLIFFWriter(self.infilename, self.outfilename) as writer:
+                writer.write(entries[0], "Hallo Welt")
+                raise RuntimeError("Translation failed")
+        self.assertEqual(os.listdir(os.path.dirname(self.outfilename)), [])
+        # Units must be written in file order
+        with self.assertRaises(ValueError):
+            with XLIFFWriter(self.infilename, self.outfilename) as writer:
+                writer.write(entries[2], "Weiter")
+                writer.write(entries[0], "Hallo Welt")
+        self.assertEqual(os.listdir(os.path.dirname(self.outfilename)), [])
+
+if __name__ == "__main__":
+    unittest.main()
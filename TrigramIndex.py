@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Trigram index over the msgids & msgstrs of a corpus (in the style of code search).
+
+Every unique string of the corpus has a number. The index maps every
+trigram of the normalized strings (see LiteralPrefilter.normalize_text)
+to the sorted list of the numbers of the strings containing it.
+A regex can only match strings which contain one of its required
+literals (see LiteralPrefilter.required_literals), and a string can only
+contain a literal if it contains all trigrams of the literal. So only
+these candidate strings need to be searched using the actual regex.
+
+The index is stored in cache/<lang>.trigrams. It is built together with
+the corpus (see 'katc.py compact') and rebuilt when the corpus changed.
+The posting lists are memory-mapped, so a query only reads the lists it needs.
+
+File layout:
+    Header      magic, version, length of the metadata (little endian)
+    Metadata    Pickled (corpus signature, string table, trigram table)
+    Postings    uint32 string numbers (native byte order), one sorted run per trigram
+"""
+import array
+import bisect
+import mmap
+import os
+import pickle
+import re
+import struct
+import time
+from ansicolor import black, red
+from LiteralPrefilter import normalize_text, required_literals
+from Rules import cleanupTranslatedString
+from RuleEngine import RuleMatches, text_key
+
+_magic = b"KATCTRIG"
+_version = 1
+_headerStruct = struct.Struct("<8sIQ")
+
+# String flags
+flagMsgid = 1
+flagMsgstr = 2
+flagMarkup = 4 # cleanupTranslatedString() changes the (msgstr) string
+
+def trigram_index_filename(lang):
+    return os.path.join("cache", "{}.trigrams".format(lang))
+
+def trigrams(text):
+    """The set of trigrams of a normalized text"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def build_trigram_index(lang, corpus):
+    """Build & save the trigram index for the corpus of a language"""
+    numbers = {} # ref => string number
+    offsets, lengths = array.array("Q"), array.array("I")
+    flags = bytearray()
+    firstEntries = array.array("I") # The first entry containing the string
+    postings = {}
+    for entryIdx, (englishRef, translatedRef, untranslated) in enumerate(corpus.entry_refs()):
+        for ref, flag in ((englishRef, flagMsgid), (None if untranslated else translatedRef, flagMsgstr)):
+            if ref is None:
+                continue
+            number = numbers.get(ref)
+            if number is None:
+                number = numbers[ref] = len(numbers)
+                offsets.append(ref[0])
+                lengths.append(ref[1])
+                flags.append(0)
+                firstEntries.append(entryIdx)
+                for trigram in trigrams(normalize_text(corpus.string(ref))):
+                    postings.setdefault(trigram, array.array("I")).append(number)
+            if flag == flagMsgstr and not flags[number] & flagMsgstr:
+                text = corpus.string(ref)
+                if cleanupTranslatedString(text) != text:
+                    flags[number] |= flagMarkup
+            flags[number] |= flag
+    # Write the postings after the metadata
+    table = {} # trigram => (index of the first number, count)
+    position = 0
+    for trigram, numberList in postings.items():
+        table[trigram] = (position, len(numberList))
+        position += len(numberList)
+    meta = pickle.dumps((corpus.signature(), offsets, lengths, bytes(flags), firstEntries, table),
+                        protocol=pickle.HIGHEST_PROTOCOL)
+    filename = trigram_index_filename(lang)
+    with open(filename + ".tmp", "wb") as outfile:
+        outfile.write(_headerStruct.pack(_magic, _version, len(meta)))
+        outfile.write(meta)
+        # Align the postings
+        outfile.write(b"\0" * (-outfile.tell() % 4))
+        for numberList in postings.values():
+            numberList.tofile(outfile)
+    os.replace(filename + ".tmp", filename)
+    return TrigramIndex(filename, corpus)
+
+class TrigramIndex(object):
+    """
+    A trigram index file of a corpus. The posting lists are memory-mapped.
+    Raises ValueError if the file does not belong to the corpus snapshot.
+    """
+    def __init__(self, filename, corpus):
+        self.corpus = corpus
+        with open(filename, "rb") as infile:
+            self._mm = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, metaLength = _headerStruct.unpack_from(self._mm, 0)
+        if magic != _magic or version != _version:
+            raise ValueError("{} is not a trigram index (version {})".format(filename, _version))
+        start = _headerStruct.size
+        signature, self.offsets, self.lengths, self.flags, self.firstEntries, self.table = \
+            pickle.loads(self._mm[start:start + metaLength])
+        if tuple(signature) != tuple(corpus.signature()):
+            raise ValueError("{} belongs to a different corpus snapshot".format(filename))
+        start += metaLength
+        start += -start % 4
+        self._postings = memoryview(self._mm)[start:].cast("I")
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def string(self, number):
+        return self.corpus.string((self.offsets[number], self.lengths[number]))
+
+    def posting(self, trigram):
+        """The sorted numbers of the strings containing a trigram"""
+        position, count = self.table.get(trigram, (0, 0))
+        return self._postings[position:position + count]
+
+    def literal_candidates(self, literal):
+        """The numbers of the strings which might contain a normalized literal (length >= 3)"""
+        lists = sorted((self.posting(trigram) for trigram in trigrams(literal)), key=len)
+        shortest, others = lists[0], lists[1:]
+        return {number for number in shortest
+                if all(_contains(numbers, number) for numbers in others)}
+
+    def candidates(self, literals):
+        """
+        The numbers of the strings which might contain one of a set of
+        normalized literals or None if it can't be narrowed down (short literals).
+        """
+        if literals is None or any(len(literal) < 3 for literal in literals):
+            return None
+        result = set()
+        for literal in literals:
+            result |= self.literal_candidates(literal)
+        return result
+
+    def search(self, regex, flags=0, fields=flagMsgid | flagMsgstr):
+        """
+        Search the strings occuring in the given fields (flagMsgid and/or flagMsgstr).
+        Returns ([(string number, match)], number of searched candidates).
+        """
+        compiled = re.compile(regex, flags)
+        candidates = self.candidates(required_literals(regex, flags))
+        numbers = range(len(self)) if candidates is None else sorted(candidates)
+        results = []
+        for number in numbers:
+            if not self.flags[number] & fields:
+                continue
+            match = compiled.search(self.string(number))
+            if match:
+                results.append((number, match))
+        return results, len(numbers)
+
+def _contains(numbers, number):
+    """Binary search in a sorted posting list"""
+    idx = bisect.bisect_left(numbers, number)
+    return idx < len(numbers) and numbers[idx] == number
+
+def open_trigram_index(lang, corpus):
+    """Open the trigram index for the corpus of a language or (re)build it if outdated"""
+    filename = trigram_index_filename(lang)
+    try:
+        return TrigramIndex(filename, corpus)
+    except (FileNotFoundError, ValueError):
+        print(black("Building trigram index for {}...".format(lang), bold=True))
+        return build_trigram_index(lang, corpus)
+
+def _indexed_sides(rule):
+    """
+    The (msgstr literals, msgid literals) of a rule which the trigram index
+    is used for: The sides whose regex is not in the RE2 set, i.e. compatibility
+    mode regexes. None if the index can't narrow that side down.
+    """
+    literals = rule.required_literals()
+    patterns = rule.set_patterns()
+    return tuple(sideLiterals if pattern is None and sideLiterals and
+                 all(len(literal) >= 3 for literal in sideLiterals) else None
+                 for sideLiterals, pattern in zip(literals, patterns))
+
+def compute_trigram_matches(index, evaluator):
+    """
+    Look up the candidate msgstrs & msgids of the content rules of a
+    RuleEvaluator whose regexes are in compatibility mode.
+    Returns a list of RuleMatches (for the msgstr and the msgid side).
+    """
+    startTime = time.time()
+    # Cleaning up markup might join literals, so these msgstrs are always candidates
+    markup = [number for number in range(len(index)) if index.flags[number] & flagMarkup]
+    keys = {} # string number => text_key()
+    def key(number):
+        if number not in keys:
+            keys[number] = text_key(index.string(number))
+        return keys[number]
+    result = []
+    for side, (field, flag) in enumerate((("translated", flagMsgstr), ("english", flagMsgid))):
+        rules = []
+        matches = {}
+        for ruleIdx, rule in enumerate(evaluator.contentRules):
+            literals = _indexed_sides(rule)[side]
+            if literals is None:
+                continue
+            rules.append(ruleIdx)
+            candidates = index.candidates(literals)
+            if field == "translated":
+                candidates.update(markup)
+            for number in candidates:
+                if index.flags[number] & flag:
+                    matches[key(number)] = matches.get(key(number), ()) + (ruleIdx,)
+        # The index only knows the strings of the corpus
+        result.append(RuleMatches(rules, matches, field=field, corpus_only=True))
+    print(black("Looked up {} msgstr & {} msgid rule regexes in the trigram index in {:.1f} s".format(
+        len(result[0].rules), len(result[1].rules), time.time() - startTime), bold=True))
+    return result
+
+def performGrep(args):
+    from Corpus import open_corpus
+    from UpdateAllFiles import get_translation_urls
+    corpus = open_corpus(args.language)
+    if corpus is None:
+        print(red("No usable corpus for {} - run 'katc.py compact' first".format(args.language), bold=True))
+        return
+    startTime = time.time()
+    index = open_trigram_index(args.language, corpus)
+    fields = (flagMsgid if args.msgid else 0) | (flagMsgstr if args.msgstr else 0)
+    results, numCandidates = index.search(args.regex, re.IGNORECASE if args.ignore_case else 0,
+                                          fields or flagMsgid | flagMsgstr)
+    duration = time.time() - startTime
+    translationURLs = get_translation_urls(args.language)
+    for number, match in results[:args.limit] if args.limit else results:
+        entryIdx = index.firstEntries[number]
+        entry = corpus.entry(entryIdx)
+        path = corpus.files[corpus.entry_file_index(entryIdx)]["path"]
+        print(black("{}#{}".format(translationURLs.get(path, path), entry.id), bold=True))
+        text = match.string
+        print("    " + text[:match.start()] + red(match.group(0), bold=True) + text[match.end():])
+    print(black("{} matching strings ({} candidates of {} strings) in {:.2f} s".format(
+        len(results), numCandidates, len(index), duration), bold=True))
@@ -18,6 +18,18 @@ from ansicolor import black, green, blue
 from retry import retry
 from multiprocessing import Pool
 from Languages import getCachedLanguageMap, findAvailableLanguages
+from CacheStorage import open_cache_file, stored_filename, remove_other_variants, \
+    compress_chunks, stat_cache_file, CachePackWriter
+from Catalog import FileCatalog, CatalogRecordBuilder
+
+# Size of the chunks downloaded files are processed in
+downloadChunkSize = 1 << 20
+
+def iterDownload(response, recordBuilder):
+    """Iterate the content of a download response, passing every chunk to the CatalogRecordBuilder"""
+    for chunk in response.iter_content(chunk_size=downloadChunkSize):
+        recordBuilder.update(chunk)
+        yield chunk
 
 languageIDs = getCachedLanguageMap()
 
@@ -90,21 +102,39 @@ def downloadTranslationFilemap(lang="de"):
 
 
 @retry(tries=8, delay=5.0)
-def performPOTDownload(lang, argtuple, project="khanacademy"):
+def performPOTDownload(lang, argtuple, project="khanacademy", compression=None):
     # Extract argument tuple
     fileid, filepath = argtuple
-    exportTranslationFile(lang, fileid, filepath, asXLIFF=False, project=project)
+    return exportTranslationFile(lang, fileid, filepath, asXLIFF=False, project=project, compression=compression)
 
 @retry(tries=8, delay=5.0)
-def performXLIFFDownload(lang, argtuple, project="khanacademy"):
+def performXLIFFDownload(lang, argtuple, project="khanacademy", compression=None):
     # Extract argument tuple
     fileid, filepath = argtuple
-    exportTranslationFile(lang, fileid, filepath, asXLIFF=True, project=project)
+    return exportTranslationFile(lang, fileid, filepath, asXLIFF=True, project=project, compression=compression)
 
-def exportTranslationFile(lang, fileid, filepath, asXLIFF=True, project="khanacademy"):
+@retry(tries=8, delay=5.0)
+def performPackDownload(lang, argtuple, asXLIFF=True, project="khanacademy", compression=None):
     """
-    Explicitly uncurried function that downloads a single Crowdin file
-    to a filesystem file. fileid, filepath
+    Download a single Crowdin file into memory so it can be stored in a pack.
+    The file is compressed while downloading, so only the stored data is held in memory.
+    Returns a (stored filepath, stored data, catalogue record) tuple
+    or None if the export failed. The mtime of the record is filled in
+    once the pack has been written.
+    """
+    fileid, filepath = argtuple
+    response = fetchTranslationFile(lang, fileid, asXLIFF=asXLIFF, project=project)
+    if response is None:
+        return None
+    recordBuilder = CatalogRecordBuilder(fileid, os.path.relpath(filepath, os.path.join("cache", lang)))
+    stored = compress_chunks(iterDownload(response, recordBuilder), compression)
+    print(green("Downloaded %s" % filepath))
+    return stored_filename(filepath, compression), stored, recordBuilder.record(len(stored), None)
+
+def fetchTranslationFile(lang, fileid, asXLIFF=True, project="khanacademy"):
+    """
+    Trigger the export of a single Crowdin file and return the
+    (streaming) download response or None if the export failed.
     """
     urlPrefix = "https://crowdin.com/project/{}/{}/{}/export".format(project, lang, fileid)
     # Initialize session
@@ -118,18 +148,36 @@ def exportTranslationFile(lang, fileid, filepath, asXLIFF=True, project="khanaca
             raise Exception("Crowdin export failed: " + exportResponse.text)
     except simplejson.scanner.JSONDecodeError:
         #print(exportResponse.text)
-        return
+        return None
     # Trigger download
-    # Store in file
-    with open(filepath, "w+b") as outfile:
-        response = s.get(exportJSON["url"], stream=True)
+    response = s.get(exportJSON["url"], stream=True)
+    if not response.ok:
+        raise Exception("Download error")
+    return response
 
-        if not response.ok:
-            raise Exception("Download error")
+def exportTranslationFile(lang, fileid, filepath, asXLIFF=True, project="khanacademy", compression=None):
+    """
+    Explicitly uncurried function that downloads a single Crowdin file
+    to a filesystem file. fileid, filepath
 
-        for block in response.iter_content(1024):
-            outfile.write(block)
-    print(green("Downloaded %s" % filepath))
+    compression: None (raw), "gzip" or "zstd". The compression suffix
+    is appended to filepath.
+
+    Returns the catalogue record for the file or None if the export failed.
+    """
+    response = fetchTranslationFile(lang, fileid, asXLIFF=asXLIFF, project=project)
+    if response is None:
+        return None
+    recordBuilder = CatalogRecordBuilder(fileid, os.path.relpath(filepath, os.path.join("cache", lang)))
+    # Store in file while downloading
+    outpath = stored_filename(filepath, compression)
+    with open_cache_file(outpath, "wb") as outfile:
+        for chunk in iterDownload(response, recordBuilder):
+            outfile.write(chunk)
+    # Avoid having both raw and compressed versions
+    remove_other_variants(filepath, compression)
+    print(green("Downloaded %s" % outpath))
+    return recordBuilder.record(*stat_cache_file(outpath))
 
 def findExistingPOFiles(lang="de", directory="de"):
     """Find PO files which already exist in the language directory"""
@@ -181,14 +229,15 @@ def updateTranslation(args):
         # Handle XLIFF filenames
         if not args.po:
             filepath = filepath.replace(".pot", ".xliff")
-        # Create dir if not exists
-        try:
-            os.makedirs(os.path.dirname(filepath))
-        except OSError as exc:
-            if exc.errno == errno.EEXIST:
-                pass
-            else:
-                raise
+        # Create dir if not exists (packs don't need directories)
+        if not args.pack:
+            try:
+                os.makedirs(os.path.dirname(filepath))
+            except OSError as exc:
+                if exc.errno == errno.EEXIST:
+                    pass
+                else:
+                    raise
         fileid = fileinfo["id"]
         # Apply filter
         filtered = False
@@ -200,21 +249,56 @@ def updateTranslation(args):
             continue
         # Add to list
         fileinfos.append((fileid, filepath))
-    # Curry the function with the language
-    performDownload = functools.partial(performPOTDownload if args.po else performXLIFFDownload, args.language)
-    # Perform parallel download
-    if args.num_processes > 1:
-        pool = Pool(args.num_processes)
-        pool.map(performDownload, fileinfos)
+    if args.pack:
+        records = downloadIntoPack(args, fileinfos)
     else:
-        for t in fileinfos:
+        # Curry the function with the language
+        performDownload = functools.partial(performPOTDownload if args.po else performXLIFFDownload,
+            args.language, compression=args.compress)
+        # Perform parallel download
+        if args.num_processes > 1:
+            pool = Pool(args.num_processes)
+            records = pool.map(performDownload, fileinfos)
+        else:
             # Perform download
-            performDownload(t)
+            records = [performDownload(t) for t in fileinfos]
+    # Update file catalogue
+    FileCatalog(args.language).update(filter(None, records))
     #Set download timestamp
     timestamp = datetime.datetime.now().strftime("%y-%m-%d %H:%M:%S")
     with open("lastdownload.txt", "w") as outfile:
         outfile.write(timestamp)
 
+def downloadIntoPack(args, fileinfos):
+    """
+    Download the given (fileid, filepath) tuples into the pack of the language
+    (see CacheStorage). The workers download & compress, this process
+    writes the pack.
+
+    Returns the list of catalogue records
+    """
+    langdir = os.path.join("cache", args.language)
+    writer = CachePackWriter(langdir)
+    performDownload = functools.partial(performPackDownload, args.language,
+        asXLIFF=not args.po, compression=args.compress)
+    if args.num_processes > 1:
+        pool = Pool(args.num_processes)
+        results = pool.imap_unordered(performDownload, fileinfos)
+    else:
+        results = map(performDownload, fileinfos)
+    records = []
+    for result in results:
+        if result is not None:
+            filepath, data, record = result
+            writer.add(os.path.relpath(filepath, langdir), data)
+            records.append(record)
+    writer.close()
+    print(green("Wrote {}".format(writer.filename), bold=True))
+    # The mtimes of the members are only known now
+    for record in records:
+        record["mtime"] = stat_cache_file(os.path.join(langdir, record["path"]))[1]
+    return records
+
 def downloadCrowdinById(session, crid, lang="de"):
     if lang in languageIDs:
         langId = languageIDs[lang]
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+r"""
+Inverted index from the words of the msgids of a corpus to the msgids.
+
+Translation constraint rules (and other rules which require a msgid
+literal, see Rule.required_literals()) can only hit entries whose msgid
+contains their trigger word, e.g. "triangle" for r"\btriangles?\b".
+Instead of testing every such rule against every entry, the posting
+lists of the words containing the trigger are looked up once per render.
+The resulting RuleMatches restrict the rules to these msgids.
+
+Words are the \w+ runs of the normalized msgid (see
+LiteralPrefilter.normalize_text), so a literal consisting of word
+characters is always part of a single word.
+
+The index is stored in cache/<lang>.words. It is built together with
+the corpus (see 'katc.py compact') and rebuilt when the corpus changed.
+"""
+import array
+import os
+import pickle
+import re
+import time
+from ansicolor import black
+from LiteralPrefilter import normalize_text
+from StringMatcher import MultiStringMatcher
+from RuleEngine import RuleMatches, text_key
+
+_version = 1
+_wordRegex = re.compile(r"\w+")
+
+def word_index_filename(lang):
+    return os.path.join("cache", "{}.words".format(lang))
+
+class WordIndex(object):
+    """
+    Maps normalized words to the msgids containing them.
+    msgids are identified by their number. refs contains the string heap
+    reference (see Corpus.entry_refs()) for every number.
+    """
+    def __init__(self, corpus, refs, postings):
+        self.corpus = corpus
+        self.refs = refs
+        self.postings = postings # word => array of msgid numbers
+
+    @classmethod
+    def build(cls, corpus):
+        numbers = {} # ref => msgid number
+        postings = {}
+        for ref, _, _ in corpus.entry_refs():
+            if ref in numbers:
+                continue
+            number = numbers[ref] = len(numbers)
+            for word in set(_wordRegex.findall(normalize_text(corpus.string(ref)))):
+                postings.setdefault(word, array.array("I")).append(number)
+        return cls(corpus, list(numbers), postings)
+
+    def save(self, filename):
+        with open(filename + ".tmp", "wb") as outfile:
+            pickle.dump((_version, self.corpus.signature(), self.refs, self.postings),
+                        outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(filename + ".tmp", filename)
+
+    @classmethod
+    def load(cls, corpus, filename):
+        """Load the index for a corpus. Returns None if it does not exist or is outdated"""
+        if not os.path.isfile(filename):
+            return None
+        with open(filename, "rb") as infile:
+            version, signature, refs, postings = pickle.load(infile)
+        if version != _version or signature != corpus.signature():
+            return None
+        return cls(corpus, refs, postings)
+
+    def __len__(self):
+        return len(self.refs)
+
+    def msgid(self, number):
+        return self.corpus.string(self.refs[number])
+
+def build_word_index(lang, corpus):
+    """Build & save the word index for the corpus of a language"""
+    index = WordIndex.build(corpus)
+    index.save(word_index_filename(lang))
+    return index
+
+def open_word_index(lang, corpus):
+    """Load the word index for the corpus of a language or (re)build it if outdated"""
+    index = WordIndex.load(corpus, word_index_filename(lang))
+    if index is None:
+        print(black("Building word index for {}...".format(lang), bold=True))
+        index = build_word_index(lang, corpus)
+    return index
+
+def _indexable_literals(rule):
+    """The msgid literals of a rule if all of them are words, else None"""
+    literals = rule.required_literals()[1]
+    if not literals or not all(_wordRegex.fullmatch(literal) for literal in literals):
+        return None
+    return literals
+
+def compute_msgid_matches(index, evaluator):
+    """
+    Look up the msgids which the content rules of a RuleEvaluator with
+    word literals in the msgid can hit. Returns the RuleMatches of these rules.
+    """
+    startTime = time.time()
+    ruleLiterals = {}
+    for ruleIdx, rule in enumerate(evaluator.contentRules):
+        literals = _indexable_literals(rule)
+        if literals is not None:
+            ruleLiterals[ruleIdx] = literals
+    # Find the words containing each literal in one pass over the vocabulary
+    literals = sorted(set().union(*ruleLiterals.values()))
+    matcher = MultiStringMatcher(literals)
+    literalWords = [[] for _ in literals]
+    for word in index.postings:
+        for literalIdx in matcher.find_all(word):
+            literalWords[literalIdx].append(word)
+    literalWords = dict(zip(literals, literalWords))
+    # Visit the posting lists
+    keys = {} # msgid number => text_key()
+    matches = {}
+    for ruleIdx, literals in ruleLiterals.items():
+        numbers = set()
+        for literal in literals:
+            for word in literalWords[literal]:
+                numbers.update(index.postings[word])
+        for number in numbers:
+            key = keys.get(number)
+            if key is None:
+                key = keys[number] = text_key(index.msgid(number))
+            matches[key] = matches.get(key, ()) + (ruleIdx,)
+    print(black("Looked up {} rules in the word index of {} msgids in {:.1f} s ({} matching msgids)".format(
+        len(ruleLiterals), len(index), time.time() - startTime, len(matches)), bold=True))
+    # The index only knows the msgids of the corpus
+    return RuleMatches(ruleLiterals, matches, field="english", corpus_only=True)
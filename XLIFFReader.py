@@ -10,8 +10,19 @@ from ansicolor import black, blue, green
 from UpdateAllFiles import *
 from XLIFFUpload import *
 import concurrent.futures
+import collections
+import contextlib
 import gc
-import bs4
+import hashlib
+import pickle
+import shutil
+import tempfile
+import threading
+from lxml import etree
+from xml.sax.saxutils import escape
+from Catalog import FileCatalog
+from CacheStorage import open_cache_file, strip_compression_suffix, \
+    list_cache_files, stat_cache_file, hash_cache_file
 
 def findXLIFFFiles(directory, filt=[]):
     """
@@ -24,103 +35,512 @@ def findXLIFFFiles(directory, filt=[]):
         poFilenames = [directory]
     else:
         xliffFiles = {} # name => crowdin file id
-        #Recursively iterate directory, ignore everythin except *.po
-        for (curdir, _, files) in os.walk(directory):
-            # Ignore non-XLIFF files
-            for f in filter(lambda f: f.endswith(".xliff"), files):
-                #Add to list of files to process
-                filename = os.path.join(curdir, f)
-                basename = os.path.basename(filename)
-                # Filter based on custom filter
-                filtered = False # true => ignore this file
-                # Ignore files not in filter, if any
-                for subfilt1 in (filt or []):
-                    for subfilt2 in subfilt1: # argparse creates nested list
-                        if subfilt2 not in filename and subfilt2 not in filename.replace(".xliff", ".pot"):
-                            filtered = True
-                if not filtered: # passed filter
-                    key = basename.replace(".xliff", ".pot")
-                    # For some reason sometimes mapping does not work correctly
-                    if key in transFilemap:
-                        xliffFiles[filename] = transFilemap[key]["id"]
-                    else:
-                        print(red("Can't find {} in filemap - ignoring file".format(key), bold=True))
+        # Recursively iterate directory (or the member table of its pack)
+        # ignore everything except *.xliff
+        for filename in list_cache_files(directory, ".xliff"):
+            basename = os.path.basename(strip_compression_suffix(filename))
+            # Filter based on custom filter
+            filtered = False # true => ignore this file
+            # Ignore files not in filter, if any
+            for subfilt1 in (filt or []):
+                for subfilt2 in subfilt1: # argparse creates nested list
+                    if subfilt2 not in filename and subfilt2 not in filename.replace(".xliff", ".pot"):
+                        filtered = True
+            if not filtered: # passed filter
+                key = basename.replace(".xliff", ".pot")
+                # For some reason sometimes mapping does not work correctly
+                if key in transFilemap:
+                    xliffFiles[filename] = transFilemap[key]["id"]
+                else:
+                    print(red("Can't find {} in filemap - ignoring file".format(key), bold=True))
     return xliffFiles
 
-def parse_xliff_file(filename):
-    with open(filename) as infile:
-        return BeautifulSoup(infile, "lxml-xml")
+XLIFFEntry = collections.namedtuple("XLIFFEntry", ["id", "english", "translated", "is_untranslated", "is_approved", "note"])
 
-def export_xliff_file(soup, filename):
-    with open(filename, "w") as outfile:
-        outfile.write(str(soup))
+def _is_element(node):
+    """Comments & processing instructions don't have a string tag"""
+    return isinstance(node.tag, str)
 
-def process_xliff_soup(filename, soup, autotranslator, indexer, autotranslate=True, preindex=False, overwrite=False):
+def _localname(node):
+    return etree.QName(node).localname
+
+def _element_text(node):
+    """Equivalent of BeautifulSoup's .text: All text, including nested inline tags"""
+    return "".join(node.itertext())
+
+def _free_element(elem):
+    """
+    Free an element that has been processed by iterparse()
+    plus all already-processed siblings that are still referenced by the parent.
+    """
+    elem.clear()
+    while elem.getprevious() is not None:
+        del elem.getparent()[0]
+
+def _trans_unit_to_entry(trans_unit, ignore_untranslated=False):
+    """
+    Convert a <trans-unit> lxml element to a XLIFFEntry.
+    Returns None for broken units and (if ignore_untranslated is set)
+    for untranslated units. In the latter case, no text is extracted at all.
+    """
+    source = target = note = None
+    for child in trans_unit:
+        if not _is_element(child):
+            continue
+        name = _localname(child)
+        if name == "source":
+            source = child
+        elif name == "target":
+            target = child
+        elif name == "note":
+            note = child
+    # Broken XLIFF entry
+    if source is None or target is None:
+        print(red("Ignoring broken trans-unit {}".format(trans_unit.get("id"))))
+        return None
+    is_untranslated = target.get("state") == "needs-translation"
+    # Skip early, before extracting any text
+    if is_untranslated and ignore_untranslated:
+        return None
+    is_approved = trans_unit.get("approved") == "yes"
+    return XLIFFEntry(trans_unit.get("id"), _element_text(source),
+        "" if is_untranslated else _element_text(target),
+        is_untranslated, is_approved,
+        "" if note is None else _element_text(note))
+
+def iterate_xliff_entries(filename, ignore_untranslated=False):
+    """
+    Iterate the <trans-unit>s of a XLIFF file as XLIFFEntry objects.
+
+    In contrast to building a BeautifulSoup tree, this streams the file
+    using lxml's iterparse() and frees every unit right after it has been
+    converted, so memory usage is constant regardless of the file size.
+
+    Untranslated entries have an empty translated string.
+    Set ignore_untranslated to skip them altogether.
+    Compressed files are decompressed on the fly.
+
+    Raises lxml.etree.XMLSyntaxError for invalid files.
+    """
+    with open_cache_file(filename) as infile:
+        context = etree.iterparse(infile, events=("end",), tag="{*}trans-unit", huge_tree=True)
+        for _, trans_unit in context:
+            entry = _trans_unit_to_entry(trans_unit, ignore_untranslated)
+            _free_element(trans_unit)
+            if entry is not None:
+                yield entry
+        del context
+
+class ParsedXLIFFCache(object):
+    """
+    Persistent on-disk cache of the entries parsed from XLIFF files.
+
+    Every XLIFF file (which might be compressed or packed, see CacheStorage)
+    maps to one cache file in the cache directory: A sequence of pickles,
+    starting with the fingerprint (size, mtime and content hash) of the
+    XLIFF file it was created from, followed by chunks (lists) of entries
+    and terminated by None. Therefore, cache files can be written while
+    the XLIFF file is being parsed and read without loading all entries.
+
+    A cache entry is valid if size and mtime match. If only the mtime
+    differs (e.g. the file has been re-downloaded), the content hash is
+    compared, which is still much cheaper than parsing.
+
+    Cache files are written atomically (write + rename), so the cache
+    can be shared between threads and processes.
+    Once the cache grows above max_size bytes, the least recently used
+    cache files are deleted.
+    """
+    def __init__(self, directory=os.path.join("cache", "parsed"), max_size=4 << 30, chunk_size=1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        # Check the size at least every 1/16th of the max size written
+        self._evict_interval = max_size // 16
+        self._bytes_written = 0
+        self._lock = threading.Lock()
+
+    def _cache_filename(self, filename):
+        key = hashlib.sha1(os.path.abspath(filename).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, key + ".pickle")
+
+    def iterate(self, filename):
+        """
+        Get an iterator over the cached entries for the given XLIFF file
+        or None if there is no valid cache entry.
+        """
+        cachefile = self._cache_filename(filename)
+        try:
+            infile = open(cachefile, "rb")
+        except OSError:
+            return None
+        try:
+            size, mtime, digest = pickle.load(infile)
+            cursize, curmtime = stat_cache_file(filename)
+            if cursize != size:
+                infile.close()
+                return None
+            if curmtime != mtime:
+                if hash_cache_file(filename) != digest:
+                    infile.close()
+                    return None
+                # Same content => Update fingerprint
+                with infile:
+                    self._update_fingerprint(cachefile, infile, (cursize, curmtime, digest))
+                infile = open(cachefile, "rb")
+                pickle.load(infile)
+            else:  # Mark as recently used
+                os.utime(cachefile)
+        except (OSError, EOFError, AttributeError, pickle.UnpicklingError, ValueError, TypeError):
+            # TypeError/ValueError: Cache file from an older version
+            infile.close()
+            return None
+        return self._iterate_chunks(infile)
+
+    @staticmethod
+    def _iterate_chunks(infile):
+        with infile:
+            while True:
+                chunk = pickle.load(infile)
+                if chunk is None:
+                    return
+                yield from chunk
+
+    def get(self, filename):
+        """
+        Get the list of cached entries for the given XLIFF file
+        or None if there is no valid cache entry.
+        """
+        entries = self.iterate(filename)
+        return None if entries is None else list(entries)
+
+    def write_through(self, filename, entries):
+        """
+        Yield the given entries of a XLIFF file while writing them to the cache.
+        The cache file is only stored once all entries have been consumed,
+        so closing the generator early or raising an exception (e.g. a parse
+        error) leaves the cache unchanged.
+        """
+        size, mtime = stat_cache_file(filename)
+        fingerprint = (size, mtime, hash_cache_file(filename))
+        outfile, tmpname = self._create()
+        try:
+            with outfile:
+                pickle.dump(fingerprint, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+                chunk = []
+                for entry in entries:
+                    chunk.append(entry)
+                    if len(chunk) >= self.chunk_size:
+                        pickle.dump(chunk, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+                        chunk = []
+                    yield entry
+                if chunk:
+                    pickle.dump(chunk, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(None, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+                written = outfile.tell()
+        except BaseException:
+            os.remove(tmpname)
+            raise
+        self._commit(tmpname, self._cache_filename(filename), written)
+
+    def put(self, filename, entries):
+        for _ in self.write_through(filename, entries):
+            pass
+
+    def _update_fingerprint(self, cachefile, infile, fingerprint):
+        """Rewrite a cache file with a new fingerprint. infile is positioned after the old one."""
+        outfile, tmpname = self._create()
+        try:
+            with outfile:
+                pickle.dump(fingerprint, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+                shutil.copyfileobj(infile, outfile)
+                written = outfile.tell()
+        except BaseException:
+            os.remove(tmpname)
+            raise
+        self._commit(tmpname, cachefile, written)
+
+    def _create(self):
+        """Create a temporary file in the cache directory. Returns (file object, filename)"""
+        os.makedirs(self.directory, exist_ok=True)
+        # Write to a temporary file first so readers never see partial files
+        fd, tmpname = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        return os.fdopen(fd, "wb"), tmpname
+
+    def _commit(self, tmpname, cachefile, written):
+        os.replace(tmpname, cachefile)
+        with self._lock:
+            self._bytes_written += written
+            if self._bytes_written < self._evict_interval:
+                return
+            self._bytes_written = 0
+        self.evict()
+
+    def evict(self):
+        """Delete least recently used cache files until the cache is below max_size"""
+        try:
+            files = [(entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                     for entry in os.scandir(self.directory)
+                     if entry.name.endswith(".pickle")]
+        except FileNotFoundError:
+            return
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # Removed by another process
+                pass
+            total -= size
+
+parsedXLIFFCache = ParsedXLIFFCache()
+
+def stream_xliff_entries(filename, ignore_untranslated=False, cache=parsedXLIFFCache):
+    """
+    Iterate all XLIFFEntry objects of a XLIFF file without building a list.
+    Uses the parsed XLIFF cache if possible (set cache=None to disable).
+    Otherwise, the file is parsed using iterate_xliff_entries() and
+    the entries are written to the cache while they are being yielded.
+
+    Raises lxml.etree.XMLSyntaxError for invalid files.
+    """
+    if cache is None:
+        yield from iterate_xliff_entries(filename, ignore_untranslated)
+        return
+    entries = cache.iterate(filename)
+    if entries is None:
+        # The cache contains all entries, even if untranslated ones are ignored
+        entries = cache.write_through(filename, iterate_xliff_entries(filename))
+    for entry in entries:
+        if not (ignore_untranslated and entry.is_untranslated):
+            yield entry
+
+def read_xliff_entries(filename, ignore_untranslated=False, cache=parsedXLIFFCache):
+    """
+    Get a list of all XLIFFEntry objects for a XLIFF file.
+    See stream_xliff_entries().
+    """
+    return list(stream_xliff_entries(filename, ignore_untranslated, cache))
+
+XLIFFHeader = collections.namedtuple("XLIFFHeader", ["xliff", "file", "header"])
+
+def read_xliff_header(filename):
+    """
+    Read the <xliff> and <file> elements (without children)
+    plus the <header> element (if any) of a XLIFF file.
+
+    Parsing stops at <body>, so this is cheap even for huge files.
+    """
+    xliff = fileElem = header = None
+    with open_cache_file(filename) as infile:
+        context = etree.iterparse(infile, events=("start", "end"))
+        for event, elem in context:
+            name = _localname(elem)
+            if event == "start":
+                if name == "xliff":
+                    xliff = elem
+                elif name == "file":
+                    fileElem = elem
+                elif name == "body":
+                    break
+            elif name == "header":  # "end" event => header is complete
+                header = elem
+        del context
+    return XLIFFHeader(xliff, fileElem, header)
+
+def read_xliff_file_attributes(filename):
+    """
+    Read the attributes of the <file> element (e.g. id, target-language)
+    without parsing the rest of the file.
+    """
+    fileElem = read_xliff_header(filename).file
+    return {} if fileElem is None else dict(fileElem.attrib)
+
+def _serialize_element(elem, nsmap):
+    """
+    Serialize an element (without its tail) for a document whose root
+    element declares nsmap. lxml declares all namespaces in scope on the
+    serialized element, so the declarations of the root are removed.
+    """
+    data = etree.tostring(elem, encoding="utf-8", with_tail=False)
+    tagEnd = data.index(b">")
+    startTag = data[:tagEnd]
+    for prefix, uri in nsmap.items():
+        declaration = ' xmlns{}="{}"'.format(":" + prefix if prefix else "",
+                                            escape(uri, {'"': "&quot;"}))
+        startTag = startTag.replace(declaration.encode("utf-8"), b"", 1)
+    return startTag + data[tagEnd:]
+
+def _tag_name(elem):
+    """The qualified tag name as written in the file, e.g. xliff or x:xliff"""
+    localname = _localname(elem)
+    return localname if elem.prefix is None else "{}:{}".format(elem.prefix, localname)
+
+def _start_and_end_tag(elem, nsmap):
+    """Serialize the start & end tag of an element (without its children)"""
+    shallow = etree.Element(elem.tag, dict(elem.attrib), nsmap=elem.nsmap)
+    startTag = _serialize_element(shallow, nsmap)
+    # Empty elements are serialized as <tag/>
+    startTag = startTag[:-2] + b">"
+    return startTag, "</{}>".format(_tag_name(elem)).encode("utf-8")
+
+class XLIFFWriter(object):
+    """
+    Incrementally writes a XLIFF file which contains only the units
+    passed to write(). The <xliff>/<file> elements and the <header>
+    are copied from the input file.
+
+    Units are copied from the input file as well (including all attributes
+    and inline markup), except for their notes. The input file is streamed
+    alongside, so units must be written in the order of the input file.
+    The target of a written unit is replaced by the translation.
+
+    The output is written to a temporary file which replaces the output file
+    once the writer is closed, so no file is created if nothing is written.
+    If an exception occurs inside the with block, the partial output is deleted.
+    No document tree is held in memory.
+
+    Use as context manager:
+        with XLIFFWriter(infilename, outfilename) as writer:
+            writer.write(entry, "translated string")
+    """
+    def __init__(self, infilename, outfilename):
+        self.infilename = infilename
+        self.outfilename = outfilename
+        self.count = 0
+        self._outfile = None
+        self._tmpname = None
+        self._endTags = None
+        self._nsmap = None
+        self._stack = None
+        self._units = None
+
+    def _open(self):
+        hdr = read_xliff_header(self.infilename)
+        self._nsmap = hdr.xliff.nsmap
+        directory = os.path.dirname(self.outfilename) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, self._tmpname = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        self._outfile = os.fdopen(fd, "wb")
+        self._outfile.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+        # The root element declares the namespaces for the whole file
+        endTags = []
+        for elem, nsmap in ((hdr.xliff, {}), (hdr.file, self._nsmap)):
+            startTag, endTag = _start_and_end_tag(elem, nsmap)
+            self._outfile.write(startTag)
+            endTags.append(endTag)
+        if hdr.header is not None:
+            self._outfile.write(_serialize_element(hdr.header, self._nsmap))
+        body = etree.QName(hdr.xliff).namespace
+        body = "body" if body is None else "{%s}body" % body
+        startTag, endTag = _start_and_end_tag(etree.Element(body, nsmap=self._nsmap), self._nsmap)
+        self._outfile.write(startTag + b"\n")
+        endTags.append(endTag)
+        self._endTags = endTags[::-1]
+        # Stream the units of the input file
+        self._stack = contextlib.ExitStack()
+        infile = self._stack.enter_context(open_cache_file(self.infilename))
+        self._units = etree.iterparse(infile, events=("end",), tag="{*}trans-unit", huge_tree=True)
+
+    def _find_unit(self, unitId):
+        """Advance the input file to the next unit with the given ID"""
+        for _, trans_unit in self._units:
+            if trans_unit.get("id") == unitId:
+                return trans_unit
+            _free_element(trans_unit)
+        raise ValueError("Unit {} not found in {} (units must be written in file order)".format(
+            unitId, self.infilename))
+
+    def write(self, entry, translated):
+        """Write the unit of an entry with the given translation"""
+        if self._outfile is None:
+            self._open()
+        trans_unit = self._find_unit(entry.id)
+        # Remove the notes & the whitespace between the elements to save space
+        trans_unit.text = None
+        for child in list(trans_unit):
+            if _is_element(child) and _localname(child) == "note":
+                trans_unit.remove(child)
+            else:
+                child.tail = None
+        for child in trans_unit:
+            if _is_element(child) and _localname(child) == "target":
+                for subelem in list(child):
+                    child.remove(subelem)
+                child.set("state", "translated")
+                child.text = translated
+        self._outfile.write(_serialize_element(trans_unit, self._nsmap) + b"\n")
+        _free_element(trans_unit)
+        self.count += 1
+
+    def close(self, discard=False):
+        """Finish the output file. If discard is set, delete the partial output instead."""
+        if self._stack is not None:
+            self._stack.close()
+            self._stack = self._units = None
+        if self._outfile is None:
+            return
+        try:
+            if not discard:
+                self._outfile.write(b"".join(self._endTags) + b"\n")
+            self._outfile.close()
+        except:
+            discard = True
+            raise
+        finally:
+            self._outfile = None
+            if discard:
+                os.remove(self._tmpname)
+            else:
+                os.replace(self._tmpname, self.outfilename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close(discard=exc_type is not None)
+
+def process_xliff_entries(filename, autotranslator, indexer, writer=None, autotranslate=True, preindex=False, overwrite=False):
     """
-    Remove both untranslated and notes from the given soup.
-    For the untranslated elements, in
+    Index all strings of the given XLIFF file and autotranslate
+    the untranslated ones.
+
+    Autotranslated units are written to the given XLIFFWriter
+    as soon as they are translated.
+
+    Returns the number of autotranslated strings
     """
     overall_count = 0
     untranslated_count = 0
     translated_count = 0
     autotranslated_count = 0
-    # Iterate over all translatable strings
-    body = soup.xliff.file.body
-
-    # Resulting elements
-    results = []
 
     indexFN = indexer.preindex if preindex else indexer.add
 
-    for trans_unit in body.children: #body.find_all("trans-unit"):
-        # Ignore strings
-        if not isinstance(trans_unit, bs4.element.Tag):
-            continue
-
-        # Ignore other tags
-        if trans_unit.name != "trans-unit":
-            print("Encountered wrong tag: {}".format(trans_unit.name))
-            continue
-
+    # Iterate over all translatable strings
+    for entry in stream_xliff_entries(filename):
         overall_count += 1
-        source = trans_unit.source
-        target = trans_unit.target
-        # Broken XLIFF?
-        if target is None:
-            print(trans_unit.prettify())
-            continue
-        note = trans_unit.note
-        is_untranslated = ("state" in target.attrs and target["state"] == "needs-translation")
-        is_approved = ("approved" in trans_unit.attrs and trans_unit["approved"] == "yes")
 
-        can_overwrite = not is_untranslated and not is_approved
+        can_overwrite = not entry.is_untranslated and not entry.is_approved
         will_overwrite = overwrite and can_overwrite
 
-        engl = source.text
-        translated = target.text
+        engl = entry.english
         # Index tags in the indexer (e.g. to extract text tags)
         # This is done even if they are translated
         # NOTE: This does index or preindex (chosen outside of the loop)
-        indexFN(engl, None if is_untranslated else translated, filename=filename)
+        indexFN(engl, None if entry.is_untranslated else entry.translated, filename=filename)
 
         # For indexing run, ignore autotranslator altogether
         if not autotranslate and not will_overwrite:
-            trans_unit.decompose()
             continue
 
-        # Remove entire tag if translated (or suggested)
-        if not is_untranslated and not will_overwrite:
-            trans_unit.decompose()
+        # Ignore if translated (or suggested)
+        if not entry.is_untranslated and not will_overwrite:
             translated_count += 1
             continue  # Dont try to autotranslate etc
 
         untranslated_count += 1
-        # Remove HUGE note text to save space
-        if note:
-            note.decompose()
-        # Remove empty text inside the <trans-unit> element to save space
-        for c in trans_unit.contents:
-            c.extract()
 
         # Now we can try to autotranslate
         try:
@@ -130,19 +550,9 @@ def process_xliff_soup(filename, soup, autotranslator, indexer, autotranslate=Tr
             traceback.print_exception(*sys.exc_info())
             autotrans = None
 
-        if autotrans is None:  # Could not translate
-            # Remove from output file to conserve space
-            trans_unit.decompose()
-        else:  # Could autotranslate
-            # Store autotranslation in XML
-            target["state"] = "translated"
-            target.string = autotrans
+        if autotrans is not None and writer is not None:  # Could autotranslate
+            writer.write(entry, autotrans)
             autotranslated_count += 1
-            # Add to result list
-            results.append(trans_unit.extract())
-
-    # Remove empty text content of the body to conserve spce
-    body.contents = results
 
     # Print stats
     if autotranslate:
@@ -154,23 +564,18 @@ def process_xliff_soup(filename, soup, autotranslator, indexer, autotranslate=Tr
             "Preindexed" if preindex else "Indexed",
             overall_count, os.path.basename(filename))))
 
-
     return autotranslated_count
 
 def readAndProcessXLIFF(lang, filename, fileid, indexer, autotranslator, upload=False, approve=False, autotranslate=True, preindex=False, overwrite=False, fullauto_account=False):
-    soup = parse_xliff_file(filename)
-    autotranslated_count = process_xliff_soup(filename, soup, autotranslator, indexer, autotranslate=autotranslate, preindex=preindex, overwrite=overwrite)
-    # If we are not autotranslating, stop here, no need to export
+    # If we are not autotranslating, there is nothing to export
     if not autotranslate:
+        process_xliff_entries(filename, autotranslator, indexer, autotranslate=False, preindex=preindex, overwrite=overwrite)
         return 0
-    # Export XLIFF
+    # Autotranslated strings are exported while processing
     outdir = "output-{}".format(lang)
-    outfilename = filename.replace("cache/{}".format(lang), outdir)
-    # Create directories & export
-    if autotranslated_count > 0:
-        os.makedirs(os.path.dirname(outfilename), exist_ok=True)
-        #print(black("Exporting to {}".format(outfilename), bold=True))
-        export_xliff_file(soup, outfilename)
+    outfilename = strip_compression_suffix(filename).replace("cache/{}".format(lang), outdir)
+    with XLIFFWriter(filename, outfilename) as writer:
+        autotranslated_count = process_xliff_entries(filename, autotranslator, indexer, writer, overwrite=overwrite)
     # Upload if enabled
     if upload and autotranslated_count > 0:
         basename = os.path.basename(filename)
@@ -243,6 +648,18 @@ def autotranslate_xliffs(args):
 
     xliffs = findXLIFFFiles("cache/{}".format(args.language), filt=args.filter)
 
+    # Plan using the file catalogue: Largest files first
+    catalog = FileCatalog(args.language)
+    if not args.index and not args.overwrite:
+        # Fully translated files have nothing to autotranslate
+        skipped = [filename for filename in xliffs if catalog.is_fully_translated(filename)]
+        for filename in skipped:
+            del xliffs[filename]
+        if skipped:
+            print(black("Skipping {} fully translated files".format(len(skipped)), bold=True))
+    xliffs = collections.OrderedDict((filename, xliffs[filename])
+                                     for filename in catalog.largest_first(xliffs))
+
     if args.index:
         # Two pass: First preindex then
         # See IgnoreFormulaPatternIndex for reason
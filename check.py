@@ -20,9 +20,12 @@ import glob
 import urllib
 import shutil
 import datetime
+import time
 import functools
 import concurrent.futures
 import collections
+import threading
+import array
 from XLIFFReader import *
 from toolz.dicttoolz import valfilter, merge, merge_with, keyfilter, valmap
 from toolz.itertoolz import groupby, reduceby
@@ -32,8 +35,15 @@ from UpdateAllFiles import get_translation_urls
 from Rules import Severity, importRulesForLanguage
 from LintReport import readAndMapLintEntries, NoResultException
 from AutoTranslateCommon import to_crowdin_search_string
-
-XLIFFEntry = collections.namedtuple("XLIFFEntry", ["id", "english", "translated", "is_untranslated", "note"])
+from Corpus import open_corpus, CorpusNote
+from Catalog import FileCatalog
+from HitExport import ParquetHitWriter
+from RuleHitCache import RuleHitCache
+from ArrowEngine import compute_vector_matches
+from WordIndex import compute_msgid_matches, open_word_index
+from TrigramIndex import compute_trigram_matches, open_trigram_index
+from RuleEngine import RuleEvaluator, content_fingerprints, diff_rule_sets, evaluate_file, evaluate_file_in_worker, init_worker, serialize_rules
+from CacheStorage import list_cache_files, strip_compression_suffix
 
 def writeToFile(filename, s):
     "Utility function to write a string to a file identified by its filename"
@@ -52,35 +62,154 @@ def findPOFiles(directory):
     if os.path.isfile(directory): #Single file>=
         poFilenames = [directory]
     else:
-        poFilenames = []
-        #Recursively iterate directory, ignore everythin except *.po
-        for (curdir, _, files) in os.walk(directory):
-            for f in files:
-                #Ignore non-PO files
-                if not f.endswith(".po") and not f.endswith(".pot"): continue
-                #Add to list of files to process
-                poFilenames.append(os.path.join(curdir, f))
+        #Recursively iterate directory (or its pack), ignore everything except *.po
+        poFilenames = list_cache_files(directory, ".po", ".pot")
     return poFilenames
 
 _multiSpace = re.compile(r"\s+")
 
+class NoteTable(object):
+    """
+    Stores every distinct note (tcomment) of a render output once.
+    Hits refer to their note by the ID (index) in the table.
+    ID 0 is the empty note.
+    """
+    def __init__(self):
+        self.notes = [""]
+        self._ids = {"": 0} # note or CorpusNote key => ID
+        self._lock = threading.Lock()
+
+    def add(self, note):
+        """Get the ID of a note (str or CorpusNote), adding it if required"""
+        if not note:
+            return 0
+        key = note.key if isinstance(note, CorpusNote) else note
+        with self._lock:
+            noteId = self._ids.get(key)
+            if noteId is None:
+                # Only decoded if not known yet
+                text = str(note)
+                noteId = self._ids.get(text)
+                if noteId is None:
+                    noteId = len(self.notes)
+                    self.notes.append(text)
+                    self._ids[text] = noteId
+                self._ids[key] = noteId
+            return noteId
+
+class HitEntryStore(object):
+    """
+    Compact, array-backed storage of the entries which have at least one hit.
+    Entries are referred to by their integer ID (index), the file
+    and the note are stored as IDs as well.
+    """
+    def __init__(self, notes):
+        self.notes = notes
+        self.ids = []
+        self.english = []
+        self.translated = []
+        self.noteIds = array.array("I")
+        self.fileIds = array.array("I")
+        self.approved = array.array("B")
+        # Relative file paths (interned)
+        self.filenames = []
+        self._fileIds = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def file_id(self, relpath):
+        """Get the ID of a relative file path, adding it if required"""
+        with self._lock:
+            fileId = self._fileIds.get(relpath)
+            if fileId is None:
+                fileId = len(self.filenames)
+                self.filenames.append(relpath)
+                self._fileIds[relpath] = fileId
+            return fileId
+
+    def add(self, entry, fileId):
+        """Add a XLIFFEntry and return its ID"""
+        noteId = self.notes.add(entry.note)
+        with self._lock:
+            self.ids.append(entry.id)
+            self.english.append(entry.english)
+            self.translated.append(entry.translated)
+            self.noteIds.append(noteId)
+            self.fileIds.append(fileId)
+            self.approved.append(entry.is_approved)
+            return len(self.ids) - 1
+
+    def __getitem__(self, entryId):
+        """Get the XLIFFEntry for an entry ID. The note is the note ID"""
+        return XLIFFEntry(self.ids[entryId], self.english[entryId], self.translated[entryId],
+            False, bool(self.approved[entryId]), self.noteIds[entryId])
+
+    def filename(self, entryId):
+        return self.filenames[self.fileIds[entryId]]
+
+class RuleHit(object):
+    """
+    A single hit of a rule. The entry is referred to by its HitEntryStore ID.
+    Images are tuples (empty lists are not stored).
+    """
+    __slots__ = ["entryId", "hit", "origImages", "translatedImages"]
+
+    def __init__(self, entryId, hit, origImages=(), translatedImages=()):
+        self.entryId = entryId
+        self.hit = hit
+        self.origImages = origImages
+        self.translatedImages = translatedImages
+
 class JSONHitRenderer(object):
     """
     A state container for the code which applies rules and generates HTML.
     """
-    def __init__(self, outdir, lang="de", num_processes=2):
+    def __init__(self, outdir, lang="de", num_processes=2, corpus=None, parquet=False, process_pool=False, hit_cache=None, arrow=False, word_index=False, trigram_index=False, verify_plans=False):
         self.lang = lang
+        # Optional memory-mapped corpus to read the entries from
+        self.corpus = corpus
+        # File catalogue (sizes) for scheduling
+        self.catalog = FileCatalog(lang)
+        # Notes & entries of all hits
+        self.notes = NoteTable()
+        self.entries = HitEntryStore(self.notes)
+        # Repeating hit strings (e.g. "[failed constraint]") are stored once
+        self._hitStrings = {}
         # Create output directory
         self.outdir = os.path.join(outdir, lang)
         os.makedirs(self.outdir, exist_ok=True)
-        # Async executor
-        self.executor = concurrent.futures.ThreadPoolExecutor(num_processes)
         # Load rules for language
         rules, rule_errors = importRulesForLanguage(lang)
         self.rules = sorted(rules, reverse=True)
         self.rule_errors = rule_errors
+        # Optional persistent hit cache (filename given)
+        self.hitCache = None
+        if hit_cache:
+            self.hitCache = RuleHitCache(hit_cache, lang, content_fingerprints(self.rules))
+            self.printRuleSetChanges()
+        # Async executor (see startExecutor())
+        self.num_processes = num_processes
+        self.process_pool = process_pool
+        # Check simple rules column-wise before (see ArrowEngine)
+        self.arrow = arrow
+        # Look up msgid literals of rules in the word index of the corpus (see WordIndex)
+        self.word_index = word_index and corpus is not None
+        # Look up compatibility mode regexes in the trigram index of the corpus (see TrigramIndex)
+        self.trigram_index = trigram_index and corpus is not None
+        # Compare the flattened rule plans with the nested rules (see RulePlan)
+        self.verify_plans = verify_plans
+        # Where the content hits came from (see RuleEvaluator.content_hits)
+        self.evaluationStats = collections.Counter()
         # Get timestamp
-        self.timestamp = datetime.datetime.now().strftime("%y-%m-%d %H:%M:%S")
+        self.renderTime = datetime.datetime.now().replace(microsecond=0)
+        self.timestamp = self.renderTime.strftime("%y-%m-%d %H:%M:%S")
+        # Optional columnar export of all hits, written while computing
+        self.parquetWriter = None
+        if parquet:
+            self.parquetWriter = ParquetHitWriter(
+                os.path.join(self.outdir, "hits.parquet"), lang, self.renderTime)
         # Process lastdownload date (copied to the templated)
         lastdownloadPath = os.path.join("cache", "lastdownload-{}.txt".format(lang))
         if os.path.isfile(lastdownloadPath):
@@ -91,44 +220,76 @@ class JSONHitRenderer(object):
         # Initialize translation ID/URL map
         self.translationURLs = get_translation_urls(lang)
 
+    def printRuleSetChanges(self):
+        """Print the rules which changed since the last run using the hit cache"""
+        previous = self.hitCache.previous_rules()
+        if not previous:
+            return
+        added, changed, removed = diff_rule_sets(previous, [(rule.name, rule.fingerprint) for rule in self.rules])
+        print(black("Rules changed since the last run: {} added, {} changed, {} removed".format(
+            len(added), len(changed), len(removed)), bold=True))
+        for name in added:
+            print(" + {}".format(name))
+        for name in changed:
+            print(" * {}".format(name))
+        for name in removed:
+            print(" - {}".format(name))
+
     def file_relpath(self, filename):
-        return os.path.relpath(filename, os.path.join("cache", self.lang))
+        return os.path.relpath(strip_compression_suffix(filename), os.path.join("cache", self.lang))
+
+    def makeRuleHit(self, entryId, hit, origImages, translatedImages):
+        """Convert a hit yielded by Rule.apply_to_xliff_entry() to a RuleHit"""
+        if isinstance(hit, str):
+            hit = self._hitStrings.setdefault(hit, hit)
+        return RuleHit(entryId, hit, tuple(origImages), tuple(translatedImages))
+
+    def startExecutor(self, ruleMatches=()):
+        """
+        Create the async executor. Worker processes get the compiled rule set
+        once instead of importing the rules for the language again.
+        """
+        if self.process_pool:
+            self.executor = concurrent.futures.ProcessPoolExecutor(self.num_processes, initializer=init_worker,
+                initargs=(serialize_rules(self.rules), self.corpus, self.hitCache, ruleMatches, self.verify_plans))
+        else:
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.num_processes)
+            self.evaluator = RuleEvaluator(self.rules, self.hitCache, ruleMatches, self.verify_plans)
 
-    def computeRuleHits(self, filename):
+    def submitFile(self, filename):
         """
-        Compute all rule hits for a single parsed PO file and return a list of hits
+        Submit the rule evaluation for a single file to the executor.
+        The future's result is passed to mergeFileHits()
         """
         # Compute relative path (which is how Crowin refers to the file)
         relpath = self.file_relpath(filename)
-        # Read XLIFF
-        basename = os.path.basename(filename)
-        soup = parse_xliff_file(filename)
-        try:
-            body = soup.xliff.file.body
-        except AttributeError:
-            print(red("File {} is not valid XLIFF - Ignoring.".format(relpath)))
+        if self.process_pool:
+            return self.executor.submit(evaluate_file_in_worker, filename, relpath)
+        return self.executor.submit(evaluate_file, self.evaluator, filename, relpath, self.corpus)
+
+    def mergeFileHits(self, filename, result):
+        """
+        Store the entries & hits computed by evaluate_file()
+        for a single file and return a list of (relpath, rule, hits)
+        """
+        if result is None: # Invalid file
             return []
-        # Iterate over all translatable strings and apply rule
-        rule_hits = defaultdict(list)
-        print(filename)
-        for trans_unit in body.find_all("trans-unit"):
-            # Extract info
-            source = trans_unit.source
-            target = trans_unit.target
-            # Broken XLIFF entry
-            if source is None or target is None:
-                continue
-            note = "" if trans_unit.note is None  else trans_unit.note.texts
-            # Convert to XLIFF entry
-            is_untranslated = ("state" in target.attrs and target["state"] == "needs-translation")
-            entry = XLIFFEntry(trans_unit["id"], source.text,
-                "" if is_untranslated else target.text,
-                is_untranslated, note)
-            # Apply to rules
-            for rule in self.rules:
-                rule_hits[rule] += list(rule.apply_to_xliff_entry(entry, relpath))
+        relpath = self.file_relpath(filename)
+        fileId = self.entries.file_id(relpath)
+        entries, hits, stats = result
+        self.evaluationStats.update(stats)
+        entryIds = []
+        for entry in entries:
+            # Note key from a worker process
+            if isinstance(entry.note, tuple):
+                entry = entry._replace(note=CorpusNote(self.corpus, entry.note))
+            entryIds.append(self.entries.add(entry, fileId))
+        # Every rule gets a (possibly empty) hit list, so zero-hit rules are in the stats
+        rule_hits = {rule: [] for rule in self.rules}
+        for ruleIdx, entryIdx, hit, origImages, translatedImages in hits:
+            rule_hits[self.rules[ruleIdx]].append(self.makeRuleHit(
+                entryIds[entryIdx], hit, origImages, translatedImages))
         # Convert to list which is easier to process down the chain
-        gc.collect()
         return [
             (relpath, rule, hits)
             for rule, hits in rule_hits.items()
@@ -144,23 +305,70 @@ class JSONHitRenderer(object):
         """
         # Compute dict with sorted & prettified filenames
         self.files = sorted(xliffs.keys())
-        # Add all futures to the executor
-        futures = [self.executor.submit(self.computeRuleHits, filename)
-            for filename in xliffs.keys()]
+        # Add all futures to the executor. Largest files first,
+        # so no large file is left running at the end.
+        filenames = self.catalog.largest_first(xliffs.keys())
+        ruleMatches = []
+        if self.arrow or self.word_index or self.trigram_index:
+            evaluator = RuleEvaluator(self.rules)
+            if self.arrow:
+                ruleMatches.append(compute_vector_matches(evaluator,
+                    [(filename, self.file_relpath(filename)) for filename in filenames], self.corpus))
+            if self.word_index:
+                ruleMatches.append(compute_msgid_matches(open_word_index(self.lang, self.corpus), evaluator))
+            if self.trigram_index:
+                ruleMatches += compute_trigram_matches(open_trigram_index(self.lang, self.corpus), evaluator)
+        self.startExecutor(ruleMatches)
+        futures = {self.submitFile(filename): filename
+            for filename in filenames}
         # Process the results in first-received order. Also keep track of rule performance
         self.fileRuleHits = collections.defaultdict(dict)
         n_finished = 0
+        # For the ETA: Estimate the amount of work by the file size
+        total_size = sum(self.catalog.size(filename) for filename in filenames)
+        finished_size = 0
+        start_time = time.time()
         # Intermediate result storage
         raw_results = collections.defaultdict(dict) # filename -> {rule: result}
         for future in concurrent.futures.as_completed(futures):
             # Extract result
-            for filename, rule, result in future.result():
+            results = self.mergeFileHits(futures[future], future.result())
+            for filename, rule, result in results:
                 self.fileRuleHits[filename][rule] = result
+            # Export as row group
+            if self.parquetWriter is not None and results:
+                self.parquetWriter.add_file(results[0][0], {rule: result for _, rule, result in results},
+                    lambda hit: self.entries.ids[hit.entryId])
             # Track progress
             n_finished += 1
+            finished_size += self.catalog.size(futures[future])
             if n_finished % 1000 == 0:
                 percent_finished = n_finished * 100. / len(futures)
-                print("Rule computation finished {0:.2f} %".format(percent_finished))
+                if finished_size and total_size:
+                    eta = (time.time() - start_time) * (total_size - finished_size) / finished_size
+                    print("Rule computation finished {0:.2f} % (ETA {1:.0f} s)".format(percent_finished, eta))
+                else:
+                    print("Rule computation finished {0:.2f} %".format(percent_finished))
+        # Free the workers
+        self.executor.shutdown()
+        stats = self.evaluationStats
+        unique = stats["evaluated"] + stats["cache"] + stats["partial"]
+        if unique:
+            print(black("{} unique of {} entries (dedup ratio {:.2f}), {} from hit cache, {} partially re-evaluated, {} evaluated".format(
+                unique, stats["entries"], stats["entries"] / unique, stats["cache"], stats["partial"], stats["evaluated"]), bold=True))
+        applications = stats["rules applied"] + stats["rules skipped"]
+        if applications:
+            print(black("Skipped {:.1f} % of {} rule applications which can't hit".format(
+                stats["rules skipped"] * 100. / applications, applications), bold=True))
+        if self.verify_plans:
+            print((red if stats["plan mismatches"] else black)("{} rule applications where the flattened rule plan differs from the nested rule".format(
+                stats["plan mismatches"]), bold=True))
+        if self.hitCache is not None:
+            self.hitCache.record_rules([(rule.name, rule.fingerprint) for rule in self.rules])
+            print(black("Evicted {} old entries from the hit cache".format(self.hitCache.evict()), bold=True))
+            self.hitCache.close()
+        if self.parquetWriter is not None:
+            self.parquetWriter.close()
 
         # Compute total stats by file
         self.statsByFile = {
@@ -211,6 +419,23 @@ class JSONHitRenderer(object):
         }
         writeJSONToFile(os.path.join(self.outdir, "filestats.json"), stats)
 
+    def hitToJSON(self, hit):
+        """
+        Convert a hit to its JSON representation. Instead of the note text
+        (formerly "tcomment"), the hit contains the ID of the note in notes.json
+        """
+        entry = self.entries[hit.entryId]
+        filename = self.entries.filename(hit.entryId)
+        # valfilter: remove empty values for smaller JSON
+        return valfilter(bool, {"msgstr": entry.translated,
+                                "msgid": entry.english,
+                                "noteId": entry.note, # See notes.json
+                                "hit": hit.hit,
+                                "origImages": hit.origImages,
+                                "translatedImages": hit.translatedImages,
+                                "crowdinLink": "{}#{}".format(self.translationURLs[filename], entry.id)
+                                })
+
     def _renderDirectory(self, ruleHits, ruleStats, directory, filename):
         # Generate output HTML for each rule
         for rule, hits in ruleHits.items():
@@ -223,23 +448,15 @@ class JSONHitRenderer(object):
                     "downloadTimestamp": self.downloadTimestamp,
                     "rule": rule.meta_dict,
                     # valfilter: remove empty values for smaller JSON
-                    "hits": [valfilter(bool, {"msgstr": entry.translated,
-                                              "msgid": entry.english,
-                                              "tcomment": entry.note,
-                                              "hit": hit,
-                                              "origImages": origImages,
-                                              "translatedImages": translatedImages,
-                                              "crowdinLink": "{}#{}".format(self.translationURLs[filename], entry.id)
-                                              })
-                             for entry, hit, filename, origImages, translatedImages in hits]
+                    "hits": [self.hitToJSON(hit) for hit in hits]
                 }
                 writeJSONToFile(outfilePathJSON, jsonAPI)
             else:  # Remove file (redirects to 404 file) if there are no exportHitsAsJSON
                 if os.path.isfile(outfilePathJSON):
                     os.remove(outfilePathJSON)
         # Render file index page (no filelist)
-        ruleInfos = [merge(rule.meta_dict, {"num_hits": ruleStats[rule]})
-                     for rule in self.rules if ruleStats[rule] > 0]
+        ruleInfos = [merge(rule.meta_dict, {"num_hits": ruleStats.get(rule, 0)})
+                     for rule in self.rules if ruleStats.get(rule, 0) > 0]
         ruleInfos.sort(key=lambda o: -o["severity"])  # Invert sort order
         js = {
             "pageTimestamp": self.timestamp,
@@ -267,10 +484,12 @@ class JSONHitRenderer(object):
         #####################
         # Compute global hits for every rule
         overview_hits = {
-            rule: list(itertools.chain(*(fileHits[rule] for fileHits in self.fileRuleHits.values())))
+            rule: list(itertools.chain(*(fileHits.get(rule, ()) for fileHits in self.fileRuleHits.values())))
             for rule in self.rules
         }
         self._renderDirectory(overview_hits, self.totalStatsByRule, self.outdir, filename="All files")
+        # Write note table
+        writeJSONToFile(os.path.join(self.outdir, "notes.json"), self.notes.notes)
         # Create rule error file
         writeJSONToFile(os.path.join(self.outdir, "ruleerrors.json"),
                         [err.msg for err in self.rule_errors])
@@ -316,15 +535,35 @@ def performRender(args):
         args.outdir = "output"
     os.makedirs(args.outdir, exist_ok=True)
 
-    renderer = JSONHitRenderer(args.outdir, args.language, args.num_processes)
+    # Use the compacted corpus if requested
+    corpus = None
+    if args.corpus:
+        corpus = open_corpus(args.language)
+        if corpus is None:
+            print(red("No usable corpus for {} - run 'katc.py compact' first. Reading XLIFF files".format(args.language), bold=True))
+    if args.word_index and corpus is None:
+        print(red("The word index requires the corpus (-c) - not using it", bold=True))
+    if args.trigram_index and corpus is None:
+        print(red("The trigram index requires the corpus (-c) - not using it", bold=True))
+
+    renderer = JSONHitRenderer(args.outdir, args.language, args.num_processes,
+                               corpus=corpus, parquet=args.parquet, process_pool=args.process_pool,
+                               hit_cache=args.hit_cache, arrow=args.arrow, word_index=args.word_index,
+                               trigram_index=args.trigram_index, verify_plans=args.verify_plans)
 
-    # Import
-    potDir = os.path.join("cache", args.language)
-    xliffFiles = findXLIFFFiles(potDir, filt=args.filter)
-    print(black("Reading {} files from {} folder...".format(len(xliffFiles), potDir), bold=True))
-    # Compute hits
-    print(black("Computing rules...", bold=True))
-    renderer.computeRuleHitsForFileSet(xliffFiles)
+    try:
+        # Import
+        potDir = os.path.join("cache", args.language)
+        xliffFiles = findXLIFFFiles(potDir, filt=args.filter)
+        print(black("Reading {} files from {} folder...".format(len(xliffFiles), potDir), bold=True))
+        # Compute hits
+        print(black("Computing rules...", bold=True))
+        renderer.computeRuleHitsForFileSet(xliffFiles)
+    except BaseException:
+        # Don't leave a partial Parquet export behind
+        if renderer.parquetWriter is not None:
+            renderer.parquetWriter.abort()
+        raise
 
     # Generate HTML
     print(black("Rendering HTML...", bold=True))
@@ -2,11 +2,10 @@
 from bottle import run, request, response, Bottle, static_file
 import simplejson as json
 import random
-import bs4
 import dbm.dumb as dbm
 from collections import namedtuple, Counter
 from AutoTranslateCommon import transmap_filename
-from XLIFFReader import parse_xliff_file
+from XLIFFReader import iterate_xliff_entries, read_xliff_file_attributes
 
 db = dbm.open("kagame.dbm", flag='c')
 
@@ -21,45 +20,23 @@ stringIDMap = {} # ID => string
 # Client vote counter
 clientVotes = Counter()
 
-def extract_strings_from_xliff_soup(filename, soup):
+def extract_strings_from_xliff(filename):
     """
-    Remove both untranslated and notes from the given soup.
-    For the untranslated elements, in
+    Extract all suggested (i.e. translated but not approved) strings
+    from the given XLIFF file
     """
     results = []
 
     global fileid
     global targetlang
-    fileid = soup.xliff.file.attrs["id"]
-    targetlang = soup.xliff.file.attrs["target-language"].partition("-")[0]
-
-    for trans_unit in soup.xliff.file.body.children: #body.find_all("trans-unit"):
-        # Ignore strings
-        if not isinstance(trans_unit, bs4.element.Tag):
-            continue
-
-        # Ignore other tags
-        if trans_unit.name != "trans-unit":
-            print("Encountered wrong tag: {}".format(trans_unit.name))
-            continue
-
-        source = trans_unit.source
-        target = trans_unit.target
-        # Broken XLIFF?
-        if target is None:
-            print(trans_unit.prettify())
-            continue
-        note = trans_unit.note
-        is_untranslated = ("state" in target.attrs and target["state"] == "needs-translation")
-        is_approved = ("approved" in trans_unit.attrs and trans_unit["approved"] == "yes")
-        strid = trans_unit["id"]
-
-        engl = source.text
-        translated = target.text
+    fileattrs = read_xliff_file_attributes(filename)
+    fileid = fileattrs["id"]
+    targetlang = fileattrs["target-language"].partition("-")[0]
 
+    for entry in iterate_xliff_entries(filename, ignore_untranslated=True):
         # only suggested strings
-        if not is_untranslated and not is_approved:
-            results.append(Translation(strid, engl, translated))
+        if not entry.is_approved:
+            results.append(Translation(entry.id, entry.english, entry.translated))
 
     return results
 
@@ -157,8 +134,7 @@ def run_game_server(args):
     compute_client_vote_count()
     print()
 
-    soup = parse_xliff_file(args.file)
-    availableStrings = extract_strings_from_xliff_soup(args.file, soup)
+    availableStrings = extract_strings_from_xliff(args.file)
     # Remap strings
     stringIDMap = {
         int(ti.id): ti
@@ -6,6 +6,9 @@ from VideoTranslations import updateVideoMap
 from PolyglottIndexer import buildPolyglottIndex
 from XLIFFReader import autotranslate_xliffs
 from game.GameServer import run_game_server
+from Corpus import performCompactCorpus
+from Catalog import performCatalog
+from TrigramIndex import performGrep
 
 if __name__ == "__main__":
     import argparse
@@ -20,6 +23,8 @@ if __name__ == "__main__":
     updateTranslationsCmd.add_argument('-m', '--force-filemap-update', action="store_true", help='Force updating the filemap')
     updateTranslationsCmd.add_argument('-a', '--all-languages', action="store_true", help='Download all languages')
     updateTranslationsCmd.add_argument('-p', '--po', action="store_true", help='Download as PO instead of XLIFF')
+    updateTranslationsCmd.add_argument('-z', '--compress', choices=["gzip", "zstd"], help='Store the downloaded files compressed')
+    updateTranslationsCmd.add_argument('--pack', action="store_true", help='Store the downloaded files in a single pack (cache/<lang>.pack) instead of a directory')
     updateTranslationsCmd.set_defaults(func=updateTranslations)
 
     updateLint = subparsers.add_parser('update-lint')
@@ -49,14 +54,42 @@ if __name__ == "__main__":
     gameServer.set_defaults(func=run_game_server)
 
     render = subparsers.add_parser('render')
-    render.add_argument('-j', '--num-processes', default=2, type=int, help='Number of threads to use for parallel processing')
+    render.add_argument('-j', '--num-processes', default=2, type=int, help='Number of threads (or processes, see -p) to use for parallel processing')
+    render.add_argument('-p', '--process-pool', action='store_true', help='Evaluate the rules in worker processes instead of threads')
     render.add_argument('-d', '--download', action='store_true', help='Download or update the directory')
     render.add_argument('-f', '--filter', nargs="*", action="append", help='Ignore file paths that do not contain this string, e.g. exercises or 2_high_priority. Can use multiple ones which are ANDed')
     render.add_argument('--only-lint', action='store_true', help='Only render the lint hierarchy')
     render.add_argument('--no-lint', action='store_true', help='Do not render the lint hierarchy')
+    render.add_argument('-c', '--corpus', action='store_true', help='Read the strings from the compacted corpus (see compact command)')
+    render.add_argument('-C', '--hit-cache', nargs='?', const="cache/rulehits.sqlite", help='Reuse the rule hits of unchanged strings and rules from previous renders (cache file, default: cache/rulehits.sqlite). Can be on a network filesystem')
+    render.add_argument('-A', '--arrow', action='store_true', help='Check simple regex & substring rules column-wise over all strings before (requires pyarrow)')
+    render.add_argument('-w', '--word-index', action='store_true', help='Only check translation constraint rules on strings containing their trigger word using the word index of the corpus (requires -c)')
+    render.add_argument('-t', '--trigram-index', action='store_true', help='Only check compatibility mode regex rules on candidate strings from the trigram index of the corpus (requires -c)')
+    render.add_argument('--verify-plans', action='store_true', help='Also apply the nested rules and compare their hits with the flattened rule plans (slower, for testing)')
+    render.add_argument('--parquet', action='store_true', help='Also export all hits to <outdir>/<lang>/hits.parquet (requires pyarrow)')
     render.add_argument('outdir', nargs='?', default=None, help='The output directory to use (default: output-<lang>)')
     render.set_defaults(func=performRender)
 
+    compact = subparsers.add_parser('compact')
+    compact.add_argument('-f', '--filter', nargs="*", action="append", help='Ignore file paths that do not contain this string, e.g. exercises or 2_high_priority. Can use multiple ones which are ANDed')
+    compact.set_defaults(func=performCompactCorpus)
+
+    catalog = subparsers.add_parser('catalog')
+    catalog.add_argument('-f', '--filter', nargs="*", action="append", help='Ignore file paths that do not contain this string, e.g. exercises or 2_high_priority. Can use multiple ones which are ANDed')
+    catalog.add_argument('-u', '--untranslated', action="store_true", help='Only list files with untranslated strings')
+    catalog.add_argument('-s', '--sort', default="size", choices=["size", "total", "untranslated", "approved"], help='The column to sort by (descending)')
+    catalog.add_argument('-n', '--limit', type=int, default=0, help='Only list the first N files (0 => all)')
+    catalog.set_defaults(func=performCatalog)
+
+    grep = subparsers.add_parser('grep')
+    grep.add_argument('-l', '--language', default=argparse.SUPPRESS, help='The language to search (same as the generic argument)')
+    grep.add_argument('--msgid', action="store_true", help='Only search the source strings')
+    grep.add_argument('--msgstr', action="store_true", help='Only search the translated strings')
+    grep.add_argument('-i', '--ignore-case', action="store_true", help='Case-insensitive search')
+    grep.add_argument('-n', '--limit', type=int, default=0, help='Only list the first N matches (0 => all)')
+    grep.add_argument('regex', help='The (Python) regular expression to search for')
+    grep.set_defaults(func=performGrep)
+
     index = subparsers.add_parser('index')
     index.add_argument('-t', '--table', type=int, default=1, help='Table offset (where to store the data in YakDB. 1 => production setup)')
     index.set_defaults(func=buildPolyglottIndex)